@@ -1,10 +1,13 @@
 import re
-from django.contrib import admin
+from django.contrib import admin, messages
 from django import forms
 from django.utils.safestring import mark_safe
 from django.utils.translation import gettext_lazy as _
 from django.db.models import Q
 from media.models import Audio, Radio, Tag, Video
+from media.search import filter_search
+from media.stats import get_play_count_subquery, get_since
+from media.tagquery import TagQueryError, compile_tag_query
 
 
 class TagsFilter(admin.RelatedFieldListFilter):
@@ -16,15 +19,16 @@ class TagsFilter(admin.RelatedFieldListFilter):
         return True
 
     def field_choices(self, field, request, model_admin):
-        tag_set = set()
         qs = self.queryset(request, model_admin.get_queryset(request))
         if qs is None:
             return ()
-        for item in qs:
-            if item.tags.count() > 0:
-                v = item.tags.values_list("id", "title")
-                tag_set.update(v)
-        return sorted(tag_set, key=lambda it: it[1])
+        through = field.remote_field.through
+        tag_ids = through.objects.filter(
+            **{f"{field.m2m_field_name()}__in": qs.values("pk")}
+        ).values("tag_id")
+        return list(
+            Tag.objects.filter(id__in=tag_ids).order_by("title").values_list("id", "title")
+        )
 
 
 @admin.register(Tag)
@@ -63,7 +67,8 @@ class MediaAdmin(admin.ModelAdmin):
     form = MediaModelForm
     list_filter = (("tags", TagsFilter),)
     search_fields = ("title",)
-    search_params_ptrn = re.compile(r"(@[A-z_]+:[^;]+;)")
+    # a ";" inside a quoted tag title does not end the parameter
+    search_params_ptrn = re.compile(r'(@[A-z_]+:(?:"(?:[^"\\]|\\.)*"|[^;"])+;)')
 
     def get_search_results(self, request, queryset, search_term):
         m = self.search_params_ptrn.findall(search_term)
@@ -73,14 +78,25 @@ class MediaAdmin(admin.ModelAdmin):
                 search_term = search_term.replace(it, "")
                 name, query = it.lstrip("@").rstrip(";").split(":", 1)
                 if name == "tags":
-                    title_list = [p.strip() for p in query.split(",")]
-                    tags = Tag.objects.filter(title__in=title_list)
-                    for tag in tags:
-                        q |= Q(tags__in=[tag])
-        queryset, use_distinct = super().get_search_results(request, queryset, search_term)
+                    try:
+                        q &= compile_tag_query(self.model, query)
+                    except TagQueryError as e:
+                        self.message_user(request, f"tags: {e}", messages.ERROR)
+                        return queryset.none(), False
+        queryset = filter_search(queryset, search_term)
         queryset = queryset.filter(q)
-        return queryset, use_distinct
+        return queryset, False
     
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request).prefetch_related("tags")
+        return queryset.annotate(
+            week_play_count=get_play_count_subquery(self.model, get_since("day", 7))
+        )
+
+    @admin.display(description=_("plays this week"), ordering="week_play_count")
+    def get_week_play_count(self, media):
+        return media.week_play_count
+
     def get_tags(self, audio):
         return ", ".join(t.title for t in audio.tags.all())
     
@@ -93,7 +109,7 @@ class AudioAdmin(MediaAdmin):
     change_list_template = "media/admin/audio_change_list.html"
     change_form_template = "media/admin/audio_change_form.html"
     model = Audio
-    list_display = ("title", "play", "duration", "get_tags", "updated", "get_file_size")
+    list_display = ("title", "play", "duration", "get_week_play_count", "get_tags", "updated", "get_file_size")
     readonly_fields = ("duration", "file_size", "md5_hex", "updated")
 
     def get_file_size(self, audio):
@@ -116,7 +132,7 @@ class RadioAdmin(MediaAdmin):
     change_list_template = "media/admin/radio_change_list.html"
     change_form_template = "media/admin/radio_change_form.html"
     model = Radio
-    list_display = ("title", "play", "get_tags", "quality", "updated")
+    list_display = ("title", "play", "get_week_play_count", "get_tags", "quality", "updated")
     list_filter = (("tags", TagsFilter), "quality")
     readonly_fields = ("updated",)
     
@@ -126,7 +142,7 @@ class VideoAdmin(MediaAdmin):
     change_list_template = "media/admin/video_change_list.html"
     change_form_template = "media/admin/video_change_form.html"
     model = Video
-    list_display = ("title", "play", "duration", "get_tags", "updated", "get_file_size")
+    list_display = ("title", "play", "duration", "get_week_play_count", "get_tags", "updated", "get_file_size")
     readonly_fields = ("duration", "file_size", "md5_hex", "updated")
 
     def get_file_size(self, audio):
@@ -0,0 +1,178 @@
+import base64
+import json
+from datetime import timedelta
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from django.http.request import HttpRequest
+from django.http.response import JsonResponse
+from django.views import View
+from media.models import Audio, MediaIndex, Radio, Video
+from media.tagquery import TagQueryError, compile_tag_query
+
+
+Media = Audio | Radio | Video | MediaIndex
+
+default_limit = 100
+max_limit = 1000
+
+
+class CursorError(Exception):
+    pass
+
+
+def encode_cursor(values):
+    data = json.dumps(values, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(data).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    try:
+        data = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(data)
+    except ValueError:
+        raise CursorError("bad cursor")
+    if not isinstance(values, list) or len(values) != 2:
+        raise CursorError("bad cursor")
+    return values
+
+
+def to_json_value(value):
+    match value:
+        case timedelta():
+            return value.total_seconds()
+        case _ if hasattr(value, "isoformat"):
+            return value.isoformat()
+        case _:
+            return value
+
+
+class ViewMediaList(View):
+    # Keyset pagination: the cursor holds the (order value, id) of the last
+    # row and the next page continues with a range condition on the
+    # (order field, id) index, so every page costs the same at any depth.
+    # type=all lists every media type at once from MediaIndex.
+    common_fields = ("id", "title", "description", "play_count", "created", "updated", "tags")
+    fields = {
+        "audio": common_fields + ("duration", "file_size"),
+        "radio": common_fields + ("quality",),
+        "video": common_fields + ("duration", "file_size"),
+        "all": (
+            "id", "media_type", "media_id", "title", "duration", "tags", "play_count", "created", "updated"
+        ),
+    }
+    order_fields = {
+        "audio": ("id", "title", "updated", "play_count", "duration"),
+        "radio": ("id", "title", "updated", "play_count"),
+        "video": ("id", "title", "updated", "play_count", "duration"),
+        "all": ("id", "title", "created", "updated", "play_count", "duration"),
+    }
+
+    def get(self, request: HttpRequest) -> JsonResponse:
+        media_type = request.GET.get("type", "all")
+        if media_type not in self.fields:
+            return JsonResponse(dict(error="unknown type"), status=400)
+        media_class = self.get_media_class(media_type)
+        fields = request.GET.get("fields", "id,title").split(",")
+        order = request.GET.get("order", "id")
+        limit = request.GET.get("limit", str(default_limit))
+        if any(field not in self.fields[media_type] for field in fields):
+            return JsonResponse(dict(error="unknown field"), status=400)
+        if order.lstrip("-") not in self.order_fields[media_type]:
+            return JsonResponse(dict(error="unknown order"), status=400)
+        if not limit.isdigit() or not 0 < int(limit) <= max_limit:
+            return JsonResponse(dict(error="bad limit"), status=400)
+        limit = int(limit)
+        queryset = media_class.objects.all()
+        tags = request.GET.get("tags")
+        if tags and media_class is MediaIndex:
+            return JsonResponse(dict(error="tags needs a media type"), status=400)
+        if tags:
+            try:
+                queryset = queryset.filter(compile_tag_query(media_class, tags))
+            except TagQueryError as e:
+                return JsonResponse(dict(error=f"tags: {e}"), status=400)
+        cursor = request.GET.get("cursor")
+        if cursor:
+            try:
+                queryset = queryset.filter(self.get_cursor_filter(media_class, order, cursor))
+            except (CursorError, TypeError, ValueError, ValidationError):
+                return JsonResponse(dict(error="bad cursor"), status=400)
+        order_field = order.lstrip("-")
+        id_order = "-id" if order.startswith("-") else "id"
+        ordering = (id_order,) if order_field == "id" else (order, id_order)
+        # the order field and id are always selected to build the next cursor
+        # MediaIndex.tags is a column, media tags are fetched separately
+        related_tags = "tags" in fields and media_class is not MediaIndex
+        columns = [field for field in fields if field != "tags" or not related_tags]
+        columns = list(dict.fromkeys(columns + [order_field, "id"]))
+        order_index, id_index = columns.index(order_field), columns.index("id")
+        rows = list(queryset.order_by(*ordering).values_list(*columns)[: limit + 1])
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor([to_json_value(rows[-1][order_index]), rows[-1][id_index]])
+        tag_ids = {}
+        if related_tags:
+            tag_ids = self.get_tag_ids(media_class, [row[id_index] for row in rows])
+        indexes = [None if field not in columns else columns.index(field) for field in fields]
+        return JsonResponse(
+            dict(
+                fields=fields,
+                rows=[
+                    [
+                        tag_ids.get(row[id_index], []) if index is None else to_json_value(row[index])
+                        for index in indexes
+                    ]
+                    for row in rows
+                ],
+                next=next_cursor,
+            )
+        )
+
+    def get_cursor_filter(self, media_class: type[Media], order: str, cursor: str) -> Q:
+        value, last_id = decode_cursor(cursor)
+        last_id = int(last_id)
+        order_field = order.lstrip("-")
+        lookup = "lt" if order.startswith("-") else "gt"
+        if order_field == "id":
+            return Q(**{f"id__{lookup}": last_id})
+        # SQLite sorts NULL (the duration of radios in MediaIndex) first, so
+        # NULL rows come before every value and after every value descending
+        is_null = Q(**{f"{order_field}__isnull": True})
+        if value is None:
+            after = is_null & Q(**{f"id__{lookup}": last_id})
+            return after if order.startswith("-") else after | ~is_null
+        if order_field == "duration":
+            value = timedelta(seconds=value)
+        field = media_class._meta.get_field(order_field)
+        value = field.to_python(value)
+        # "field >= value" keeps the (field, id) index range usable, the OR
+        # only breaks ties between rows with the same value
+        condition = Q(**{f"{order_field}__{lookup}e": value}) & (
+            Q(**{f"{order_field}__{lookup}": value}) | Q(**{f"id__{lookup}": last_id})
+        )
+        if order.startswith("-") and field.null:
+            condition |= is_null
+        return condition
+
+    def get_tag_ids(self, media_class: type[Media], media_ids: list[int]) -> dict[int, list[int]]:
+        column = f"{media_class._meta.model_name}_id"
+        tag_ids = {}
+        for media_id, tag_id in media_class.tags.through.objects.filter(
+            **{f"{column}__in": media_ids}
+        ).values_list(column, "tag_id"):
+            tag_ids.setdefault(media_id, []).append(tag_id)
+        return tag_ids
+
+    def get_media_class(self, media_type: str | None) -> type[Media]:
+        match media_type:
+            case "audio":
+                return Audio
+            case "radio":
+                return Radio
+            case "video":
+                return Video
+            case "all":
+                return MediaIndex
+            case _:
+                raise NotImplementedError()
@@ -1,6 +1,14 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
 
 
 class MediaConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "media"
+
+    def ready(self):
+        from media.db import apply_sqlite_pragmas
+        from media.templatetags.md5static import StaticUrlCache
+
+        connection_created.connect(apply_sqlite_pragmas, dispatch_uid="media_sqlite_pragmas")
+        StaticUrlCache.load_manifest()
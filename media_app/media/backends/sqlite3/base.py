@@ -0,0 +1,15 @@
+from django.db.backends.sqlite3 import base
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    # set by media.db.write_atomic() around the BEGIN of its block
+    begin_immediate = False
+
+    def _start_transaction_under_autocommit(self):
+        # A deferred BEGIN that reads first and writes later cannot wait for
+        # the write lock, it fails at once with "database is locked" when
+        # another connection writes. IMMEDIATE waits busy_timeout instead.
+        if self.begin_immediate:
+            self.cursor().execute("BEGIN IMMEDIATE")
+        else:
+            super()._start_transaction_under_autocommit()
@@ -0,0 +1,530 @@
+import os
+import struct
+from typing import NamedTuple
+
+
+head_size = 64 * 1024
+tail_size = 64 * 1024
+
+
+class ContainerError(Exception):
+    pass
+
+
+class ContainerInfo(NamedTuple):
+    format_name: str
+    media_type: str
+    duration: float | None
+    audio_codec: str = ""
+    sample_rate: int | None = None
+    channels: int | None = None
+    bit_rate: int | None = None
+    video_codec: str = ""
+    width: int | None = None
+    height: int | None = None
+
+
+def read_container_info(path):
+    # None means the format is not recognized (or the header is damaged) and
+    # the caller should fall back to ffprobe
+    try:
+        with open(path, "rb") as file:
+            head = file.read(head_size)
+            size = os.fstat(file.fileno()).st_size
+            for parser in container_parsers:
+                file.seek(0)
+                info = parser(file, head, size)
+                if info is None:
+                    continue
+                if info.bit_rate is None and info.duration:
+                    info = info._replace(bit_rate=int(size * 8 / info.duration))
+                return info
+    except (ContainerError, struct.error, ValueError, IndexError, OSError):
+        return None
+    return None
+
+
+def read_at(file, offset, length):
+    # a damaged size field must not allocate a huge buffer
+    if offset < 0 or offset + length > os.fstat(file.fileno()).st_size:
+        raise ContainerError("unexpected end of file")
+    file.seek(offset)
+    data = file.read(length)
+    if len(data) < length:
+        raise ContainerError("unexpected end of file")
+    return data
+
+
+# MP3
+
+mpeg_bit_rates = {
+    (1, 1): (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+    (1, 2): (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+    (1, 3): (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    (2, 1): (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+    (2, 2): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    (2, 3): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+mpeg_sample_rates = {1: (44100, 48000, 32000), 2: (22050, 24000, 16000), 25: (11025, 12000, 8000)}
+
+
+def parse_mpeg_frame_header(data, offset):
+    if offset + 4 > len(data):
+        return None
+    b1, b2, b3 = data[offset + 1], data[offset + 2], data[offset + 3]
+    if data[offset] != 0xFF or b1 & 0xE0 != 0xE0:
+        return None
+    version = {3: 1, 2: 2, 0: 25}.get((b1 >> 3) & 0x03)
+    layer = {3: 1, 2: 2, 1: 3}.get((b1 >> 1) & 0x03)
+    bit_rate_index = b2 >> 4
+    sample_rate_index = (b2 >> 2) & 0x03
+    if version is None or layer is None or bit_rate_index in (0, 15) or sample_rate_index == 3:
+        return None
+    bit_rate = mpeg_bit_rates[(min(version, 2), layer)][bit_rate_index] * 1000
+    sample_rate = mpeg_sample_rates[version][sample_rate_index]
+    padding = (b2 >> 1) & 0x01
+    channels = 1 if b3 >> 6 == 3 else 2
+    if layer == 1:
+        samples = 384
+        frame_length = (12 * bit_rate // sample_rate + padding) * 4
+    else:
+        samples = 1152 if layer == 2 or version == 1 else 576
+        frame_length = samples // 8 * bit_rate // sample_rate + padding
+    return dict(
+        version=version, layer=layer, bit_rate=bit_rate, sample_rate=sample_rate,
+        channels=channels, samples=samples, frame_length=frame_length,
+    )
+
+
+def parse_mp3(file, head, size):
+    start = 0
+    if head[:3] == b"ID3":
+        tag_size = (head[6] << 21) | (head[7] << 14) | (head[8] << 7) | head[9]
+        start = 10 + tag_size + (10 if head[5] & 0x10 else 0)
+        if start + 4 > size:
+            raise ContainerError("ID3 tag without audio")
+        head = read_at(file, start, min(head_size, size - start))
+    elif head[:2] not in (b"\xff\xfb", b"\xff\xfa", b"\xff\xf3", b"\xff\xf2", b"\xff\xe3", b"\xff\xe2"):
+        return None
+    offset = 0
+    while offset < len(head) - 4:
+        frame = parse_mpeg_frame_header(head, offset)
+        if frame is not None:
+            following = parse_mpeg_frame_header(head, offset + frame["frame_length"])
+            if following is not None or offset + frame["frame_length"] >= len(head):
+                break
+        offset += 1
+    else:
+        return None
+    audio_start = start + offset
+    frame_data = head[offset:]
+    if frame["version"] == 1:
+        side_info = 17 if frame["channels"] == 1 else 32
+    else:
+        side_info = 9 if frame["channels"] == 1 else 17
+    frame_count = None
+    xing = frame_data[4 + side_info:4 + side_info + 12]
+    if xing[:4] in (b"Xing", b"Info"):
+        flags = struct.unpack(">I", xing[4:8])[0]
+        if flags & 0x01:
+            frame_count = struct.unpack(">I", xing[8:12])[0]
+    elif frame_data[36:40] == b"VBRI":
+        frame_count = struct.unpack(">I", frame_data[50:54])[0]
+    audio_end = size
+    if size >= 128 and read_at(file, size - 128, 3) == b"TAG":
+        audio_end -= 128
+    if frame_count:
+        duration = frame_count * frame["samples"] / frame["sample_rate"]
+        bit_rate = int((audio_end - audio_start) * 8 / duration) if duration else frame["bit_rate"]
+    else:
+        bit_rate = frame["bit_rate"]
+        duration = (audio_end - audio_start) * 8 / bit_rate
+    return ContainerInfo(
+        format_name="mp3",
+        media_type="audio",
+        duration=duration,
+        audio_codec="mp3" if frame["layer"] == 3 else f"mp{frame['layer']}",
+        sample_rate=frame["sample_rate"],
+        channels=frame["channels"],
+        bit_rate=bit_rate,
+    )
+
+
+# FLAC
+
+def parse_flac(file, head, size):
+    if head[:4] != b"fLaC":
+        return None
+    block_type = head[4] & 0x7F
+    if block_type != 0:
+        raise ContainerError("STREAMINFO is not the first metadata block")
+    return parse_flac_streaminfo(head[8:42])
+
+
+def parse_flac_streaminfo(data):
+    packed = int.from_bytes(data[10:18], "big")
+    sample_rate = packed >> 44
+    channels = ((packed >> 41) & 0x07) + 1
+    total_samples = packed & 0xFFFFFFFFF
+    if sample_rate == 0:
+        raise ContainerError("invalid sample rate")
+    return ContainerInfo(
+        format_name="flac",
+        media_type="audio",
+        duration=total_samples / sample_rate if total_samples else None,
+        audio_codec="flac",
+        sample_rate=sample_rate,
+        channels=channels,
+    )
+
+
+# Ogg (Vorbis, Opus, FLAC, Theora)
+
+def iter_ogg_bos_packets(head):
+    offset = 0
+    while head[offset:offset + 4] == b"OggS" and head[offset + 5] & 0x02:
+        segment_count = head[offset + 26]
+        body = offset + 27 + segment_count
+        body_size = sum(head[offset + 27:body])
+        yield head[offset + 14:offset + 18], head[body:body + body_size]
+        offset = body + body_size
+
+
+def parse_ogg_audio_packet(packet):
+    # returns (info, pre_skip, granule_rate)
+    if packet[:7] == b"\x01vorbis":
+        channels = packet[11]
+        sample_rate = struct.unpack("<I", packet[12:16])[0]
+        return ContainerInfo("ogg", "audio", None, "vorbis", sample_rate, channels), 0, sample_rate
+    if packet[:8] == b"OpusHead":
+        channels = packet[9]
+        pre_skip = struct.unpack("<H", packet[10:12])[0]
+        sample_rate = struct.unpack("<I", packet[12:16])[0]
+        return ContainerInfo("ogg", "audio", None, "opus", sample_rate, channels), pre_skip, 48000
+    if packet[:5] == b"\x7fFLAC":
+        info = parse_flac_streaminfo(packet[17:51])._replace(format_name="ogg", duration=None)
+        return info, 0, info.sample_rate
+    return None, 0, 0
+
+
+def parse_ogg(file, head, size):
+    if head[:4] != b"OggS":
+        return None
+    audio = None
+    video = None
+    for serial, packet in iter_ogg_bos_packets(head):
+        if packet[:7] == b"\x80theora" and video is None:
+            video = ContainerInfo(
+                "ogg", "video", None,
+                video_codec="theora",
+                width=int.from_bytes(packet[14:17], "big"),
+                height=int.from_bytes(packet[17:20], "big"),
+            )
+        elif audio is None:
+            info, pre_skip, granule_rate = parse_ogg_audio_packet(packet)
+            if info is not None:
+                audio = (serial, info, pre_skip, granule_rate)
+    if audio is None:
+        return video
+    serial, info, pre_skip, granule_rate = audio
+    if video is not None:
+        info = video._replace(
+            audio_codec=info.audio_codec, sample_rate=info.sample_rate, channels=info.channels
+        )
+    tail_start = max(0, size - tail_size)
+    tail = read_at(file, tail_start, size - tail_start)
+    granule = None
+    position = tail.rfind(b"OggS")
+    while position >= 0:
+        if tail[position + 14:position + 18] == serial:
+            value = struct.unpack("<q", tail[position + 6:position + 14])[0]
+            if value >= 0:
+                granule = value
+                break
+        position = tail.rfind(b"OggS", 0, position)
+    if granule is None or not granule_rate:
+        return info
+    return info._replace(duration=max(granule - pre_skip, 0) / granule_rate)
+
+
+# WAV and AVI
+
+def iter_riff_chunks(file, offset, end):
+    while offset + 8 <= end:
+        chunk_id, chunk_size = struct.unpack("<4sI", read_at(file, offset, 8))
+        yield chunk_id, offset + 8, chunk_size
+        offset += 8 + chunk_size + (chunk_size & 1)
+
+
+def parse_riff(file, head, size):
+    if head[:4] != b"RIFF":
+        return None
+    end = min(size, 8 + struct.unpack("<I", head[4:8])[0])
+    match head[8:12]:
+        case b"WAVE":
+            return parse_wav(file, end)
+        case b"AVI ":
+            return parse_avi(file, end)
+    return None
+
+
+def parse_wav(file, end):
+    fmt = None
+    data_size = None
+    for chunk_id, offset, chunk_size in iter_riff_chunks(file, 12, end):
+        if chunk_id == b"fmt ":
+            fmt = struct.unpack("<HHII", read_at(file, offset, 12))
+        elif chunk_id == b"data":
+            data_size = min(chunk_size, end - offset)
+            break
+    if fmt is None:
+        raise ContainerError("missing fmt chunk")
+    format_tag, channels, sample_rate, byte_rate = fmt
+    return ContainerInfo(
+        format_name="wav",
+        media_type="audio",
+        duration=data_size / byte_rate if data_size is not None and byte_rate else None,
+        audio_codec="pcm" if format_tag in (1, 0xFFFE) else f"wav_{format_tag:#x}",
+        sample_rate=sample_rate,
+        channels=channels,
+        bit_rate=byte_rate * 8,
+    )
+
+
+def parse_avi(file, end):
+    for chunk_id, offset, chunk_size in iter_riff_chunks(file, 12, end):
+        if chunk_id == b"LIST" and read_at(file, offset, 4) == b"hdrl":
+            for sub_id, sub_offset, _ in iter_riff_chunks(file, offset + 4, offset + chunk_size):
+                if sub_id == b"avih":
+                    avih = struct.unpack("<10I", read_at(file, sub_offset, 40))
+                    micro_sec_per_frame, total_frames = avih[0], avih[4]
+                    return ContainerInfo(
+                        format_name="avi",
+                        media_type="video",
+                        duration=micro_sec_per_frame * total_frames / 1000000 or None,
+                        width=avih[8],
+                        height=avih[9],
+                    )
+    raise ContainerError("missing avih header")
+
+
+# MP4 / M4A / MOV
+
+mp4_containers = (b"moov", b"trak", b"mdia", b"minf", b"stbl")
+
+
+def iter_mp4_boxes(file, offset, end):
+    while offset + 8 <= end:
+        box_size, box_type = struct.unpack(">I4s", read_at(file, offset, 8))
+        header_size = 8
+        if box_size == 1:
+            box_size = struct.unpack(">Q", read_at(file, offset + 8, 8))[0]
+            header_size = 16
+        elif box_size == 0:
+            box_size = end - offset
+        if box_size < header_size:
+            raise ContainerError("invalid box size")
+        yield box_type, offset + header_size, offset + box_size
+        offset += box_size
+
+
+def parse_mp4(file, head, size):
+    if head[4:8] != b"ftyp":
+        return None
+    for box_type, start, end in iter_mp4_boxes(file, 0, size):
+        if box_type == b"moov":
+            return parse_mp4_moov(file, start, end, head[8:12].decode("latin-1").strip())
+    raise ContainerError("missing moov box")
+
+
+def parse_mp4_moov(file, start, end, brand):
+    duration = None
+    audio_track = None
+    video_track = None
+    for box_type, box_start, box_end in iter_mp4_boxes(file, start, end):
+        if box_type == b"mvhd":
+            version = read_at(file, box_start, 1)[0]
+            if version == 1:
+                timescale, length = struct.unpack(">IQ", read_at(file, box_start + 20, 12))
+            else:
+                timescale, length = struct.unpack(">II", read_at(file, box_start + 12, 8))
+            duration = length / timescale if timescale else None
+        elif box_type == b"trak":
+            track = parse_mp4_trak(file, box_start, box_end)
+            if track.get("handler") == b"soun" and audio_track is None:
+                audio_track = track
+            elif track.get("handler") == b"vide" and video_track is None:
+                if track.get("codec") not in ("jpeg", "png "):
+                    video_track = track
+    if audio_track is None and video_track is None:
+        raise ContainerError("no audio or video track")
+    audio_track = audio_track or {}
+    video_track = video_track or {}
+    return ContainerInfo(
+        format_name="mov" if brand == "qt" else "mp4",
+        media_type="video" if video_track else "audio",
+        duration=duration,
+        audio_codec=audio_track.get("codec", "").strip(),
+        sample_rate=audio_track.get("sample_rate"),
+        channels=audio_track.get("channels"),
+        video_codec=video_track.get("codec", "").strip(),
+        width=video_track.get("width"),
+        height=video_track.get("height"),
+    )
+
+
+def parse_mp4_trak(file, start, end, track=None):
+    track = {} if track is None else track
+    for box_type, box_start, box_end in iter_mp4_boxes(file, start, end):
+        if box_type in mp4_containers:
+            parse_mp4_trak(file, box_start, box_end, track)
+        elif box_type == b"tkhd":
+            width, height = struct.unpack(">II", read_at(file, box_end - 8, 8))
+            track["width"], track["height"] = width >> 16, height >> 16
+        elif box_type == b"hdlr" and "handler" not in track:
+            track["handler"] = read_at(file, box_start + 8, 4)
+        elif box_type == b"stsd":
+            entry = read_at(file, box_start + 8, 8)
+            track["codec"] = entry[4:8].decode("latin-1")
+            if track.get("handler") == b"soun":
+                channels, _, _, _, sample_rate = struct.unpack(
+                    ">HHHHI", read_at(file, box_start + 8 + 24, 12)
+                )
+                track["channels"], track["sample_rate"] = channels, sample_rate >> 16
+    return track
+
+
+# Matroska / WebM
+
+ebml_header = 0x1A45DFA3
+ebml_segment = 0x18538067
+ebml_info = 0x1549A966
+ebml_timecode_scale = 0x2AD7B1
+ebml_duration = 0x4489
+ebml_tracks = 0x1654AE6B
+ebml_track_entry = 0xAE
+ebml_track_type = 0x83
+ebml_codec_id = 0x86
+ebml_video = 0xE0
+ebml_audio = 0xE1
+ebml_pixel_width = 0xB0
+ebml_pixel_height = 0xBA
+ebml_sampling_frequency = 0xB5
+ebml_channels = 0x9F
+ebml_doc_type = 0x4282
+ebml_cluster = 0x1F43B675
+
+
+def read_ebml_vint(file, keep_marker):
+    first = file.read(1)
+    if not first:
+        raise ContainerError("unexpected end of file")
+    value = first[0]
+    mask = 0x80
+    length = 1
+    while length <= 8 and not value & mask:
+        mask >>= 1
+        length += 1
+    if length > 8:
+        raise ContainerError("invalid variable size integer")
+    if not keep_marker:
+        value &= mask - 1
+    rest = file.read(length - 1)
+    if len(rest) < length - 1:
+        raise ContainerError("unexpected end of file")
+    unknown = not keep_marker and value == mask - 1 and rest == b"\xff" * (length - 1)
+    for byte in rest:
+        value = (value << 8) | byte
+    return (None if unknown else value), length
+
+
+def iter_ebml_elements(file, offset, end):
+    while offset < end:
+        file.seek(offset)
+        element_id, id_length = read_ebml_vint(file, keep_marker=True)
+        element_size, size_length = read_ebml_vint(file, keep_marker=False)
+        data_start = offset + id_length + size_length
+        data_end = end if element_size is None else data_start + element_size
+        yield element_id, data_start, data_end
+        offset = data_end
+
+
+def read_ebml_uint(file, start, end):
+    return int.from_bytes(read_at(file, start, end - start), "big")
+
+
+def read_ebml_float(file, start, end):
+    data = read_at(file, start, end - start)
+    return struct.unpack(">f" if len(data) == 4 else ">d", data)[0]
+
+
+def parse_matroska(file, head, size):
+    if int.from_bytes(head[:4], "big") != ebml_header:
+        return None
+    doc_type = "matroska"
+    timecode_scale = 1000000
+    duration = None
+    tracks = []
+    for element_id, start, end in iter_ebml_elements(file, 0, size):
+        if element_id == ebml_header:
+            for sub_id, sub_start, sub_end in iter_ebml_elements(file, start, end):
+                if sub_id == ebml_doc_type:
+                    doc_type = read_at(file, sub_start, sub_end - sub_start).decode("ascii").strip("\0")
+        elif element_id == ebml_segment:
+            for sub_id, sub_start, sub_end in iter_ebml_elements(file, start, min(end, size)):
+                if sub_id == ebml_info:
+                    for info_id, info_start, info_end in iter_ebml_elements(file, sub_start, sub_end):
+                        if info_id == ebml_timecode_scale:
+                            timecode_scale = read_ebml_uint(file, info_start, info_end)
+                        elif info_id == ebml_duration:
+                            duration = read_ebml_float(file, info_start, info_end)
+                elif sub_id == ebml_tracks:
+                    tracks = parse_matroska_tracks(file, sub_start, sub_end)
+                elif sub_id == ebml_cluster and tracks:
+                    break
+            break
+    audio_track = next((t for t in tracks if t.get("type") == 2), {})
+    video_track = next((t for t in tracks if t.get("type") == 1), {})
+    if not audio_track and not video_track:
+        raise ContainerError("no audio or video track")
+    return ContainerInfo(
+        format_name=doc_type,
+        media_type="video" if video_track else "audio",
+        duration=duration * timecode_scale / 1000000000 if duration is not None else None,
+        audio_codec=audio_track.get("codec", ""),
+        sample_rate=audio_track.get("sample_rate"),
+        channels=audio_track.get("channels"),
+        video_codec=video_track.get("codec", ""),
+        width=video_track.get("width"),
+        height=video_track.get("height"),
+    )
+
+
+def parse_matroska_tracks(file, start, end):
+    tracks = []
+    for element_id, entry_start, entry_end in iter_ebml_elements(file, start, end):
+        if element_id != ebml_track_entry:
+            continue
+        track = {}
+        for sub_id, sub_start, sub_end in iter_ebml_elements(file, entry_start, entry_end):
+            if sub_id == ebml_track_type:
+                track["type"] = read_ebml_uint(file, sub_start, sub_end)
+            elif sub_id == ebml_codec_id:
+                track["codec"] = read_at(file, sub_start, sub_end - sub_start).decode("ascii").strip("\0")
+            elif sub_id == ebml_video:
+                for video_id, video_start, video_end in iter_ebml_elements(file, sub_start, sub_end):
+                    if video_id == ebml_pixel_width:
+                        track["width"] = read_ebml_uint(file, video_start, video_end)
+                    elif video_id == ebml_pixel_height:
+                        track["height"] = read_ebml_uint(file, video_start, video_end)
+            elif sub_id == ebml_audio:
+                for audio_id, audio_start, audio_end in iter_ebml_elements(file, sub_start, sub_end):
+                    if audio_id == ebml_sampling_frequency:
+                        track["sample_rate"] = int(read_ebml_float(file, audio_start, audio_end))
+                    elif audio_id == ebml_channels:
+                        track["channels"] = read_ebml_uint(file, audio_start, audio_end)
+        tracks.append(track)
+    return tracks
+
+
+container_parsers = (parse_flac, parse_ogg, parse_riff, parse_mp4, parse_matroska, parse_mp3)
@@ -0,0 +1,27 @@
+from contextlib import contextmanager
+from django.conf import settings
+from django.db import transaction
+
+
+def apply_sqlite_pragmas(sender, connection, **kwargs):
+    if connection.vendor != "sqlite":
+        return
+    with connection.cursor() as cursor:
+        for name, value in settings.MEDIA_SQLITE_PRAGMAS.items():
+            cursor.execute(f"PRAGMA {name} = {value}")
+
+
+@contextmanager
+def write_atomic(using=None):
+    # transaction.atomic() for blocks that write: the outermost one takes the
+    # SQLite write lock at BEGIN. Read-only blocks keep a deferred BEGIN and
+    # do not queue behind writers.
+    connection = transaction.get_connection(using)
+    begin_immediate = getattr(connection, "begin_immediate", False)
+    connection.begin_immediate = True
+    try:
+        with transaction.atomic(using=using):
+            connection.begin_immediate = begin_immediate
+            yield
+    finally:
+        connection.begin_immediate = begin_immediate
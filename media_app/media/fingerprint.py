@@ -0,0 +1,52 @@
+import hashlib
+import mmap
+
+
+sample_block_size = 1024 * 1024
+
+
+def hash_file(path, algorithm):
+    hash_buf = hashlib.new(algorithm)
+    with path.open("rb") as file:
+        try:
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                hash_buf.update(buf)
+        except ValueError:
+            # empty files cannot be mapped
+            pass
+    return hash_buf.hexdigest()
+
+
+def get_md5_fingerprint(path):
+    return hash_file(path, "md5")
+
+
+def get_blake2b_fingerprint(path):
+    return "blake2b:" + hash_file(path, "blake2b")
+
+
+def get_sampled_fingerprint(path):
+    size = path.stat().st_size
+    if size <= sample_block_size * 3:
+        return get_md5_fingerprint(path)
+    hash_buf = hashlib.blake2b(size.to_bytes(8, "little"))
+    with path.open("rb") as file:
+        for offset in (0, (size - sample_block_size) // 2, size - sample_block_size):
+            file.seek(offset)
+            hash_buf.update(file.read(sample_block_size))
+    return "sampled:" + hash_buf.hexdigest()
+
+
+fingerprint_strategies = {
+    "md5": get_md5_fingerprint,
+    "blake2b": get_blake2b_fingerprint,
+    "sampled": get_sampled_fingerprint,
+}
+
+
+def get_fingerprint(path, strategy="md5"):
+    return fingerprint_strategies[strategy](path)
+
+
+def is_sampled_fingerprint(value):
+    return value.startswith("sampled:")
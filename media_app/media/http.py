@@ -0,0 +1,113 @@
+import re
+from secrets import token_hex
+from django.utils.http import parse_http_date_safe
+
+
+range_spec_ptrn = re.compile(r"^(\d*)-(\d*)$")
+max_ranges = 16
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def parse_range_header(header, size):
+    # None means "ignore the header and send the full body"
+    units, _, spec = header.partition("=")
+    if units.strip().lower() != "bytes" or not spec.strip():
+        return None
+    ranges = []
+    for part in spec.split(","):
+        part = part.replace(" ", "").replace("\t", "")
+        if not part:
+            continue
+        m = range_spec_ptrn.match(part)
+        if m is None:
+            return None
+        first, last = m.groups()
+        if first == "" and last == "":
+            return None
+        if first == "":
+            suffix = int(last)
+            if suffix == 0 or size == 0:
+                continue
+            ranges.append((max(size - suffix, 0), size - 1))
+            continue
+        start = int(first)
+        end = int(last) if last else size - 1
+        if last and end < start:
+            return None
+        if start >= size:
+            continue
+        ranges.append((start, min(end, size - 1)))
+    if not ranges:
+        raise RangeNotSatisfiable()
+    ranges.sort()
+    merged = [ranges[0]]
+    for start, end in ranges[1:]:
+        last_start, last_end = merged[-1]
+        if start <= last_end + 1:
+            merged[-1] = (last_start, max(last_end, end))
+        else:
+            merged.append((start, end))
+    if len(merged) > max_ranges:
+        return None
+    return merged
+
+
+def if_range_matches(header, etag, last_modified):
+    header = header.strip()
+    if header.startswith("W/"):
+        return False
+    if header.startswith('"'):
+        return header == etag
+    if_range_date = parse_http_date_safe(header)
+    if if_range_date is None:
+        return False
+    return if_range_date == int(last_modified)
+
+
+class MultipartRanges:
+    def __init__(self, ranges, size, content_type):
+        self.boundary = token_hex(16)
+        self.ranges = ranges
+        self.size = size
+        self.content_type = content_type
+
+    @property
+    def content_type_header(self):
+        return f"multipart/byteranges; boundary={self.boundary}"
+
+    def part_header(self, start, end):
+        return (
+            f"--{self.boundary}\r\n"
+            f"Content-Type: {self.content_type}\r\n"
+            f"Content-Range: bytes {start}-{end}/{self.size}\r\n"
+            "\r\n"
+        ).encode("ascii")
+
+    @property
+    def closing(self):
+        return f"--{self.boundary}--\r\n".encode("ascii")
+
+    @property
+    def content_length(self):
+        length = len(self.closing)
+        for start, end in self.ranges:
+            length += len(self.part_header(start, end)) + (end - start + 1) + 2
+        return length
+
+    def iterator(self, get_fd_iterator):
+        for start, end in self.ranges:
+            yield self.part_header(start, end)
+            yield from get_fd_iterator(start, end - start + 1)
+            yield b"\r\n"
+        yield self.closing
+
+    async def aiterator(self, aget_fd_iterator):
+        for start, end in self.ranges:
+            yield self.part_header(start, end)
+            async for chunk in aget_fd_iterator(start, end - start + 1):
+                yield chunk
+            yield b"\r\n"
+        yield self.closing
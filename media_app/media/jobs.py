@@ -0,0 +1,181 @@
+from datetime import timedelta
+import os
+import socket
+import traceback
+import uuid
+from django.conf import settings
+from django.db.models import F, Q
+from django.utils import timezone
+from media.containers import read_container_info
+from media.fingerprint import get_fingerprint
+from media.models import Audio, MediaJob, Video
+from media.probe import build_container_probe, build_media_probe, ffprobe, has_ffprobe
+
+
+media_classes = {"audio": Audio, "video": Video}
+
+
+class JobError(Exception):
+    pass
+
+
+def get_worker_name():
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+def get_media_type_name(media_class):
+    return media_class._meta.model_name
+
+
+def build_job(kind, media_class, media_id):
+    return MediaJob(
+        kind=kind,
+        media_type=get_media_type_name(media_class),
+        media_id=media_id,
+        run_after=timezone.now(),
+    )
+
+
+def get_media_jobs(kind, media_class, media_id):
+    return MediaJob.objects.filter(kind=kind, media_type=get_media_type_name(media_class), media_id=media_id)
+
+
+def enqueue_media_job(kind, media_class, media_id):
+    # The views call this on every request. A job that is already queued,
+    # running, done or failed is left alone, and looking first keeps those
+    # requests from taking the write lock.
+    if get_media_jobs(kind, media_class, media_id).exists():
+        return
+    MediaJob.objects.bulk_create([build_job(kind, media_class, media_id)], ignore_conflicts=True)
+
+
+async def aenqueue_media_job(kind, media_class, media_id):
+    if await get_media_jobs(kind, media_class, media_id).aexists():
+        return
+    await MediaJob.objects.abulk_create(
+        [build_job(kind, media_class, media_id)], ignore_conflicts=True
+    )
+
+
+def enqueue_missing_backfills(batch_size=1000):
+    count = 0
+    for media_class in media_classes.values():
+        queryset = media_class.objects.filter(
+            Q(md5_hex="") | Q(file_size=0) | Q(duration=timedelta(0))
+        ).values_list("id", flat=True)
+        jobs = [build_job("backfill", media_class, media_id) for media_id in queryset.iterator()]
+        # ignore_conflicts does not report the skipped rows, count the table
+        queued = MediaJob.objects.filter(kind="backfill", media_type=get_media_type_name(media_class))
+        before = queued.count()
+        MediaJob.objects.bulk_create(jobs, batch_size=batch_size, ignore_conflicts=True)
+        count += queued.count() - before
+    return count
+
+
+def get_claimable_jobs(now):
+    stale = now - timedelta(seconds=settings.MEDIA_JOB_LOCK_TIMEOUT)
+    return MediaJob.objects.filter(
+        Q(status="pending", run_after__lte=now) | Q(status="running", locked_at__lt=stale)
+    )
+
+
+def claim_jobs(worker, limit):
+    # Workers race on the conditional UPDATE: a row that another worker
+    # claimed first no longer matches the filter and is skipped.
+    now = timezone.now()
+    candidates = list(
+        get_claimable_jobs(now).order_by("run_after").values_list("id", flat=True)[:limit]
+    )
+    if not candidates:
+        return []
+    get_claimable_jobs(now).filter(id__in=candidates).update(
+        status="running", locked_by=worker, locked_at=now, updated=now
+    )
+    return list(
+        MediaJob.objects.filter(id__in=candidates, status="running", locked_by=worker, locked_at=now)
+    )
+
+
+def run_job(job, worker):
+    try:
+        job_handlers[job.kind](job)
+    except Exception as e:
+        fail_job(job, worker, e)
+        return False
+    MediaJob.objects.filter(id=job.id, locked_by=worker).update(
+        status="done", attempts=F("attempts") + 1, last_error="", updated=timezone.now()
+    )
+    return True
+
+
+def fail_job(job, worker, error):
+    attempts = job.attempts + 1
+    now = timezone.now()
+    if attempts >= settings.MEDIA_JOB_MAX_ATTEMPTS or isinstance(error, (JobError, NotImplementedError)):
+        status, run_after = "failed", now
+    else:
+        delay = min(
+            settings.MEDIA_JOB_RETRY_DELAY * 2 ** (attempts - 1), settings.MEDIA_JOB_MAX_RETRY_DELAY
+        )
+        status, run_after = "pending", now + timedelta(seconds=delay)
+    MediaJob.objects.filter(id=job.id, locked_by=worker).update(
+        status=status,
+        attempts=attempts,
+        run_after=run_after,
+        last_error="".join(traceback.format_exception(error)),
+        updated=now,
+    )
+
+
+def purge_finished_jobs():
+    # Failed jobs are kept, they stop media that cannot be backfilled from
+    # being re-queued on every play until retry_failed_jobs is called.
+    before = timezone.now() - timedelta(seconds=settings.MEDIA_JOB_FINISHED_RETENTION)
+    return MediaJob.objects.filter(status="done", updated__lt=before).delete()[0]
+
+
+def retry_failed_jobs():
+    now = timezone.now()
+    return MediaJob.objects.filter(status="failed").update(
+        status="pending", attempts=0, run_after=now, locked_by="", locked_at=None, updated=now
+    )
+
+
+def backfill_media(job):
+    media_class = media_classes.get(job.media_type)
+    if media_class is None:
+        raise JobError(f"unsupported media type {job.media_type!r}")
+    media = media_class.objects.filter(id=job.media_id).first()
+    if media is None:
+        return
+    file_path = media.get_processed_path()
+    update_fields = []
+    if media.file_size == 0:
+        media.file_size = file_path.stat().st_size
+        update_fields.append("file_size")
+    if media.md5_hex == "":
+        media.md5_hex = get_fingerprint(file_path, settings.MEDIA_FINGERPRINT_STRATEGY)
+        update_fields.append("md5_hex")
+    if media.duration == timedelta(0):
+        probe = media.get_probe()
+        if probe is None:
+            container = read_container_info(file_path)
+            if container is not None:
+                probe = build_container_probe(media.md5_hex, container)
+            elif has_ffprobe():
+                probe = build_media_probe(media.md5_hex, ffprobe(file_path))
+            if probe is not None:
+                probe.save()
+        if probe is not None and probe.duration is not None:
+            media.duration = probe.duration
+            update_fields.append("duration")
+    if update_fields:
+        media.save(update_fields=update_fields + ["updated"])
+    if media.duration == timedelta(0):
+        # a done job would be purged and queued again by the next play
+        raise JobError(f"no duration found for {file_path}")
+
+
+job_handlers = {
+    "backfill": backfill_media,
+}
@@ -0,0 +1,29 @@
+from media.search import media_type_codes
+
+
+media_types = {code: media_type for media_type, code in media_type_codes.items()}
+
+
+def get_global_id(media_type, media_id):
+    # Global ids of MediaIndex and media_search encode the media type, so
+    # dispatching one needs no lookup table.
+    return media_id * 4 + media_type_codes[media_type]
+
+
+def split_global_id(global_id):
+    media_id, code = divmod(int(global_id), 4)
+    if code not in media_types or media_id <= 0:
+        raise ValueError(f"bad global id {global_id!r}")
+    return media_types[code], media_id
+
+
+def get_media_key(data):
+    # (type, id) of a request, either from "gid" or from "type" and "id"
+    global_id = data.get("gid")
+    if global_id is None:
+        return data.get("type"), data.get("id")
+    try:
+        media_type, media_id = split_global_id(global_id)
+    except ValueError:
+        return None, None
+    return media_type, str(media_id)
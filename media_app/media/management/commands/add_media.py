@@ -1,15 +1,24 @@
-from datetime import timedelta
-from hashlib import md5
 import mimetypes
-import json
 from multiprocessing import Process, RLock, cpu_count, Queue
 import os
 from pathlib import Path
+import queue
 import signal
-import subprocess
 import sys
+import time
+from django.conf import settings
 from django.core.management.base import BaseCommand, CommandParser
-from media.models import Audio, Video
+from django.db import DatabaseError, connections
+from django.db.models import Q, Value
+from django.db.models.functions import Concat, Substr
+from django.utils import timezone
+from media.containers import read_container_info
+from media.db import write_atomic
+from media.fingerprint import fingerprint_strategies, get_fingerprint
+from media.metrics import flush_metrics, ingest_files, ingest_seconds
+from media.models import Audio, MediaFingerprint, MediaProbe, Video
+from media.probe import PopenError, build_container_probe, build_media_probe, ffprobe, has_ffprobe
+from media.watch import Debouncer, create_watcher, iter_files
 
 
 def eprint(*args, **kwargs):
@@ -19,9 +28,9 @@ def eprint(*args, **kwargs):
 class Command(BaseCommand):
     help = "Add media from your media directory"
     lock = RLock()
-    chunk_size = 1024 * 1024
     cpu_count = cpu_count()
     has_ffprobe = False
+    flush_interval = 1
     DONE = "DONE"
 
     def __init__(self, *args, **kwargs):
@@ -36,12 +45,68 @@ class Command(BaseCommand):
             dest="skip_existing_paths",
             help="skip existing paths",
         )
+        self.add_base_argument(  # type: ignore
+            parser,
+            "--rescan",
+            action="store_true",
+            dest="rescan",
+            help="ignore the fingerprint index and process every file again",
+        )
+        parser.add_argument(
+            "--fingerprint",
+            choices=sorted(fingerprint_strategies),
+            default=settings.MEDIA_FINGERPRINT_STRATEGY,
+            dest="fingerprint",
+            help="content fingerprint stored in md5_hex, sampled ones can be verified later "
+                 "with verify_fingerprints",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=500,
+            dest="batch_size",
+            help="files written per transaction by the single writer process, "
+                 "0 lets every worker write its own files",
+        )
+        parser.add_argument(
+            "--watch",
+            action="store_true",
+            dest="watch",
+            help="keep running and ingest files as they change under the given paths",
+        )
+        parser.add_argument(
+            "--debounce",
+            type=float,
+            default=5,
+            dest="debounce",
+            help="seconds a changed file must stay untouched before it is ingested",
+        )
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=None,
+            dest="poll_interval",
+            help="scan for changes every N seconds instead of using inotify",
+        )
         parser.add_argument('paths', nargs='+', type=Path, help='List of paths to process')
 
     def handle(self, *args, **options):
         self.skip_existing_paths = options["skip_existing_paths"]
+        self.verbosity = options["verbosity"]
+        self.fingerprint_strategy = options["fingerprint"]
+        self.existing_paths = load_existing_paths() if self.skip_existing_paths else set()
+        self.fingerprints = {} if options["rescan"] else load_fingerprints()
+        self.batch_size = options["batch_size"]
+        # workers are forked with the index above, but must not share the connection
+        connections.close_all()
         workers: list[Process] = []
         task_queue = Queue()
+        self.results_queue = Queue() if self.batch_size > 0 else None
+        writer = None
+        if self.results_queue is not None:
+            writer = Process(target=self.writer, args=(self.results_queue,))
+            writer.daemon = True
+            writer.start()
         print("cpu count:", self.cpu_count)
         for i in range(self.cpu_count):
             worker = Process(target=self.worker, args=(task_queue,))
@@ -60,24 +125,59 @@ class Command(BaseCommand):
                         for fname in files:
                             file_path = Path(path) / fname
                             task_queue.put(file_path)
+                            ingest_files.inc("queued")
                 else:
                     task_queue.put(media_path)
+                    ingest_files.inc("queued")
+            if options["watch"]:
+                roots = [media_path for media_path in options["paths"] if media_path.exists()]
+                self.watch(roots, task_queue, options["debounce"], options["poll_interval"])
             for worker in workers:
                 task_queue.put(self.DONE)
             for worker in workers:
                 if worker.is_alive():
                     worker.join()
+            if writer is not None:
+                writer.join()
+                self.results_queue.close()
+                self.results_queue.join_thread()
             task_queue.close()
             task_queue.join_thread()
         except KeyboardInterrupt:
             eprint("process recieved SIGINT")
-            for worker in workers:
-                if worker.is_alive():
-                    worker.terminate()
-                    worker.join()
+            for process in workers + ([writer] if writer is not None else []):
+                if process.is_alive():
+                    process.terminate()
+                    process.join()
             task_queue.close()
             task_queue.cancel_join_thread()
-        
+            if self.results_queue is not None:
+                self.results_queue.close()
+                self.results_queue.cancel_join_thread()
+
+    def watch(self, roots, task_queue, debounce, poll_interval):
+        watcher = create_watcher(roots, poll_interval)
+        debouncer = Debouncer(debounce)
+        print("watching", *roots)
+        try:
+            while True:
+                for event in watcher.read_events(timeout=1):
+                    match event:
+                        case ("changed", path):
+                            debouncer.touch(path)
+                        case ("removed", path):
+                            debouncer.discard(path)
+                            remove_media_paths(path)
+                        case ("moved", old_path, new_path):
+                            debouncer.discard(old_path)
+                            if not move_media_paths(old_path, new_path):
+                                for file_path in iter_files(new_path):
+                                    debouncer.touch(file_path)
+                for path in debouncer.ready():
+                    task_queue.put(path)
+                    ingest_files.inc("queued")
+        finally:
+            watcher.close()
 
     def worker(self, task_queue):
         signal.signal(signal.SIGINT, signal.SIG_IGN)
@@ -87,22 +187,69 @@ class Command(BaseCommand):
                 if task == self.DONE:
                     print("worker recieved", self.DONE)
                     return
-                self.process_file(task)
+                try:
+                    self.process_file(task)
+                except Exception as e:
+                    # one unreadable file must not take the worker down
+                    eprint(task, e)
         except KeyboardInterrupt:
             eprint("worker recieved SIGINT")
+        finally:
+            # the writer waits for a DONE from every worker
+            if self.results_queue is not None:
+                self.results_queue.put(self.DONE)
+            flush_metrics()
+
+    def writer(self, results_queue):
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        batch = []
+        done = 0
+        try:
+            while done < self.cpu_count:
+                try:
+                    result = results_queue.get(timeout=self.flush_interval)
+                except queue.Empty:
+                    result = None
+                if result == self.DONE:
+                    done += 1
+                elif result is not None:
+                    batch.append(result)
+                if batch and (result is None or len(batch) >= self.batch_size):
+                    write_batch(batch, self.verbosity)
+                    batch = []
+            if batch:
+                write_batch(batch, self.verbosity)
+        finally:
+            flush_metrics()
+
+    def save_result(self, result):
+        if self.results_queue is not None:
+            self.results_queue.put(result)
+            return
+        with self.lock:
+            write_result(result, self.verbosity)
 
     def process_file(self, file_path):
+        start = time.perf_counter()
         if self.skip_existing_paths:
-            if (Audio.objects.filter(path=str(file_path)).exists()
-                    or Video.objects.filter(path=str(file_path)).exists()):
+            if str(file_path) in self.existing_paths:
                 eprint("skipping existing", file_path)
+                ingest_files.inc("skipped")
                 return
+        stat = file_path.stat()
+        fingerprint = (stat.st_size, stat.st_mtime_ns, stat.st_ino)
+        if self.fingerprints.get(str(file_path)) == fingerprint:
+            if self.verbosity > 1:
+                print("unchanged", file_path)
+            ingest_files.inc("skipped")
+            return
         fields = dict(
             title=file_path.stem,
             path=str(file_path),
-            file_size=file_path.stat().st_size,
+            file_size=stat.st_size,
         )
-        media_type = resolve_media_type(file_path)
+        container = read_container_info(file_path)
+        media_type = container.media_type if container else resolve_media_type(file_path)
         media_class = None
         match media_type:
             case "audio":
@@ -111,89 +258,220 @@ class Command(BaseCommand):
                 media_class = Video
             case _:
                 eprint(f"unsupported media type", file_path)
+                ingest_files.inc("unsupported")
+                self.save_result((None, None, file_path, fingerprint, None))
                 return
-        if self.has_ffprobe:
+        fields["md5_hex"] = get_fingerprint(file_path, self.fingerprint_strategy)
+        probe = MediaProbe.objects.filter(fingerprint=fields["md5_hex"]).first()
+        new_probe = None
+        if probe is None and container is not None:
+            probe = new_probe = build_container_probe(fields["md5_hex"], container)
+        elif probe is None and self.has_ffprobe:
             try:
-                file_info = ffprobe(file_path)
-                if duration := get_media_duration(file_info):
-                    fields["duration"] = duration
+                probe = new_probe = build_media_probe(fields["md5_hex"], ffprobe(file_path))
             except PopenError as e:
                 eprint(f"ffprobe: {e}")
                 pass
-        md5_hex = get_md5_hex(file_path)
-        fields["md5_hex"] = md5_hex
-        with self.lock:
-            try:
-                media_class.objects.update_or_create(defaults=fields, md5_hex=md5_hex)
-                print(file_path)
-            except KeyboardInterrupt:
-                raise
-            except Exception as e:
-                eprint(file_path, e)
+        if probe is not None:
+            if probe.media_type or probe.data.get("streams"):
+                media_class = {"audio": Audio, "video": Video}.get(probe.media_type)
+                if media_class is None:
+                    eprint(f"unsupported media type", file_path)
+                    ingest_files.inc("unsupported")
+                    self.save_result((None, None, file_path, fingerprint, new_probe))
+                    return
+            if probe.duration is not None:
+                fields["duration"] = probe.duration
+        ingest_files.inc("processed")
+        ingest_seconds.observe("process", value=time.perf_counter() - start)
+        self.save_result((media_class, fields, file_path, fingerprint, new_probe))
 
 
-def resolve_media_type(file_path):
-    mtype, _ = mimetypes.guess_type(file_path)
-    if mtype and mtype[:5] in ("audio", "video"):
-        media_type = mtype[:5]
-        return media_type
+def get_tree_filter(path):
+    # a range instead of startswith, LIKE is case-insensitive on SQLite and
+    # would also match siblings that differ only in case
+    prefix = os.path.join(str(path), "")
+    return Q(path=str(path)) | Q(path__gte=prefix, path__lt=prefix + "\U0010ffff")
+
+
+def remove_media_paths(path):
+    for model in (Audio, Video, MediaFingerprint):
+        deleted, _ = model.objects.filter(get_tree_filter(path)).delete()
+        if deleted and model is not MediaFingerprint:
+            print("removed", path)
+
+
+def move_media_paths(old_path, new_path):
+    moved = 0
+    new_value = Concat(Value(str(new_path)), Substr("path", len(str(old_path)) + 1))
+    with write_atomic():
+        for model in (Audio, Video):
+            moved += model.objects.filter(get_tree_filter(old_path)).update(
+                path=new_value, updated=timezone.now()
+            )
+        if moved:
+            MediaFingerprint.objects.filter(get_tree_filter(new_path)).delete()
+            MediaFingerprint.objects.filter(get_tree_filter(old_path)).update(path=new_value)
+        else:
+            MediaFingerprint.objects.filter(get_tree_filter(old_path)).delete()
+    if moved:
+        print("moved", old_path, "->", new_path)
+    return moved
+
 
+def load_existing_paths():
+    paths = set(Audio.objects.values_list("path", flat=True).iterator())
+    paths.update(Video.objects.values_list("path", flat=True).iterator())
+    return paths
 
-class PopenError(Exception):
-    pass
 
-def popen(*args):
-    p = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    out, err = p.communicate()
-    if p.returncode != 0:
-        raise PopenError(err)
-    return out
+def load_fingerprints():
+    media_paths = load_existing_paths()
+    fingerprints = {}
+    rows = MediaFingerprint.objects.values_list("path", "size", "mtime_ns", "inode", "media_type")
+    for path, size, mtime_ns, inode, media_type in rows.iterator(chunk_size=10000):
+        # a media row removed since the last scan has to be ingested again
+        if media_type and path not in media_paths:
+            continue
+        fingerprints[path] = (size, mtime_ns, inode)
+    return fingerprints
 
 
-def get_md5_hex(path):
-    md5_buf = md5(b"")
-    with path.open("rb") as file:
-        chunk = file.read(Command.chunk_size)
-        while chunk:
-            md5_buf.update(chunk)
-            chunk = file.read(Command.chunk_size)
-    return md5_buf.hexdigest()
+def save_fingerprint(file_path, fingerprint, media_type):
+    size, mtime_ns, inode = fingerprint
+    MediaFingerprint.objects.update_or_create(
+        defaults=dict(size=size, mtime_ns=mtime_ns, inode=inode, media_type=media_type),
+        path=str(file_path),
+    )
 
 
-def has_ffprobe():
+def get_media_type_name(media_class):
+    return media_class.__name__.lower() if media_class is not None else ""
+
+
+def write_result(result, verbosity=1):
+    media_class, fields, file_path, fingerprint, probe = result
     try:
-        out = popen('ffprobe', '-version')
-        return True
-    except PopenError:
-        return False
+        with write_atomic():
+            save_probe_batch([result])
+            if media_class is not None:
+                save_media(media_class, fields)
+            save_fingerprint(file_path, fingerprint, get_media_type_name(media_class))
+        if media_class is not None:
+            ingest_files.inc("written")
+        if media_class is not None and verbosity > 0:
+            print(file_path)
+    except KeyboardInterrupt:
+        raise
+    except Exception as e:
+        eprint(file_path, e)
 
-def ffprobe(path):
-    out = popen('ffprobe', '-show_format', '-show_streams', '-of', 'json', path)
-    return json.loads(out.decode('utf-8'))
+
+def write_batch(batch, verbosity=1):
+    start = time.perf_counter()
+    try:
+        with write_atomic():
+            for media_class in (Audio, Video):
+                fields_list = [fields for cls, fields, _, _, _ in batch if cls is media_class]
+                if fields_list:
+                    save_media_batch(media_class, fields_list)
+            save_fingerprint_batch(batch)
+            save_probe_batch(batch)
+    except DatabaseError:
+        # redo the batch file by file to report which files failed
+        for result in batch:
+            write_result(result, verbosity)
+        return
+    ingest_files.inc("written", amount=sum(1 for media_class, *_ in batch if media_class is not None))
+    ingest_seconds.observe("write", value=time.perf_counter() - start)
+    if verbosity > 0:
+        for media_class, _, file_path, _, _ in batch:
+            if media_class is not None:
+                print(file_path)
 
 
-def get_media_duration(data):
-    if "format" in data and "duration" in data["format"]:
-        duration = float(data["format"]["duration"])
-        delta = timedelta(seconds=round(duration, 0))
-        return delta
+def save_media_batch(media_class, fields_list):
+    by_md5_hex = {
+        media.md5_hex: media for media in
+        media_class.objects.filter(md5_hex__in=[fields["md5_hex"] for fields in fields_list])
+    }
+    by_path = {
+        media.path: media for media in
+        media_class.objects.filter(path__in=[fields["path"] for fields in fields_list])
+    }
+    created = []
+    updated = {}
+    update_fields = {"updated"}
+    now = timezone.now()
+    for fields in fields_list:
+        media = by_md5_hex.get(fields["md5_hex"]) or by_path.get(fields["path"])
+        if media is None:
+            media = media_class(**fields)
+            created.append(media)
+        else:
+            for name, value in fields.items():
+                setattr(media, name, value)
+            if media.pk is not None:
+                media.updated = now
+                updated[media.pk] = media
+                update_fields.update(fields)
+        by_md5_hex[media.md5_hex] = media
+        by_path[media.path] = media
+    media_class.objects.bulk_create(created)
+    if updated:
+        media_class.objects.bulk_update(updated.values(), sorted(update_fields))
 
 
-def get_media_type(data):
-    has_audio = False
-    if 'format' in data and data['format'].get("format_name", "").startswith("image"):
+def save_fingerprint_batch(batch):
+    fingerprints = {}
+    for media_class, _, file_path, (size, mtime_ns, inode), _ in batch:
+        fingerprints[str(file_path)] = MediaFingerprint(
+            path=str(file_path),
+            size=size,
+            mtime_ns=mtime_ns,
+            inode=inode,
+            media_type=get_media_type_name(media_class),
+        )
+    MediaFingerprint.objects.bulk_create(
+        fingerprints.values(),
+        update_conflicts=True,
+        unique_fields=("path",),
+        update_fields=("updated", "size", "mtime_ns", "inode", "media_type"),
+    )
+
+
+def save_probe_batch(batch):
+    probes = {probe.fingerprint: probe for _, _, _, _, probe in batch if probe is not None}
+    if not probes:
         return
-    if 'streams' in data:
-        for stream in data['streams']:
-            if stream.get('codec_type') == 'video':
-                codec_name = stream.get('codec_name')
-                if isinstance(codec_name, str):
-                    if 'jpeg' in codec_name or 'jpg' in codec_name:
-                        return
-                if codec_name in ('ansi', 'png', 'pictor', 'gif', 'bmp', 'svg', 'tiff', 'webp', ''):
-                    return
-                return 'video'
-            elif stream.get('codec_type') == 'audio':
-                has_audio = True
-    if has_audio:
-        return 'audio'
+    MediaProbe.objects.bulk_create(
+        probes.values(),
+        update_conflicts=True,
+        unique_fields=("fingerprint",),
+        update_fields=[
+            field.name for field in MediaProbe._meta.concrete_fields
+            if field.name not in ("id", "created", "fingerprint")
+        ],
+    )
+
+
+def save_media(media_class, fields):
+    # falling back to the path keeps the row when a file is fingerprinted
+    # with a different strategy than last time
+    media = (
+        media_class.objects.filter(md5_hex=fields["md5_hex"]).first()
+        or media_class.objects.filter(path=fields["path"]).first()
+    )
+    if media is None:
+        return media_class.objects.create(**fields)
+    for name, value in fields.items():
+        setattr(media, name, value)
+    media.save()
+    return media
+
+
+def resolve_media_type(file_path):
+    mtype, _ = mimetypes.guess_type(file_path)
+    if mtype and mtype[:5] in ("audio", "video"):
+        media_type = mtype[:5]
+        return media_type
@@ -0,0 +1,48 @@
+import os
+from pathlib import Path
+import shutil
+import tempfile
+import time
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandParser
+from media.models import Audio, MediaFingerprint, Video
+
+
+class Command(BaseCommand):
+    help = "Compare per-file and batched add_media writes on a synthetic library"
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument("--files", type=int, default=2000, help="number of synthetic files")
+        parser.add_argument("--file-size", type=int, default=16 * 1024, help="bytes per file")
+        parser.add_argument(
+            "--batch-sizes",
+            type=int,
+            nargs="+",
+            default=[0, 100, 500],
+            help="add_media --batch-size values to compare, 0 is per-file writes",
+        )
+
+    def handle(self, *args, **options):
+        root = Path(tempfile.mkdtemp(prefix="bench_ingest_"))
+        try:
+            for i in range(options["files"]):
+                directory = root / f"{i // 500:04d}"
+                directory.mkdir(exist_ok=True)
+                (directory / f"track_{i:06d}.mp3").write_bytes(os.urandom(options["file_size"]))
+            for batch_size in options["batch_sizes"]:
+                self.cleanup(root)
+                start = time.perf_counter()
+                call_command("add_media", str(root), rescan=True, batch_size=batch_size, verbosity=0)
+                elapsed = time.perf_counter() - start
+                count = Audio.objects.filter(path__startswith=str(root)).count()
+                self.stdout.write(
+                    f"batch-size={batch_size:<5} files={count:<7} "
+                    f"seconds={elapsed:.2f} files/s={count / elapsed:.0f}"
+                )
+        finally:
+            self.cleanup(root)
+            shutil.rmtree(root)
+
+    def cleanup(self, root):
+        for model in (Audio, Video, MediaFingerprint):
+            model.objects.filter(path__startswith=str(root)).delete()
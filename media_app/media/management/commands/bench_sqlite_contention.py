@@ -0,0 +1,151 @@
+from multiprocessing import Process, Queue
+import random
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandParser
+from django.db import OperationalError, connections
+from django.db.models import F
+from media.db import write_atomic
+from media.models import Audio
+
+
+profiles = {
+    # Django's SQLite defaults: rollback journal, synchronous = FULL
+    "default": {"journal_mode": "DELETE", "synchronous": "FULL"},
+    "settings": None,
+}
+
+
+class Command(BaseCommand):
+    help = "Run ingest, stream lookups and play count writes side by side against the database"
+
+    path_prefix = "/home/bench_sqlite_contention/"
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument("--seconds", type=float, default=10, help="duration of every run")
+        parser.add_argument("--rows", type=int, default=5000, help="rows present before the run")
+        parser.add_argument("--ingest-workers", type=int, default=1, help="add_media runs a single writer")
+        parser.add_argument("--ingest-batch", type=int, default=100, help="rows per ingest transaction")
+        parser.add_argument(
+            "--ingest-pause",
+            type=float,
+            default=0.1,
+            help="seconds between ingest batches, add_media hashes files in between",
+        )
+        parser.add_argument("--readers", type=int, default=4, help="stream lookup processes")
+        parser.add_argument("--writers", type=int, default=2, help="play count update processes")
+        parser.add_argument(
+            "--profiles",
+            nargs="+",
+            choices=list(profiles),
+            default=list(profiles),
+            help="'default' is Django's plain SQLite, 'settings' is MEDIA_SQLITE_PRAGMAS",
+        )
+
+    def handle(self, *args, **options):
+        configured_pragmas = settings.MEDIA_SQLITE_PRAGMAS
+        try:
+            for profile in options["profiles"]:
+                settings.MEDIA_SQLITE_PRAGMAS = profiles[profile] or configured_pragmas
+                self.cleanup()
+                self.populate(options["rows"])
+                ids = list(
+                    Audio.objects.filter(path__startswith=self.path_prefix).values_list("id", flat=True)
+                )
+                results = self.run(ids, options)
+                for role, (count, errors, latencies) in results.items():
+                    latencies.sort()
+                    p50 = latencies[len(latencies) // 2] * 1000 if latencies else 0
+                    p99 = latencies[int(len(latencies) * 0.99)] * 1000 if latencies else 0
+                    self.stdout.write(
+                        f"{profile:<9} {role:<7} ops={count:<7} ops/s={count / options['seconds']:<8.0f} "
+                        f"p50={p50:.2f}ms p99={p99:.2f}ms locked={errors}"
+                    )
+        finally:
+            settings.MEDIA_SQLITE_PRAGMAS = configured_pragmas
+            self.cleanup()
+
+    def run(self, ids, options):
+        # the journal mode of the file changes with the first new connection
+        connections.close_all()
+        Audio.objects.exists()
+        connections.close_all()
+        results_queue = Queue()
+        deadline = time.monotonic() + options["seconds"]
+        roles = (
+            [
+                ("ingest", self.ingest, (i, options["ingest_batch"]), options["ingest_pause"])
+                for i in range(options["ingest_workers"])
+            ]
+            + [("read", self.read, (ids,), 0) for _ in range(options["readers"])]
+            + [("write", self.write, (ids,), 0) for _ in range(options["writers"])]
+        )
+        processes = [
+            Process(target=self.worker, args=(role, target, args, pause, deadline, results_queue))
+            for role, target, args, pause in roles
+        ]
+        for p in processes:
+            p.start()
+        results = {}
+        for _ in processes:
+            role, count, errors, latencies = results_queue.get()
+            total = results.setdefault(role, [0, 0, []])
+            total[0] += count
+            total[1] += errors
+            total[2].extend(latencies)
+        for p in processes:
+            p.join()
+        return results
+
+    def worker(self, role, target, args, pause, deadline, results_queue):
+        count = errors = 0
+        latencies = []
+        step = 0
+        while time.monotonic() < deadline:
+            if step and pause:
+                time.sleep(pause)
+            start = time.perf_counter()
+            try:
+                target(step, *args)
+            except OperationalError:
+                errors += 1
+                continue
+            finally:
+                step += 1
+            latencies.append(time.perf_counter() - start)
+            count += 1
+        connections.close_all()
+        results_queue.put((role, count, errors, latencies))
+
+    def ingest(self, step, worker, batch):
+        with write_atomic():
+            Audio.objects.bulk_create(
+                Audio(
+                    title=f"ingest {worker} {step} {i}",
+                    path=f"{self.path_prefix}ingest/{worker}/{step}/{i}.mp3",
+                    md5_hex=f"bench_sqlite_contention:{worker}:{step}:{i}",
+                )
+                for i in range(batch)
+            )
+
+    def read(self, step, ids):
+        Audio.objects.filter(id=random.choice(ids)).values_list("path", "md5_hex", "file_size").first()
+
+    def write(self, step, ids):
+        Audio.objects.filter(id=random.choice(ids)).update(play_count=F("play_count") + 1)
+
+    def populate(self, rows):
+        Audio.objects.bulk_create(
+            (
+                Audio(
+                    title=f"track {i}",
+                    path=f"{self.path_prefix}{i}.mp3",
+                    md5_hex=f"bench_sqlite_contention:{i}",
+                )
+                for i in range(rows)
+            ),
+            batch_size=1000,
+        )
+
+    def cleanup(self):
+        Audio.objects.filter(path__startswith=self.path_prefix).delete()
@@ -0,0 +1,343 @@
+from datetime import timedelta
+from http.client import HTTPConnection
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import importlib.util
+import json
+import os
+from pathlib import Path
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError, CommandParser
+from media.models import Audio, Radio, Video
+
+
+servers = {
+    # {python} and {port} are filled in, --wsgi-command/--asgi-command override them
+    "wsgi": (
+        "{python} manage.py runserver --noreload --skip-checks 127.0.0.1:{port}",
+        "/media/media-file-stream/",
+    ),
+    "asgi": (
+        "{python} -m uvicorn media_app.asgi:application --port {port} --no-access-log",
+        "/media/async/media-file-stream/",
+    ),
+}
+scenarios = ("download", "seek", "radio")
+
+
+class RadioHandler(BaseHTTPRequestHandler):
+    # an endless stream paced at the station bitrate
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "audio/mpeg")
+        self.end_headers()
+        chunk = os.urandom(4096)
+        start = time.monotonic()
+        sent = 0
+        try:
+            while True:
+                self.wfile.write(chunk)
+                sent += len(chunk)
+                delay = start + sent / self.server.bitrate - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+        except OSError:
+            pass
+
+    def log_message(self, format, *args):
+        pass
+
+
+def percentile(values, p):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(int(len(values) * p), len(values) - 1)]
+
+
+def get_free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def get_process_tree(pid):
+    # pid and its descendants, from /proc
+    children = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as fh:
+                ppid = int(fh.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    tree = [pid]
+    for p in tree:
+        tree.extend(children.get(p, []))
+    return tree
+
+
+def get_cpu_seconds(pids):
+    ticks = os.sysconf("SC_CLK_TCK")
+    total = 0
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/stat") as fh:
+                fields = fh.read().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        # utime and stime
+        total += (int(fields[11]) + int(fields[12])) / ticks
+    return total
+
+
+def get_peak_rss(pids):
+    # VmHWM is the peak since each process started, in KiB
+    total = 0
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/status") as fh:
+                for line in fh:
+                    if line.startswith("VmHWM:"):
+                        total += int(line.split()[1]) * 1024
+        except OSError:
+            continue
+    return total
+
+
+def get_git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, cwd=settings.BASE_DIR
+        ).stdout.strip()
+    except OSError:
+        return ""
+
+
+class Command(BaseCommand):
+    help = "Load test the media file stream under WSGI and ASGI with synthetic files and a local radio"
+
+    path_prefix = "/bench_stream/"
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument("--servers", nargs="+", choices=list(servers), default=list(servers))
+        parser.add_argument("--scenarios", nargs="+", choices=scenarios, default=list(scenarios))
+        parser.add_argument("--wsgi-command", default=servers["wsgi"][0])
+        parser.add_argument("--asgi-command", default=servers["asgi"][0])
+        parser.add_argument("--clients", type=int, default=8, help="concurrent clients")
+        parser.add_argument("--seconds", type=float, default=10, help="duration of every scenario")
+        parser.add_argument(
+            "--sizes",
+            type=int,
+            nargs="+",
+            default=[256 * 1024, 4 * 1024 * 1024, 32 * 1024 * 1024],
+            help="bytes per synthetic file, every size is written as audio and video",
+        )
+        parser.add_argument("--range-size", type=int, default=256 * 1024, help="bytes per seek request")
+        parser.add_argument("--radio-bitrate", type=int, default=32 * 1024, help="station bytes per second")
+        parser.add_argument("--radio-bytes", type=int, default=64 * 1024, help="bytes read per radio listener")
+        parser.add_argument("--output", help="write the results as JSON to this file")
+
+    def handle(self, *args, **options):
+        commands = dict(wsgi=options["wsgi_command"], asgi=options["asgi_command"])
+        for server in list(options["servers"]):
+            if "-m uvicorn" in commands[server] and importlib.util.find_spec("uvicorn") is None:
+                self.stderr.write(f"skipping {server}: uvicorn is not installed, pass --{server}-command")
+                options["servers"].remove(server)
+        root = Path(tempfile.mkdtemp(prefix="bench_stream_"))
+        radio_server = ThreadingHTTPServer(("127.0.0.1", 0), RadioHandler)
+        radio_server.daemon_threads = True
+        radio_server.bitrate = options["radio_bitrate"]
+        threading.Thread(target=radio_server.serve_forever, daemon=True).start()
+        results = []
+        try:
+            self.cleanup()
+            files = self.populate(root, options["sizes"])
+            radio = Radio.objects.create(
+                title="bench_stream radio",
+                path=f"http://127.0.0.1:{radio_server.server_address[1]}{self.path_prefix}radio",
+            )
+            for server in options["servers"]:
+                results.extend(
+                    self.run_server(server, commands[server], servers[server][1], files, radio, options)
+                )
+        finally:
+            radio_server.shutdown()
+            self.cleanup()
+            shutil.rmtree(root)
+        if options["output"]:
+            with open(options["output"], "w") as fh:
+                json.dump(
+                    dict(
+                        revision=get_git_revision(),
+                        stream_mode=settings.MEDIA_FILE_STREAM_MODE,
+                        radio_relay=settings.MEDIA_RADIO_RELAY,
+                        options={
+                            key: options[key]
+                            for key in ("clients", "seconds", "sizes", "range_size", "radio_bitrate", "radio_bytes")
+                        },
+                        results=results,
+                    ),
+                    fh,
+                    indent=1,
+                )
+
+    def run_server(self, server, command, url, files, radio, options):
+        port = get_free_port()
+        process = subprocess.Popen(
+            command.format(python=sys.executable, port=port).split(),
+            cwd=settings.BASE_DIR,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        results = []
+        try:
+            self.wait_for_port(port, process)
+            for scenario in options["scenarios"]:
+                pids = get_process_tree(process.pid)
+                cpu = get_cpu_seconds(pids)
+                result = self.run_scenario(scenario, port, url, files, radio, options)
+                pids = get_process_tree(process.pid)
+                result.update(
+                    server=server,
+                    scenario=scenario,
+                    cpu_seconds=get_cpu_seconds(pids) - cpu,
+                    peak_rss=get_peak_rss(pids),
+                )
+                gb = result["bytes"] / 1024**3
+                result["cpu_seconds_per_gb"] = result["cpu_seconds"] / gb if gb else None
+                self.stdout.write(
+                    f"{server:<5} {scenario:<8} requests={result['requests']:<6} errors={result['errors']:<4} "
+                    f"MB/s={result['bytes'] / result['seconds'] / 1024**2:<8.1f} "
+                    f"ttfb p50={result['ttfb_p50'] * 1000:.1f}ms p99={result['ttfb_p99'] * 1000:.1f}ms "
+                    f"latency p50={result['latency_p50'] * 1000:.1f}ms p99={result['latency_p99'] * 1000:.1f}ms "
+                    f"cpu/GB={result['cpu_seconds_per_gb'] or 0:.2f}s rss={result['peak_rss'] / 1024**2:.0f}MiB"
+                )
+                results.append(result)
+        finally:
+            process.terminate()
+            try:
+                process.wait(10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        return results
+
+    def wait_for_port(self, port, process):
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise CommandError(f"server exited with {process.returncode}")
+            try:
+                socket.create_connection(("127.0.0.1", port), timeout=1).close()
+                return
+            except OSError:
+                time.sleep(0.1)
+        raise CommandError("server did not start")
+
+    def run_scenario(self, scenario, port, url, files, radio, options):
+        deadline = time.monotonic() + options["seconds"]
+        lock = threading.Lock()
+        totals = dict(requests=0, errors=0, bytes=0, ttfb=[], latency=[])
+
+        def client():
+            while time.monotonic() < deadline:
+                match scenario:
+                    case "download":
+                        media_type, id, size = random.choice(files)
+                        query, headers, limit = f"type={media_type}&id={id}", {}, None
+                    case "seek":
+                        media_type, id, size = random.choice(files)
+                        start = random.randrange(max(size - options["range_size"], 1))
+                        end = min(start + options["range_size"], size) - 1
+                        query, headers, limit = f"type={media_type}&id={id}", dict(Range=f"bytes={start}-{end}"), None
+                    case "radio":
+                        query, headers, limit = f"type=radio&id={radio.id}", {}, options["radio_bytes"]
+                    case _:
+                        raise NotImplementedError()
+                try:
+                    ttfb, latency, received = self.request(port, f"{url}?{query}", headers, limit)
+                except (OSError, ValueError):
+                    with lock:
+                        totals["errors"] += 1
+                    continue
+                with lock:
+                    totals["requests"] += 1
+                    totals["bytes"] += received
+                    totals["ttfb"].append(ttfb)
+                    totals["latency"].append(latency)
+
+        start = time.perf_counter()
+        threads = [threading.Thread(target=client) for _ in range(options["clients"])]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        seconds = time.perf_counter() - start
+        return dict(
+            requests=totals["requests"],
+            errors=totals["errors"],
+            bytes=totals["bytes"],
+            seconds=seconds,
+            ttfb_p50=percentile(totals["ttfb"], 0.5),
+            ttfb_p99=percentile(totals["ttfb"], 0.99),
+            latency_p50=percentile(totals["latency"], 0.5),
+            latency_p99=percentile(totals["latency"], 0.99),
+        )
+
+    def request(self, port, url, headers, limit):
+        # returns time to first body byte, total time and body bytes
+        start = time.perf_counter()
+        connection = HTTPConnection("127.0.0.1", port, timeout=30)
+        try:
+            connection.request("GET", url, headers=headers)
+            response = connection.getresponse()
+            if response.status not in (200, 206):
+                raise ValueError(f"status {response.status}")
+            received = 0
+            ttfb = None
+            while limit is None or received < limit:
+                chunk = response.read1(65536)
+                if not chunk:
+                    break
+                if ttfb is None:
+                    ttfb = time.perf_counter() - start
+                received += len(chunk)
+            if not received:
+                raise ValueError("empty response")
+            return ttfb, time.perf_counter() - start, received
+        finally:
+            connection.close()
+
+    def populate(self, root, sizes):
+        files = []
+        for media_class, media_type, suffix in ((Audio, "audio", "mp3"), (Video, "video", "mp4")):
+            for size in sizes:
+                path = root / f"{media_type}_{size}.{suffix}"
+                with open(path, "wb") as fh:
+                    remaining = size
+                    while remaining:
+                        remaining -= fh.write(os.urandom(min(remaining, 1024 * 1024)))
+                # complete rows, the views would enqueue backfill jobs otherwise
+                object = media_class.objects.create(
+                    title=f"bench_stream {media_type} {size}",
+                    path=path.as_uri(),
+                    file_size=size,
+                    md5_hex=f"bench_stream:{media_type}:{size}",
+                    duration=timedelta(seconds=max(size // 16000, 1)),
+                )
+                files.append((media_type, object.id, size))
+        return files
+
+    def cleanup(self):
+        for media_class in (Audio, Video):
+            media_class.objects.filter(path__contains="/bench_stream_").delete()
+        Radio.objects.filter(path__contains=self.path_prefix).delete()
@@ -0,0 +1,78 @@
+import random
+import time
+from django.core.management.base import BaseCommand, CommandParser
+from django.db.models import Q
+from media.models import Audio, Tag
+from media.tagquery import compile_tag_query
+
+
+class Command(BaseCommand):
+    help = "Compare the old OR-only @tags: filter with compiled tag queries on a synthetic library"
+
+    path_prefix = "/home/bench_tag_query/"
+    tag_prefix = "bench_tag_query "
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument("--rows", type=int, default=20000, help="number of synthetic Audio rows")
+        parser.add_argument("--tags", type=int, default=50, help="number of synthetic tags")
+        parser.add_argument("--tags-per-row", type=int, default=4)
+        parser.add_argument("--repeat", type=int, default=5, help="runs per query")
+
+    def handle(self, *args, **options):
+        self.cleanup()
+        try:
+            titles = self.populate(options["rows"], options["tags"], options["tags_per_row"])
+            a, b, c, d = (f"{self.tag_prefix}{title}" for title in titles[:4])
+            self.compare(f"{a},{b}", options["repeat"], legacy=True)
+            for query in (f"{a} & {b}", f"({a} & {b}) | {c} & !{d}", f"!{a}"):
+                self.compare(query, options["repeat"])
+        finally:
+            self.cleanup()
+
+    def populate(self, rows, tags, tags_per_row):
+        random.seed(0)
+        titles = [f"{i:03d}" for i in range(tags)]
+        tag_objects = Tag.objects.bulk_create(Tag(title=f"{self.tag_prefix}{title}") for title in titles)
+        audio = Audio.objects.bulk_create(
+            (
+                Audio(title=f"track {i}", path=f"{self.path_prefix}{i}.mp3", md5_hex=f"bench_tag_query:{i}")
+                for i in range(rows)
+            ),
+            batch_size=1000,
+        )
+        through = Audio.tags.through
+        through.objects.bulk_create(
+            (
+                through(audio_id=item.id, tag_id=tag.id)
+                for item in audio
+                for tag in random.sample(tag_objects, tags_per_row)
+            ),
+            batch_size=1000,
+        )
+        return titles
+
+    def compare(self, query, repeat, legacy=False):
+        queryset = Audio.objects.filter(path__startswith=self.path_prefix)
+        if legacy:
+            # the pre-compiler implementation of "@tags:a,b;"
+            q = Q()
+            for tag in Tag.objects.filter(title__in=[p.strip() for p in query.split(",")]):
+                q |= Q(tags__in=[tag])
+            self.report("legacy  ", query, queryset.filter(q), repeat)
+        self.report("compiled", query, queryset.filter(compile_tag_query(Audio, query)), repeat)
+
+    def report(self, label, query, queryset, repeat):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            rows = list(queryset.values_list("id", flat=True))
+            timings.append(time.perf_counter() - start)
+        query = query.replace(self.tag_prefix, "")
+        self.stdout.write(
+            f"{label} {query:<24} rows={len(rows):<7} distinct={len(set(rows)):<7} "
+            f"best={min(timings) * 1000:.1f}ms"
+        )
+
+    def cleanup(self):
+        Audio.objects.filter(path__startswith=self.path_prefix).delete()
+        Tag.objects.filter(title__startswith=self.tag_prefix).delete()
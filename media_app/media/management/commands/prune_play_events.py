@@ -0,0 +1,31 @@
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandParser
+from django.utils import timezone
+from media.stats import prune_play_events
+
+
+class Command(BaseCommand):
+    help = "Delete old play events and hourly play statistics, daily statistics are kept"
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument(
+            "--event-days",
+            type=int,
+            default=settings.MEDIA_PLAY_EVENT_RETENTION_DAYS,
+            help="keep raw play events of this many days",
+        )
+        parser.add_argument(
+            "--hourly-days",
+            type=int,
+            default=settings.MEDIA_PLAY_STAT_HOURLY_RETENTION_DAYS,
+            help="keep hourly play statistics of this many days",
+        )
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        events, hourly = prune_play_events(
+            now - timedelta(days=options["event_days"]),
+            now - timedelta(days=options["hourly_days"]),
+        )
+        print(f"deleted {events} play events and {hourly} hourly statistics")
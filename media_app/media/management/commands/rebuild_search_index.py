@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand, CommandError
+from media.search import has_search_index, rebuild_search_index
+
+
+class Command(BaseCommand):
+    help = "Rebuild the media_search full-text index from Audio, Radio and Video"
+
+    def handle(self, *args, **options):
+        if not has_search_index():
+            raise CommandError("the full-text index is only maintained on SQLite")
+        print(f"indexed {rebuild_search_index()} media")
@@ -0,0 +1,61 @@
+import signal
+import time
+from django.core.management.base import BaseCommand, CommandParser
+from django.db import close_old_connections
+from media.jobs import (
+    claim_jobs, enqueue_missing_backfills, get_worker_name, purge_finished_jobs, retry_failed_jobs, run_job
+)
+from media.management.commands.add_media import eprint
+
+
+class Command(BaseCommand):
+    help = "Process queued media maintenance jobs, several workers may run side by side"
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument(
+            "--enqueue-missing",
+            action="store_true",
+            help="queue a backfill job for every file without md5_hex, file_size or duration",
+        )
+        parser.add_argument(
+            "--retry-failed",
+            action="store_true",
+            help="queue failed jobs again, they are kept and block re-queueing otherwise",
+        )
+        parser.add_argument(
+            "--once", action="store_true", help="exit when no job is ready instead of polling"
+        )
+        parser.add_argument("--batch-size", type=int, default=10, help="jobs claimed at a time")
+        parser.add_argument(
+            "--poll-interval", type=float, default=2, help="seconds to wait when the queue is empty"
+        )
+
+    def handle(self, *args, **options):
+        self.stopping = False
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        if options["enqueue_missing"]:
+            print(f"queued {enqueue_missing_backfills()} backfill jobs")
+        if options["retry_failed"]:
+            print(f"queued {retry_failed_jobs()} failed jobs again")
+        worker = get_worker_name()
+        purge_finished_jobs()
+        while not self.stopping:
+            jobs = claim_jobs(worker, options["batch_size"])
+            for job in jobs:
+                # claimed jobs are finished before stopping, otherwise they
+                # would wait for MEDIA_JOB_LOCK_TIMEOUT
+                if run_job(job, worker):
+                    if options["verbosity"] > 0:
+                        print("done", job)
+                else:
+                    eprint("failed", job)
+            close_old_connections()
+            if not jobs:
+                if options["once"]:
+                    break
+                time.sleep(options["poll_interval"])
+                purge_finished_jobs()
+
+    def stop(self, signum, frame):
+        self.stopping = True
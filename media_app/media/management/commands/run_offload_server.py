@@ -0,0 +1,12 @@
+from django.core.management.commands.runserver import Command as RunserverCommand
+from media.offload import OffloadApplication
+
+
+class Command(RunserverCommand):
+    help = (
+        "Start a development server that emulates nginx X-Accel-Redirect and "
+        "X-Sendfile offload for the media file stream"
+    )
+
+    def get_handler(self, *args, **options):
+        return OffloadApplication(super().get_handler(*args, **options))
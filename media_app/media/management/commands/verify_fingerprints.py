@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand, CommandParser
+from django.db import IntegrityError
+from media.db import write_atomic
+from media.fingerprint import get_fingerprint, is_sampled_fingerprint
+from media.management.commands.add_media import eprint
+from media.models import Audio, MediaProbe, Video
+
+
+class Command(BaseCommand):
+    help = "Replace sampled fingerprints with a full content hash"
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument(
+            "--fingerprint",
+            choices=("md5", "blake2b"),
+            default="md5",
+            dest="fingerprint",
+            help="full hash to store",
+        )
+
+    def handle(self, *args, **options):
+        for media_class in (Audio, Video):
+            queryset = media_class.objects.filter(md5_hex__startswith="sampled:")
+            for media in queryset.iterator():
+                if not is_sampled_fingerprint(media.md5_hex):
+                    continue
+                try:
+                    file_path = media.get_processed_path()
+                    old = media.md5_hex
+                    media.md5_hex = get_fingerprint(file_path, options["fingerprint"])
+                    with write_atomic():
+                        media.save(update_fields=("md5_hex", "updated"))
+                        # the probe is keyed by the fingerprint, keep it
+                        # instead of running ffprobe again
+                        probes = MediaProbe.objects.filter(fingerprint=old)
+                        if MediaProbe.objects.filter(fingerprint=media.md5_hex).exists():
+                            probes.delete()
+                        else:
+                            probes.update(fingerprint=media.md5_hex)
+                    print(file_path)
+                except (OSError, NotImplementedError, IntegrityError) as e:
+                    eprint(media.path, e)
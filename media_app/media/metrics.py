@@ -0,0 +1,346 @@
+import atexit
+from contextlib import contextmanager
+import fcntl
+import json
+import logging
+import os
+from pathlib import Path
+import threading
+import time
+from django.conf import settings
+from django.http.response import FileResponse
+
+
+logger = logging.getLogger(__name__)
+
+default_buckets = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 30, 60, 300, 1800)
+# counters and histograms of exited processes, merged by collect()
+aggregate_name = "aggregate.json"
+
+
+class MetricsStore:
+    # Samples of this process, written to MEDIA_METRICS_DIR/<pid>.json every
+    # MEDIA_METRICS_FLUSH_INTERVAL seconds. /metrics sums the files of all
+    # processes, gauges only count while their process is alive.
+    def __init__(self):
+        self.values = {}
+        self.dirty = False
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.thread = None
+        self.pid = None
+        self.flushed_pid = None
+
+    def add(self, key, amount):
+        with self.lock:
+            if self.pid != os.getpid():
+                # a forked worker starts from zero, the parent keeps its file
+                self.pid = os.getpid()
+                self.values = {}
+                self.thread = threading.Thread(target=self.run, name="media-metrics", daemon=True)
+                self.thread.start()
+            self.values[key] = self.values.get(key, 0) + amount
+            self.dirty = True
+
+    def run(self):
+        while True:
+            time.sleep(settings.MEDIA_METRICS_FLUSH_INTERVAL)
+            self.flush()
+
+    def get_values(self):
+        with self.lock:
+            if self.pid != os.getpid():
+                return {}
+            return dict(self.values)
+
+    def flush(self):
+        with self.flush_lock:
+            with self.lock:
+                if not self.dirty or self.pid != os.getpid():
+                    return
+                values = list(self.values.items())
+                self.dirty = False
+            directory = Path(settings.MEDIA_METRICS_DIR)
+            path = directory / f"{self.pid}.json"
+            try:
+                if self.flushed_pid != self.pid:
+                    # a file left by an exited process with the same pid
+                    with locked_directory(directory):
+                        if path.exists():
+                            merge_into_aggregate(directory, [path])
+                        write_samples(path, values)
+                    self.flushed_pid = self.pid
+                else:
+                    write_samples(path, values)
+            except OSError:
+                logger.exception("media metrics flush to %s failed", path)
+                with self.lock:
+                    self.dirty = True
+
+
+store = MetricsStore()
+atexit.register(store.flush)
+metrics = {}
+
+
+def flush_metrics():
+    # multiprocessing workers leave with os._exit() and skip atexit
+    store.flush()
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        metrics[name] = self
+
+    def add(self, name, labels, amount):
+        if settings.MEDIA_METRICS:
+            store.add((name, tuple(zip(self.labelnames, labels))), amount)
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, *labels, amount=1):
+        self.add(self.name, labels, amount)
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def inc(self, *labels, amount=1):
+        self.add(self.name, labels, amount)
+
+    def dec(self, *labels, amount=1):
+        self.add(self.name, labels, -amount)
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=default_buckets):
+        super().__init__(name, help, labelnames)
+        self.buckets = buckets
+
+    def observe(self, *labels, value):
+        # only the first matching bucket is stored, render() accumulates them
+        bucket = next((str(le) for le in self.buckets if value <= le), "+Inf")
+        self.add(f"{self.name}_bucket", labels + (bucket,), 1)
+        self.add(f"{self.name}_sum", labels, value)
+        self.add(f"{self.name}_count", labels, 1)
+
+    def add(self, name, labels, amount):
+        if settings.MEDIA_METRICS:
+            labelnames = self.labelnames + ("le",) if name.endswith("_bucket") else self.labelnames
+            store.add((name, tuple(zip(labelnames, labels))), amount)
+
+
+streams_active = Gauge("media_streams_active", "Media file streams being sent", ("type",))
+stream_requests = Counter(
+    "media_stream_requests_total", "Media file stream responses", ("type", "status")
+)
+stream_bytes = Counter("media_stream_bytes_total", "Media file stream body bytes sent", ("type",))
+stream_errors = Counter(
+    "media_stream_errors_total", "Media file streams that failed while reading", ("type",)
+)
+stream_chunk_seconds = Histogram(
+    "media_stream_chunk_seconds", "Time to read one chunk of a media file stream", ("type",)
+)
+stream_seconds = Histogram(
+    "media_stream_duration_seconds", "Time from the view to the end of a media file stream", ("type",)
+)
+radio_upstream_errors = Counter(
+    "media_radio_upstream_errors_total", "Radio relay upstream connections that failed"
+)
+play_count_updates = Counter("media_play_count_updates_total", "Play count reports", ("type",))
+duration_updates = Counter("media_duration_updates_total", "Duration reports", ("type",))
+ingest_files = Counter(
+    "media_ingest_files_total", "Files handled by add_media per stage", ("stage",)
+)
+ingest_seconds = Histogram(
+    "media_ingest_stage_seconds", "Time add_media spends per file or batch and stage", ("stage",)
+)
+
+
+def is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def is_gauge(name):
+    metric = metrics.get(name)
+    return metric is not None and metric.type == "gauge"
+
+
+@contextmanager
+def locked_directory(directory):
+    directory.mkdir(parents=True, exist_ok=True)
+    with open(directory / "lock", "w") as fh:
+        fcntl.flock(fh, fcntl.LOCK_EX)
+        yield
+
+
+def read_samples(path):
+    try:
+        with open(path) as fh:
+            return [((name, tuple(map(tuple, labels))), value) for name, labels, value in json.load(fh)]
+    except (OSError, ValueError):
+        return []
+
+
+def write_samples(path, values):
+    with open(path.with_suffix(".tmp"), "w") as fh:
+        json.dump([[name, labels, value] for (name, labels), value in values], fh)
+    os.replace(path.with_suffix(".tmp"), path)
+
+
+def merge_into_aggregate(directory, paths):
+    # Called with the directory locked. Gauges of exited processes are
+    # dropped, counters and histograms are kept in one file so the number of
+    # files stays bounded and a reused pid cannot reset them.
+    totals = dict(read_samples(directory / aggregate_name))
+    for path in paths:
+        for key, value in read_samples(path):
+            if not is_gauge(key[0]):
+                totals[key] = totals.get(key, 0) + value
+    write_samples(directory / aggregate_name, totals.items())
+    for path in paths:
+        path.unlink(missing_ok=True)
+
+
+def collect():
+    directory = Path(settings.MEDIA_METRICS_DIR)
+    own = store.get_values()
+    samples = [own.items()]
+    with locked_directory(directory):
+        dead = []
+        for path in directory.glob("*.json"):
+            if not path.stem.isdigit():
+                continue
+            pid = int(path.stem)
+            if pid == os.getpid():
+                if not own:
+                    samples.append(read_samples(path))
+            elif is_alive(pid):
+                samples.append(read_samples(path))
+            else:
+                dead.append(path)
+        if dead:
+            merge_into_aggregate(directory, dead)
+        samples.append(read_samples(directory / aggregate_name))
+    totals = {}
+    for values in samples:
+        for key, value in values:
+            totals[key] = totals.get(key, 0) + value
+    return totals
+
+
+def format_sample(name, labels, value):
+    if labels:
+        text = ",".join('%s="%s"' % (k, str(v).replace("\\", "\\\\").replace('"', '\\"')) for k, v in labels)
+        name = f"{name}{{{text}}}"
+    return f"{name} {value!r}"
+
+
+def render():
+    totals = collect()
+    lines = []
+    for metric in metrics.values():
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.type}")
+        if metric.type != "histogram":
+            for (name, labels), value in sorted(totals.items()):
+                if name == metric.name:
+                    lines.append(format_sample(name, labels, value))
+            continue
+        series = sorted({labels for name, labels in totals if name == f"{metric.name}_count"})
+        for labels in series:
+            cumulative = 0
+            for le in [str(le) for le in metric.buckets] + ["+Inf"]:
+                cumulative += totals.get((f"{metric.name}_bucket", labels + (("le", le),)), 0)
+                lines.append(format_sample(f"{metric.name}_bucket", labels + (("le", le),), cumulative))
+            lines.append(format_sample(f"{metric.name}_sum", labels, totals[(f"{metric.name}_sum", labels)]))
+            lines.append(format_sample(f"{metric.name}_count", labels, totals[(f"{metric.name}_count", labels)]))
+    return "\n".join(lines) + "\n"
+
+
+def iter_metered(media_type, iterator, close):
+    iterator = iter(iterator)
+    try:
+        while True:
+            start = time.perf_counter()
+            try:
+                chunk = next(iterator)
+            except StopIteration:
+                return
+            stream_chunk_seconds.observe(media_type, value=time.perf_counter() - start)
+            stream_bytes.inc(media_type, amount=len(chunk))
+            yield chunk
+    except Exception:
+        stream_errors.inc(media_type)
+        raise
+    finally:
+        close()
+
+
+async def aiter_metered(media_type, iterator, close):
+    iterator = aiter(iterator)
+    try:
+        while True:
+            start = time.perf_counter()
+            try:
+                chunk = await anext(iterator)
+            except StopAsyncIteration:
+                return
+            stream_chunk_seconds.observe(media_type, value=time.perf_counter() - start)
+            stream_bytes.inc(media_type, amount=len(chunk))
+            yield chunk
+    except Exception:
+        stream_errors.inc(media_type)
+        raise
+    finally:
+        close()
+
+
+def instrument_stream(media_type, response):
+    # Counts the stream as active until the server closes the response.
+    # FileResponse bodies may go out through wsgi.file_wrapper, so they are
+    # counted by Content-Length instead of per chunk.
+    if not settings.MEDIA_METRICS:
+        return response
+    start = time.monotonic()
+    streams_active.inc(media_type)
+    stream_requests.inc(media_type, str(response.status_code))
+    sent_bytes = 0
+    closed = []
+
+    def close():
+        # wsgiref skips close() when the client hangs up, the metered
+        # iterator calls it again when it is collected
+        if closed:
+            return
+        closed.append(True)
+        if sent_bytes:
+            stream_bytes.inc(media_type, amount=sent_bytes)
+        streams_active.dec(media_type)
+        stream_seconds.observe(media_type, value=time.monotonic() - start)
+
+    if not response.streaming:
+        sent_bytes = len(response.content)
+    elif isinstance(response, FileResponse):
+        sent_bytes = int(response.get("Content-Length", 0))
+    elif response.is_async:
+        response.streaming_content = aiter_metered(media_type, response.streaming_content, close)
+    else:
+        response.streaming_content = iter_metered(media_type, response.streaming_content, close)
+    response._resource_closers.append(close)
+    return response
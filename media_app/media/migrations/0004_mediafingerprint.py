@@ -0,0 +1,25 @@
+# Generated by Django 5.0.3 on 2026-10-18 06:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('media', '0003_audio_play_count_radio_play_count_video_play_count'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MediaFingerprint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('updated', models.DateTimeField(auto_now=True)),
+                ('path', models.CharField(max_length=200, unique=True)),
+                ('size', models.BigIntegerField()),
+                ('mtime_ns', models.BigIntegerField()),
+                ('inode', models.BigIntegerField()),
+                ('media_type', models.CharField(blank=True, default='', max_length=5)),
+            ],
+        ),
+    ]
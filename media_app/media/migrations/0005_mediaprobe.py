@@ -0,0 +1,33 @@
+# Generated by Django 5.0.3 on 2026-10-18 06:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('media', '0004_mediafingerprint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MediaProbe',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('updated', models.DateTimeField(auto_now=True)),
+                ('fingerprint', models.CharField(max_length=200, unique=True)),
+                ('media_type', models.CharField(blank=True, default='', max_length=5)),
+                ('format_name', models.CharField(blank=True, default='', max_length=200)),
+                ('duration', models.DurationField(blank=True, null=True)),
+                ('bit_rate', models.IntegerField(blank=True, null=True)),
+                ('audio_codec', models.CharField(blank=True, default='', max_length=50)),
+                ('sample_rate', models.IntegerField(blank=True, null=True)),
+                ('channels', models.IntegerField(blank=True, null=True)),
+                ('video_codec', models.CharField(blank=True, default='', max_length=50)),
+                ('width', models.IntegerField(blank=True, null=True)),
+                ('height', models.IntegerField(blank=True, null=True)),
+                ('data', models.JSONField(blank=True, default=dict)),
+            ],
+        ),
+    ]
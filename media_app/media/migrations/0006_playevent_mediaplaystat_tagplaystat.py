@@ -0,0 +1,63 @@
+# Generated by Django 5.0.3 on 2026-10-18 06:41
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('media', '0005_mediaprobe'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PlayEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(db_index=True)),
+                ('media_type', models.CharField(max_length=5)),
+                ('media_id', models.BigIntegerField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='TagPlayStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('hour', 'hour'), ('day', 'day')], max_length=4)),
+                ('start', models.DateTimeField()),
+                ('play_count', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='MediaPlayStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('hour', 'hour'), ('day', 'day')], max_length=4)),
+                ('start', models.DateTimeField()),
+                ('media_type', models.CharField(max_length=5)),
+                ('media_id', models.BigIntegerField()),
+                ('play_count', models.IntegerField(default=0)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['period', 'media_type', 'start'], name='media_media_period_c8181a_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='mediaplaystat',
+            constraint=models.UniqueConstraint(fields=('period', 'start', 'media_type', 'media_id'), name='unique_media_play_stat'),
+        ),
+        migrations.AddField(
+            model_name='tagplaystat',
+            name='tag',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='media.tag'),
+        ),
+        migrations.AddIndex(
+            model_name='tagplaystat',
+            index=models.Index(fields=['period', 'start'], name='media_tagpl_period_0cb3ad_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='tagplaystat',
+            constraint=models.UniqueConstraint(fields=('period', 'start', 'tag'), name='unique_tag_play_stat'),
+        ),
+    ]
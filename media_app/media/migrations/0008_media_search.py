@@ -0,0 +1,91 @@
+from django.db import migrations
+
+
+media_type_codes = {"audio": 1, "radio": 2, "video": 3}
+
+
+def get_tags_sql(media_type, media_id):
+    return (
+        f"(SELECT coalesce(group_concat(media_tag.title, ' '), '') FROM media_tag "
+        f"INNER JOIN media_{media_type}_tags ON media_{media_type}_tags.tag_id = media_tag.id "
+        f"WHERE media_{media_type}_tags.{media_type}_id = {media_id})"
+    )
+
+
+def get_forward_sql():
+    statements = [
+        "CREATE VIRTUAL TABLE media_search USING fts5("
+        "media_type UNINDEXED, media_id UNINDEXED, title, description, tags, "
+        "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+    ]
+    tag_updates = []
+    for media_type, code in media_type_codes.items():
+        table = f"media_{media_type}"
+        statements += [
+            f"CREATE TRIGGER media_search_{media_type}_insert AFTER INSERT ON {table} BEGIN "
+            "INSERT INTO media_search(rowid, media_type, media_id, title, description, tags) "
+            f"VALUES (NEW.id * 4 + {code}, '{media_type}', NEW.id, NEW.title, NEW.description, "
+            f"{get_tags_sql(media_type, 'NEW.id')}); END",
+            f"CREATE TRIGGER media_search_{media_type}_update AFTER UPDATE OF title, description "
+            f"ON {table} BEGIN UPDATE media_search SET title = NEW.title, "
+            f"description = NEW.description WHERE rowid = NEW.id * 4 + {code}; END",
+            f"CREATE TRIGGER media_search_{media_type}_delete AFTER DELETE ON {table} BEGIN "
+            f"DELETE FROM media_search WHERE rowid = OLD.id * 4 + {code}; END",
+        ]
+        for event, row in (("insert", "NEW"), ("delete", "OLD")):
+            statements.append(
+                f"CREATE TRIGGER media_search_{media_type}_tags_{event} "
+                f"AFTER {event.upper()} ON {table}_tags BEGIN "
+                f"UPDATE media_search SET tags = {get_tags_sql(media_type, f'{row}.{media_type}_id')} "
+                f"WHERE rowid = {row}.{media_type}_id * 4 + {code}; END"
+            )
+        tag_updates.append(
+            f"UPDATE media_search SET tags = {get_tags_sql(media_type, 'media_search.media_id')} "
+            f"WHERE rowid IN (SELECT {media_type}_id * 4 + {code} FROM {table}_tags "
+            "WHERE tag_id = NEW.id);"
+        )
+        statements.append(
+            "INSERT INTO media_search(rowid, media_type, media_id, title, description, tags) "
+            f"SELECT id * 4 + {code}, '{media_type}', id, title, description, "
+            f"{get_tags_sql(media_type, f'{table}.id')} FROM {table}"
+        )
+    statements.append(
+        "CREATE TRIGGER media_search_tag_update AFTER UPDATE OF title ON media_tag BEGIN "
+        + " ".join(tag_updates)
+        + " END"
+    )
+    return statements
+
+
+def get_reverse_sql():
+    statements = ["DROP TRIGGER IF EXISTS media_search_tag_update"]
+    for media_type in media_type_codes:
+        for event in ("insert", "update", "delete", "tags_insert", "tags_delete"):
+            statements.append(f"DROP TRIGGER IF EXISTS media_search_{media_type}_{event}")
+    statements.append("DROP TABLE IF EXISTS media_search")
+    return statements
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != "sqlite":
+        return
+    for statement in get_forward_sql():
+        schema_editor.execute(statement)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != "sqlite":
+        return
+    for statement in get_reverse_sql():
+        schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('media', '0007_mediajob'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
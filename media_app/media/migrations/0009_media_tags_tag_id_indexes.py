@@ -0,0 +1,22 @@
+from django.db import migrations
+
+
+media_types = ("audio", "radio", "video")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('media', '0008_media_search'),
+    ]
+
+    # The through tables only have (media_id, tag_id) unique and single column
+    # indexes; tag queries that start from a tag need (tag_id, media_id).
+    operations = [
+        migrations.RunSQL(
+            f"CREATE INDEX media_{media_type}_tags_tag_id_{media_type}_id "
+            f"ON media_{media_type}_tags (tag_id, {media_type}_id)",
+            f"DROP INDEX media_{media_type}_tags_tag_id_{media_type}_id",
+        )
+        for media_type in media_types
+    ]
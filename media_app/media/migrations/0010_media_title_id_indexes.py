@@ -0,0 +1,25 @@
+# Generated by Django 5.0.3 on 2026-10-18 06:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('media', '0009_media_tags_tag_id_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='audio',
+            index=models.Index(fields=['title', 'id'], name='media_audio_title_id'),
+        ),
+        migrations.AddIndex(
+            model_name='radio',
+            index=models.Index(fields=['title', 'id'], name='media_radio_title_id'),
+        ),
+        migrations.AddIndex(
+            model_name='video',
+            index=models.Index(fields=['title', 'id'], name='media_video_title_id'),
+        ),
+    ]
@@ -0,0 +1,112 @@
+# Generated by Django 5.0.3 on 2026-10-18 06:52
+
+from django.db import migrations, models
+
+
+media_type_codes = {"audio": 1, "radio": 2, "video": 3}
+columns = "id, media_type, media_id, created, updated, title, path, duration, tags, play_count"
+
+
+def get_tags_sql(media_type, media_id):
+    return (
+        f"(SELECT coalesce(group_concat(media_tag.title, ', '), '') FROM media_tag "
+        f"INNER JOIN media_{media_type}_tags ON media_{media_type}_tags.tag_id = media_tag.id "
+        f"WHERE media_{media_type}_tags.{media_type}_id = {media_id})"
+    )
+
+
+def get_values_sql(media_type, row):
+    duration = "NULL" if media_type == "radio" else f"{row}.duration"
+    return (
+        f"{row}.id * 4 + {media_type_codes[media_type]}, '{media_type}', {row}.id, "
+        f"{row}.created, {row}.updated, {row}.title, {row}.path, {duration}, "
+        f"{get_tags_sql(media_type, f'{row}.id')}, {row}.play_count"
+    )
+
+
+def get_forward_sql():
+    statements = []
+    tag_updates = []
+    for media_type, code in media_type_codes.items():
+        table = f"media_{media_type}"
+        statements += [
+            f"INSERT INTO media_mediaindex ({columns}) "
+            f"SELECT {get_values_sql(media_type, table)} FROM {table}",
+            f"CREATE TRIGGER media_mediaindex_{media_type}_insert AFTER INSERT ON {table} BEGIN "
+            f"INSERT INTO media_mediaindex ({columns}) VALUES ({get_values_sql(media_type, 'NEW')}); END",
+            f"CREATE TRIGGER media_mediaindex_{media_type}_update AFTER UPDATE ON {table} BEGIN "
+            f"UPDATE media_mediaindex SET updated = NEW.updated, title = NEW.title, path = NEW.path, "
+            f"duration = {'NULL' if media_type == 'radio' else 'NEW.duration'}, "
+            f"play_count = NEW.play_count WHERE id = NEW.id * 4 + {code}; END",
+            f"CREATE TRIGGER media_mediaindex_{media_type}_delete AFTER DELETE ON {table} BEGIN "
+            f"DELETE FROM media_mediaindex WHERE id = OLD.id * 4 + {code}; END",
+        ]
+        for event, row in (("insert", "NEW"), ("delete", "OLD")):
+            statements.append(
+                f"CREATE TRIGGER media_mediaindex_{media_type}_tags_{event} "
+                f"AFTER {event.upper()} ON {table}_tags BEGIN "
+                f"UPDATE media_mediaindex SET tags = {get_tags_sql(media_type, f'{row}.{media_type}_id')} "
+                f"WHERE id = {row}.{media_type}_id * 4 + {code}; END"
+            )
+        tag_updates.append(
+            f"UPDATE media_mediaindex SET tags = {get_tags_sql(media_type, 'media_mediaindex.media_id')} "
+            f"WHERE id IN (SELECT {media_type}_id * 4 + {code} FROM {table}_tags "
+            "WHERE tag_id = NEW.id);"
+        )
+    statements.append(
+        "CREATE TRIGGER media_mediaindex_tag_update AFTER UPDATE OF title ON media_tag BEGIN "
+        + " ".join(tag_updates)
+        + " END"
+    )
+    return statements
+
+
+def get_reverse_sql():
+    statements = ["DROP TRIGGER IF EXISTS media_mediaindex_tag_update"]
+    for media_type in media_type_codes:
+        for event in ("insert", "update", "delete", "tags_insert", "tags_delete"):
+            statements.append(f"DROP TRIGGER IF EXISTS media_mediaindex_{media_type}_{event}")
+    return statements
+
+
+def create_triggers(apps, schema_editor):
+    if schema_editor.connection.vendor != "sqlite":
+        return
+    for statement in get_forward_sql():
+        schema_editor.execute(statement)
+
+
+def drop_triggers(apps, schema_editor):
+    if schema_editor.connection.vendor != "sqlite":
+        return
+    for statement in get_reverse_sql():
+        schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('media', '0010_media_title_id_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MediaIndex',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('media_type', models.CharField(max_length=5)),
+                ('media_id', models.BigIntegerField()),
+                ('created', models.DateTimeField()),
+                ('updated', models.DateTimeField()),
+                ('title', models.CharField(max_length=200)),
+                ('path', models.CharField(max_length=200)),
+                ('duration', models.DurationField(blank=True, null=True)),
+                ('tags', models.TextField(blank=True, default='')),
+                ('play_count', models.IntegerField(default=0)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['created', 'id'], name='media_media_created_2135e6_idx'), models.Index(fields=['updated', 'id'], name='media_media_updated_0b92dc_idx'), models.Index(fields=['title', 'id'], name='media_media_title_db0bdf_idx'), models.Index(fields=['play_count', 'id'], name='media_media_play_co_b6a36c_idx'), models.Index(fields=['duration', 'id'], name='media_media_duratio_7b028a_idx'), models.Index(fields=['path'], name='media_media_path_177c19_idx')],
+            },
+        ),
+        migrations.RunPython(create_triggers, drop_triggers),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.0.3 on 2026-10-18 06:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('media', '0011_mediaindex'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='audio',
+            index=models.Index(fields=['play_count', 'id'], name='media_audio_play_count_id'),
+        ),
+        migrations.AddIndex(
+            model_name='audio',
+            index=models.Index(fields=['updated', 'id'], name='media_audio_updated_id'),
+        ),
+        migrations.AddIndex(
+            model_name='audio',
+            index=models.Index(fields=['duration', 'id'], name='media_audio_duration_id'),
+        ),
+        migrations.AddIndex(
+            model_name='radio',
+            index=models.Index(fields=['play_count', 'id'], name='media_radio_play_count_id'),
+        ),
+        migrations.AddIndex(
+            model_name='radio',
+            index=models.Index(fields=['updated', 'id'], name='media_radio_updated_id'),
+        ),
+        migrations.AddIndex(
+            model_name='video',
+            index=models.Index(fields=['play_count', 'id'], name='media_video_play_count_id'),
+        ),
+        migrations.AddIndex(
+            model_name='video',
+            index=models.Index(fields=['updated', 'id'], name='media_video_updated_id'),
+        ),
+        migrations.AddIndex(
+            model_name='video',
+            index=models.Index(fields=['duration', 'id'], name='media_video_duration_id'),
+        ),
+    ]
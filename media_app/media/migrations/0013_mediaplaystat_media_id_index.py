@@ -0,0 +1,17 @@
+# Generated by Django 5.0.3 on 2026-10-18 07:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('media', '0012_media_play_count_updated_duration_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='mediaplaystat',
+            index=models.Index(fields=['period', 'media_type', 'media_id', 'start'], name='media_media_period_60e8a2_idx'),
+        ),
+    ]
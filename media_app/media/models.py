@@ -1,9 +1,12 @@
 from datetime import timedelta
-from hashlib import md5
 from pathlib import Path
 from urllib.parse import urlparse, unquote
 from urllib.request import urlopen
+from django.conf import settings
 from django.db import models
+from media.fingerprint import is_sampled_fingerprint
+from media.radio import aiter_relay, aiter_url, iter_relay
+from media.streaming import aiter_file_range
 
 
 class Tag(models.Model):
@@ -35,6 +38,11 @@ class Media(models.Model):
 
     class Meta:
         abstract = True
+        indexes = (
+            models.Index(fields=("title", "id"), name="%(app_label)s_%(class)s_title_id"),
+            models.Index(fields=("play_count", "id"), name="%(app_label)s_%(class)s_play_count_id"),
+            models.Index(fields=("updated", "id"), name="%(app_label)s_%(class)s_updated_id"),
+        )
 
     def __str__(self):
         return self.title
@@ -48,14 +56,23 @@ class Media(models.Model):
     def get_fd_iterator(self):
         raise NotImplementedError()
 
+    def aget_fd_iterator(self):
+        raise NotImplementedError()
+
 
-class Audio(Media):
+class FileMedia(Media):
     chunk_size = 1024 * 1024
 
     file_size = models.IntegerField(blank=False, null=False, default=0)
     md5_hex = models.CharField(max_length=200, blank=False, null=False, unique=True)
     duration = models.DurationField(blank=False, null=False, default=timedelta(seconds=0))
-    
+
+    class Meta(Media.Meta):
+        abstract = True
+        indexes = Media.Meta.indexes + (
+            models.Index(fields=("duration", "id"), name="%(app_label)s_%(class)s_duration_id"),
+        )
+
     def get_processed_path(self):
         if self.path.startswith("file://"):
             file_path = Path(unquote(urlparse(self.path).path))
@@ -64,25 +81,39 @@ class Audio(Media):
         else:
             raise NotImplementedError()
         return file_path
-    
-    def get_fd_iterator(self):
+
+    def get_etag(self, stat):
+        # md5_hex is as old as the last ingest and a sampled one does not
+        # cover every byte, the stat keeps the ETag strong for the file on disk
+        validator = f"{stat.st_mtime_ns:x}-{stat.st_size:x}"
+        if self.md5_hex and not is_sampled_fingerprint(self.md5_hex):
+            return f'"{self.md5_hex}-{validator}"'
+        return f'"{validator}"'
+
+    def get_fd_iterator(self, start=0, length=None):
         chunk_size = self.__class__.chunk_size
         with self.get_processed_path().open("rb") as file:
-            if self.md5_hex == "":
-                md5_buf = md5(b"")
-                chunk = file.read(chunk_size)
-                while chunk:
-                    md5_buf.update(chunk)
-                    yield chunk
-                    chunk = file.read(chunk_size)
-                self.md5_hex = md5_buf.hexdigest()
-                self.save()
-            else:
-                chunk = file.read(chunk_size)
-                while chunk:
-                    yield chunk
-                    chunk = file.read(chunk_size)
-    
+            file.seek(start)
+            remaining = length
+            while remaining is None or remaining > 0:
+                size = chunk_size if remaining is None else min(chunk_size, remaining)
+                chunk = file.read(size)
+                if not chunk:
+                    break
+                if remaining is not None:
+                    remaining -= len(chunk)
+                yield chunk
+
+    def aget_fd_iterator(self, start=0, length=None):
+        return aiter_file_range(self.get_processed_path(), start, length)
+
+    def get_probe(self):
+        return MediaProbe.objects.filter(fingerprint=self.md5_hex).first()
+
+
+class Audio(FileMedia):
+    pass
+
 
 class Radio(Media):
     chunk_size = 1024
@@ -93,6 +124,11 @@ class Radio(Media):
         return urlparse(self.path)
     
     def get_fd_iterator(self):
+        if settings.MEDIA_RADIO_RELAY:
+            return iter_relay(self.get_processed_path().geturl())
+        return self.iter_url()
+
+    def iter_url(self):
         chunk_size = self.__class__.chunk_size
         with urlopen(self.get_processed_path().geturl()) as file:
             chunk = file.read(chunk_size)
@@ -100,37 +136,170 @@ class Radio(Media):
                 yield chunk
                 chunk = file.read(chunk_size)
 
+    def aget_fd_iterator(self):
+        if settings.MEDIA_RADIO_RELAY:
+            return aiter_relay(self.get_processed_path().geturl())
+        return aiter_url(self.get_processed_path().geturl(), self.__class__.chunk_size)
 
-class Video(Media):
-    chunk_size = 1024 * 1024
 
-    file_size = models.IntegerField(blank=False, null=False, default=0)
-    md5_hex = models.CharField(max_length=200, blank=False, null=False, unique=True)
-    duration = models.DurationField(blank=False, null=False, default=timedelta(seconds=0))
-    
-    def get_processed_path(self):
-        if self.path.startswith("file://"):
-            file_path = Path(unquote(urlparse(self.path).path))
-        elif self.path.startswith("/home/"):
-            file_path = Path(self.path)
-        else:
-            raise NotImplementedError()
-        return file_path
-    
-    def get_fd_iterator(self):
-        chunk_size = self.__class__.chunk_size
-        with self.get_processed_path().open("rb") as file:
-            if self.md5_hex == "":
-                md5_buf = md5(b"")
-                chunk = file.read(chunk_size)
-                while chunk:
-                    md5_buf.update(chunk)
-                    yield chunk
-                    chunk = file.read(chunk_size)
-                self.md5_hex = md5_buf.hexdigest()
-                self.save()
-            else:
-                chunk = file.read(chunk_size)
-                while chunk:
-                    yield chunk
-                    chunk = file.read(chunk_size)
+class Video(FileMedia):
+    pass
+
+
+class MediaFingerprint(models.Model):
+    updated = models.DateTimeField(auto_now=True)
+    path = models.CharField(max_length=200, blank=False, null=False, unique=True)
+    size = models.BigIntegerField(blank=False, null=False)
+    mtime_ns = models.BigIntegerField(blank=False, null=False)
+    inode = models.BigIntegerField(blank=False, null=False)
+    media_type = models.CharField(max_length=5, blank=True, null=False, default="")
+
+    def __str__(self):
+        return self.path
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} pk={self.pk} path=\"{self.path[:50]}>\""
+
+
+class MediaProbe(models.Model):
+    created = models.DateTimeField(auto_now_add=True, editable=False)
+    updated = models.DateTimeField(auto_now=True)
+    fingerprint = models.CharField(max_length=200, blank=False, null=False, unique=True)
+    media_type = models.CharField(max_length=5, blank=True, null=False, default="")
+    format_name = models.CharField(max_length=200, blank=True, null=False, default="")
+    duration = models.DurationField(blank=True, null=True)
+    bit_rate = models.IntegerField(blank=True, null=True)
+    audio_codec = models.CharField(max_length=50, blank=True, null=False, default="")
+    sample_rate = models.IntegerField(blank=True, null=True)
+    channels = models.IntegerField(blank=True, null=True)
+    video_codec = models.CharField(max_length=50, blank=True, null=False, default="")
+    width = models.IntegerField(blank=True, null=True)
+    height = models.IntegerField(blank=True, null=True)
+    data = models.JSONField(blank=True, null=False, default=dict)
+
+    def __str__(self):
+        return self.fingerprint
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} pk={self.pk} fingerprint=\"{self.fingerprint[:50]}>\""
+
+
+class PlayEvent(models.Model):
+    created = models.DateTimeField(blank=False, null=False, db_index=True)
+    media_type = models.CharField(max_length=5, blank=False, null=False)
+    media_id = models.BigIntegerField(blank=False, null=False)
+
+    def __str__(self):
+        return f"{self.media_type} {self.media_id}"
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} pk={self.pk} media_type=\"{self.media_type}\" media_id={self.media_id}>"
+
+
+class MediaPlayStat(models.Model):
+    class Meta:
+        constraints = (
+            models.UniqueConstraint(
+                fields=("period", "start", "media_type", "media_id"), name="unique_media_play_stat"
+            ),
+        )
+        indexes = (
+            models.Index(fields=("period", "media_type", "start")),
+            # per media totals, see media.stats.get_play_count_subquery
+            models.Index(fields=("period", "media_type", "media_id", "start")),
+        )
+
+    period = models.CharField(max_length=4, choices=(("hour", "hour"), ("day", "day")))
+    start = models.DateTimeField(blank=False, null=False)
+    media_type = models.CharField(max_length=5, blank=False, null=False)
+    media_id = models.BigIntegerField(blank=False, null=False)
+    play_count = models.IntegerField(blank=False, null=False, default=0)
+
+    def __str__(self):
+        return f"{self.media_type} {self.media_id} {self.period} {self.start}"
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} pk={self.pk} period=\"{self.period}\" media_id={self.media_id}>"
+
+
+class TagPlayStat(models.Model):
+    class Meta:
+        constraints = (
+            models.UniqueConstraint(fields=("period", "start", "tag"), name="unique_tag_play_stat"),
+        )
+        indexes = (models.Index(fields=("period", "start")),)
+
+    period = models.CharField(max_length=4, choices=(("hour", "hour"), ("day", "day")))
+    start = models.DateTimeField(blank=False, null=False)
+    tag = models.ForeignKey(Tag, on_delete=models.CASCADE)
+    play_count = models.IntegerField(blank=False, null=False, default=0)
+
+    def __str__(self):
+        return f"{self.tag_id} {self.period} {self.start}"
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} pk={self.pk} period=\"{self.period}\" tag_id={self.tag_id}>"
+
+
+class MediaJob(models.Model):
+    class Meta:
+        constraints = (
+            models.UniqueConstraint(
+                fields=("kind", "media_type", "media_id"), name="unique_media_job"
+            ),
+        )
+        indexes = (models.Index(fields=("status", "run_after")),)
+
+    created = models.DateTimeField(auto_now_add=True, editable=False)
+    updated = models.DateTimeField(auto_now=True)
+    kind = models.CharField(max_length=50, blank=False, null=False)
+    media_type = models.CharField(max_length=5, blank=False, null=False)
+    media_id = models.BigIntegerField(blank=False, null=False)
+    status = models.CharField(
+        max_length=7,
+        choices=(("pending", "pending"), ("running", "running"), ("done", "done"), ("failed", "failed")),
+        default="pending",
+    )
+    attempts = models.IntegerField(blank=False, null=False, default=0)
+    run_after = models.DateTimeField(blank=False, null=False)
+    locked_by = models.CharField(max_length=100, blank=True, null=False, default="")
+    locked_at = models.DateTimeField(blank=True, null=True)
+    last_error = models.TextField(blank=True, null=False, default="")
+
+    def __str__(self):
+        return f"{self.kind} {self.media_type} {self.media_id}"
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} pk={self.pk} kind=\"{self.kind}\" status=\"{self.status}\">"
+
+
+class MediaIndex(models.Model):
+    # Read-only copy of Audio, Radio and Video maintained by the triggers of
+    # migration 0011. id = media_id * 4 + media type code (audio 1, radio 2,
+    # video 3), the same global id as the media_search rowid.
+    class Meta:
+        indexes = (
+            models.Index(fields=("created", "id")),
+            models.Index(fields=("updated", "id")),
+            models.Index(fields=("title", "id")),
+            models.Index(fields=("play_count", "id")),
+            models.Index(fields=("duration", "id")),
+            models.Index(fields=("path",)),
+        )
+
+    id = models.BigIntegerField(primary_key=True)
+    media_type = models.CharField(max_length=5, blank=False, null=False)
+    media_id = models.BigIntegerField(blank=False, null=False)
+    created = models.DateTimeField(blank=False, null=False)
+    updated = models.DateTimeField(blank=False, null=False)
+    title = models.CharField(max_length=200, blank=False, null=False)
+    path = models.CharField(max_length=200, blank=False, null=False)
+    duration = models.DurationField(blank=True, null=True)
+    tags = models.TextField(blank=True, null=False, default="")
+    play_count = models.IntegerField(blank=False, null=False, default=0)
+
+    def __str__(self):
+        return self.title
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} pk={self.pk} title=\"{self.title[:50]}>\""
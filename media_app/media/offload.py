@@ -0,0 +1,110 @@
+import os
+from pathlib import Path
+from urllib.parse import quote, unquote_to_bytes
+from django.conf import settings
+from media.http import MultipartRanges, RangeNotSatisfiable, parse_range_header
+from media.streaming import FileRange, iter_file_range
+
+
+offload_headers = ("x-accel-redirect", "x-sendfile")
+dropped_headers = offload_headers + ("content-length", "content-range")
+
+
+def get_accel_redirect_uri(path):
+    prefix = settings.MEDIA_ACCEL_REDIRECT_PREFIX.rstrip("/")
+    return prefix + quote(os.fsencode(path))
+
+
+def get_sendfile_header(path):
+    # raw path bytes survive the latin-1 header encoding unchanged
+    return os.fsencode(path).decode("latin-1")
+
+
+def resolve_offload_path(name, value):
+    match name:
+        case "x-accel-redirect":
+            prefix = settings.MEDIA_ACCEL_REDIRECT_PREFIX.rstrip("/")
+            if not value.startswith(prefix + "/"):
+                return None
+            return Path(os.fsdecode(unquote_to_bytes(value[len(prefix):])))
+        case "x-sendfile":
+            return Path(os.fsdecode(value.encode("latin-1")))
+
+
+class OffloadApplication:
+    # Local stand-in for nginx/apache: wraps a WSGI application and serves the
+    # file named by an X-Accel-Redirect/X-Sendfile header, including Range.
+    def __init__(self, application):
+        self.application = application
+
+    def __call__(self, environ, start_response):
+        captured = {}
+
+        def capture_start_response(status, headers, exc_info=None):
+            captured["status"] = status
+            captured["headers"] = headers
+            return lambda data: None
+
+        body = self.application(environ, capture_start_response)
+        headers = captured["headers"]
+        file_path = None
+        for name, value in headers:
+            if name.lower() in offload_headers:
+                file_path = resolve_offload_path(name.lower(), value)
+        if file_path is None:
+            start_response(captured["status"], headers)
+            return body
+        if hasattr(body, "close"):
+            body.close()
+        headers = [(k, v) for k, v in headers if k.lower() not in dropped_headers]
+        try:
+            fsize = file_path.stat().st_size
+        except OSError:
+            start_response("404 Not Found", [("Content-Length", "0")])
+            return [b""]
+        content_type = next(
+            (v for k, v in headers if k.lower() == "content-type"), "application/octet-stream"
+        )
+        ranges = None
+        if range_header := environ.get("HTTP_RANGE"):
+            try:
+                ranges = parse_range_header(range_header, fsize)
+            except RangeNotSatisfiable:
+                start_response(
+                    "416 Range Not Satisfiable",
+                    [("Content-Range", f"bytes */{fsize}"), ("Content-Length", "0")],
+                )
+                return [b""]
+        if ranges is None:
+            start_response("200 OK", headers + [("Content-Length", str(fsize))])
+            return self.wrap_file(environ, FileRange(file_path))
+        if len(ranges) == 1:
+            start, end = ranges[0]
+            start_response("206 Partial Content", headers + [
+                ("Content-Length", str(end - start + 1)),
+                ("Content-Range", f"bytes {start}-{end}/{fsize}"),
+            ])
+            return self.wrap_file(environ, FileRange(file_path, start, end - start + 1))
+        multipart = MultipartRanges(ranges, fsize, content_type)
+        headers = [(k, v) for k, v in headers if k.lower() != "content-type"]
+        start_response("206 Partial Content", headers + [
+            ("Content-Type", multipart.content_type_header),
+            ("Content-Length", str(multipart.content_length)),
+        ])
+        return multipart.iterator(
+            lambda start, length: iter_file_range(file_path, start, length)
+        )
+
+    def wrap_file(self, environ, file):
+        if file_wrapper := environ.get("wsgi.file_wrapper"):
+            return file_wrapper(file, 1024 * 1024)
+        return iter_closing(file)
+
+
+def iter_closing(file):
+    # the server closes the generator when the client hangs up
+    try:
+        while chunk := file.read(1024 * 1024):
+            yield chunk
+    finally:
+        file.close()
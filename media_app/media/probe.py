@@ -0,0 +1,115 @@
+from datetime import timedelta
+import json
+import subprocess
+from media.models import MediaProbe
+
+
+
+class PopenError(Exception):
+    pass
+
+def popen(*args):
+    p = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    out, err = p.communicate()
+    if p.returncode != 0:
+        raise PopenError(err)
+    return out
+
+
+def has_ffprobe():
+    try:
+        out = popen('ffprobe', '-version')
+        return True
+    except (PopenError, OSError):
+        return False
+
+def ffprobe(path):
+    out = popen('ffprobe', '-show_format', '-show_streams', '-of', 'json', path)
+    return json.loads(out.decode('utf-8'))
+
+
+def get_media_duration(data):
+    if "format" in data and "duration" in data["format"]:
+        duration = float(data["format"]["duration"])
+        delta = timedelta(seconds=round(duration, 0))
+        return delta
+
+
+def get_media_type(data):
+    has_audio = False
+    if 'format' in data and data['format'].get("format_name", "").startswith("image"):
+        return
+    if 'streams' in data:
+        for stream in data['streams']:
+            if stream.get('codec_type') == 'video':
+                # still images, e.g. cover art embedded next to an audio stream
+                if stream.get('disposition', {}).get('attached_pic'):
+                    continue
+                codec_name = stream.get('codec_name')
+                if isinstance(codec_name, str):
+                    if 'jpeg' in codec_name or 'jpg' in codec_name:
+                        continue
+                if codec_name in ('ansi', 'png', 'pictor', 'gif', 'bmp', 'svg', 'tiff', 'webp', ''):
+                    continue
+                return 'video'
+            elif stream.get('codec_type') == 'audio':
+                has_audio = True
+    if has_audio:
+        return 'audio'
+
+
+def get_stream(data, codec_type):
+    for stream in data.get("streams", ()):
+        if stream.get("codec_type") == codec_type and not stream.get("disposition", {}).get("attached_pic"):
+            return stream
+    return {}
+
+
+def get_int(data, key):
+    try:
+        return int(data[key])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def build_media_probe(fingerprint, data):
+    # the file name is the only part of the ffprobe output that is not
+    # determined by the content, drop it so moved files share the entry
+    data.get("format", {}).pop("filename", None)
+    media_format = data.get("format", {})
+    audio = get_stream(data, "audio")
+    video = get_stream(data, "video") if get_media_type(data) == "video" else {}
+    return MediaProbe(
+        fingerprint=fingerprint,
+        media_type=get_media_type(data) or "",
+        format_name=media_format.get("format_name", ""),
+        duration=get_media_duration(data),
+        bit_rate=get_int(media_format, "bit_rate"),
+        audio_codec=audio.get("codec_name", ""),
+        sample_rate=get_int(audio, "sample_rate"),
+        channels=get_int(audio, "channels"),
+        video_codec=video.get("codec_name", ""),
+        width=get_int(video, "width"),
+        height=get_int(video, "height"),
+        data=data,
+    )
+
+
+def build_container_probe(fingerprint, container):
+    return MediaProbe(
+        fingerprint=fingerprint,
+        media_type=container.media_type,
+        format_name=container.format_name,
+        duration=(
+            timedelta(seconds=round(container.duration, 0))
+            if container.duration is not None else None
+        ),
+        bit_rate=container.bit_rate,
+        audio_codec=container.audio_codec,
+        sample_rate=container.sample_rate,
+        channels=container.channels,
+        video_codec=container.video_codec,
+        width=container.width,
+        height=container.height,
+        data=container._asdict(),
+    )
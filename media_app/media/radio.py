@@ -0,0 +1,248 @@
+import asyncio
+import logging
+import ssl
+import threading
+from urllib.parse import urljoin, urlsplit
+from django.conf import settings
+from media.metrics import radio_upstream_errors
+
+
+logger = logging.getLogger(__name__)
+max_redirects = 5
+
+
+class RadioError(Exception):
+    pass
+
+
+async def open_url(url):
+    # Minimal HTTP/1.0 client: radio servers often answer "ICY 200 OK", which
+    # general purpose HTTP clients refuse to parse.
+    for _ in range(max_redirects + 1):
+        parts = urlsplit(url)
+        match parts.scheme:
+            case "http":
+                port, ssl_context = parts.port or 80, None
+            case "https":
+                port, ssl_context = parts.port or 443, ssl.create_default_context()
+            case _:
+                raise RadioError(f"unsupported scheme {parts.scheme!r}")
+        reader, writer = await asyncio.open_connection(parts.hostname, port, ssl=ssl_context)
+        target = parts.path or "/"
+        if parts.query:
+            target = f"{target}?{parts.query}"
+        writer.write(
+            f"GET {target} HTTP/1.0\r\n"
+            f"Host: {parts.netloc}\r\n"
+            "User-Agent: Django-Media-Player\r\n"
+            "Connection: close\r\n\r\n".encode("latin-1")
+        )
+        await writer.drain()
+        status_line = await reader.readline()
+        try:
+            status = int(status_line.split()[1])
+        except (IndexError, ValueError):
+            writer.close()
+            raise RadioError(f"bad status line {status_line!r}")
+        headers = {}
+        while line := await reader.readline():
+            if not line.strip():
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        if status in (301, 302, 303, 307, 308) and "location" in headers:
+            writer.close()
+            url = urljoin(url, headers["location"])
+            continue
+        if status >= 400:
+            writer.close()
+            raise RadioError(f"{url} returned {status}")
+        return reader, writer
+    raise RadioError(f"too many redirects for {url}")
+
+
+async def aiter_url(url, chunk_size):
+    reader, writer = await open_url(url)
+    try:
+        while chunk := await reader.read(chunk_size):
+            yield chunk
+    finally:
+        writer.close()
+
+
+_relay_loop = None
+_relays = {}
+_relays_lock = threading.Lock()
+_relay_loop_lock = threading.Lock()
+
+
+def get_relay_loop():
+    global _relay_loop
+    with _relay_loop_lock:
+        if _relay_loop is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(
+                target=loop.run_forever, name="media-radio-relay", daemon=True
+            ).start()
+            _relay_loop = loop
+    return _relay_loop
+
+
+class RadioRelay:
+    # One upstream connection per station feeding a ring of the most recent
+    # chunks; every listener keeps its own sequence number into the ring.
+    def __init__(self, url):
+        self.url = url
+        self.chunk_size = settings.MEDIA_RADIO_RELAY_CHUNK_SIZE
+        self.capacity = settings.MEDIA_RADIO_RELAY_BUFFER_CHUNKS
+        self.burst = min(settings.MEDIA_RADIO_RELAY_BURST_CHUNKS, self.capacity)
+        self.grace_period = settings.MEDIA_RADIO_RELAY_GRACE_PERIOD
+        self.slow_listener = settings.MEDIA_RADIO_RELAY_SLOW_LISTENER
+        self.chunks = [None] * self.capacity
+        self.head = 0
+        self.closed = False
+        self.listeners = 0
+        self.idle_generation = 0
+        self.waiters = []
+        self.lock = threading.Lock()
+        self.cond = threading.Condition(self.lock)
+        self.loop = get_relay_loop()
+        self.task = None
+
+    def start(self):
+        self.loop.call_soon_threadsafe(self._start_task)
+
+    def _start_task(self):
+        self.task = self.loop.create_task(self.run())
+
+    async def run(self):
+        try:
+            async for chunk in aiter_url(self.url, self.chunk_size):
+                self.publish(chunk)
+        except asyncio.CancelledError:
+            pass
+        except (OSError, RadioError) as e:
+            logger.warning("radio relay %s: %s", self.url, e)
+            radio_upstream_errors.inc()
+        finally:
+            self.close()
+
+    def publish(self, chunk):
+        with self.lock:
+            self.chunks[self.head % self.capacity] = chunk
+            self.head += 1
+            waiters, self.waiters = self.waiters, []
+            self.cond.notify_all()
+        for loop, event in waiters:
+            loop.call_soon_threadsafe(event.set)
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            waiters, self.waiters = self.waiters, []
+            self.cond.notify_all()
+        for loop, event in waiters:
+            loop.call_soon_threadsafe(event.set)
+        with _relays_lock:
+            if _relays.get(self.url) is self:
+                del _relays[self.url]
+
+    def add_listener(self):
+        with self.lock:
+            if self.closed:
+                return False
+            self.listeners += 1
+            return True
+
+    def remove_listener(self):
+        with self.lock:
+            self.listeners -= 1
+            if self.listeners > 0:
+                return
+            self.idle_generation += 1
+            generation = self.idle_generation
+        self.loop.call_soon_threadsafe(
+            self.loop.call_later, self.grace_period, self._stop_if_idle, generation
+        )
+
+    def _stop_if_idle(self, generation):
+        with self.lock:
+            if self.listeners > 0 or generation != self.idle_generation:
+                return
+            self.closed = True
+        if self.task is not None:
+            self.task.cancel()
+        self.close()
+
+    def start_position(self):
+        with self.lock:
+            return max(0, self.head - self.burst)
+
+    def next_chunk(self, position):
+        # called with self.lock held; a None position drops the listener
+        oldest = max(0, self.head - self.capacity)
+        if position < oldest:
+            if self.slow_listener == "drop":
+                return None, None
+            position = max(oldest, self.head - self.burst)
+        if position < self.head:
+            return position + 1, self.chunks[position % self.capacity]
+        return position, None
+
+    def iter_chunks(self):
+        position = self.start_position()
+        while True:
+            with self.cond:
+                position, chunk = self.next_chunk(position)
+                while chunk is None and position is not None and not self.closed:
+                    self.cond.wait()
+                    position, chunk = self.next_chunk(position)
+            if chunk is None:
+                return
+            yield chunk
+
+    async def aiter_chunks(self):
+        loop = asyncio.get_running_loop()
+        position = self.start_position()
+        while True:
+            event = None
+            with self.lock:
+                position, chunk = self.next_chunk(position)
+                if chunk is None and position is not None and not self.closed:
+                    event = asyncio.Event()
+                    self.waiters.append((loop, event))
+            if chunk is not None:
+                yield chunk
+            elif event is None:
+                return
+            else:
+                await event.wait()
+
+
+def join_relay(url):
+    with _relays_lock:
+        relay = _relays.get(url)
+        if relay is not None and relay.add_listener():
+            return relay
+        relay = RadioRelay(url)
+        relay.add_listener()
+        _relays[url] = relay
+    relay.start()
+    return relay
+
+
+def iter_relay(url):
+    relay = join_relay(url)
+    try:
+        yield from relay.iter_chunks()
+    finally:
+        relay.remove_listener()
+
+
+async def aiter_relay(url):
+    relay = join_relay(url)
+    try:
+        async for chunk in relay.aiter_chunks():
+            yield chunk
+    finally:
+        relay.remove_listener()
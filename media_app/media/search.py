@@ -0,0 +1,104 @@
+import re
+from django.db import connection
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+from media.models import Audio, Radio, Video
+
+
+word_ptrn = re.compile(r"\w+")
+# FTS5 rowid = media id * 4 + media type code, see migration 0008
+media_type_codes = {"audio": 1, "radio": 2, "video": 3}
+# bm25 column weights: media_type, media_id, title, description, tags
+rank_sql = "bm25(media_search, 0.0, 0.0, 10.0, 1.0, 5.0)"
+
+
+def has_search_index():
+    return connection.vendor == "sqlite"
+
+
+def build_match_query(text):
+    # Every word must match, the last one also as a prefix while typing.
+    words = word_ptrn.findall(text)
+    if not words:
+        return None
+    terms = [f'"{word}"' for word in words[:-1]]
+    terms.append(f'"{words[-1]}"*')
+    return " ".join(terms)
+
+
+def search_media(text, media_type=None, limit=20, offset=0):
+    match_query = build_match_query(text)
+    if match_query is None:
+        return []
+    sql = (
+        f"SELECT media_type, media_id, title, {rank_sql} AS rank "
+        "FROM media_search WHERE media_search MATCH %s"
+    )
+    if not has_search_index():
+        return search_media_fallback(text, media_type, limit, offset)
+    params = [match_query]
+    if media_type is not None:
+        # cheaper than comparing the stored media_type column
+        sql += " AND rowid %% 4 = %s"
+        params.append(media_type_codes[media_type])
+    sql += " ORDER BY rank LIMIT %s OFFSET %s"
+    params.extend((limit, offset))
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+
+
+def search_media_fallback(text, media_type, limit, offset):
+    results = []
+    for media_class in (Audio, Radio, Video):
+        name = media_class._meta.model_name
+        if media_type is not None and name != media_type:
+            continue
+        queryset = filter_search(media_class.objects.all(), text).order_by("title")
+        results.extend(
+            (name, media_id, title, None)
+            for media_id, title in queryset.values_list("id", "title")[: offset + limit]
+        )
+    return results[offset:offset + limit]
+
+
+def filter_search(queryset, text):
+    match_query = build_match_query(text)
+    if match_query is None:
+        return queryset
+    media_type = queryset.model._meta.model_name
+    if not has_search_index():
+        tag_ids = queryset.model.tags.through.objects.filter(
+            tag__title__icontains=text
+        ).values(f"{media_type}_id")
+        return queryset.filter(
+            Q(title__icontains=text) | Q(description__icontains=text) | Q(id__in=tag_ids)
+        )
+    return queryset.filter(
+        id__in=RawSQL(
+            "SELECT media_id FROM media_search WHERE media_search MATCH %s AND rowid %% 4 = %s",
+            (match_query, media_type_codes[media_type]),
+        )
+    )
+
+
+def get_tags_sql(media_type, media_id):
+    return (
+        f"(SELECT coalesce(group_concat(media_tag.title, ' '), '') FROM media_tag "
+        f"INNER JOIN media_{media_type}_tags ON media_{media_type}_tags.tag_id = media_tag.id "
+        f"WHERE media_{media_type}_tags.{media_type}_id = {media_id})"
+    )
+
+
+def rebuild_search_index():
+    with connection.cursor() as cursor:
+        cursor.execute("DELETE FROM media_search")
+        for media_type, code in media_type_codes.items():
+            cursor.execute(
+                "INSERT INTO media_search(rowid, media_type, media_id, title, description, tags) "
+                f"SELECT id * 4 + {code}, '{media_type}', id, title, description, "
+                f"{get_tags_sql(media_type, f'media_{media_type}.id')} FROM media_{media_type}"
+            )
+        cursor.execute("INSERT INTO media_search(media_search) VALUES ('optimize')")
+        cursor.execute("SELECT count(*) FROM media_search")
+        return cursor.fetchone()[0]
@@ -0,0 +1,161 @@
+from collections import Counter
+from datetime import timedelta
+from django.db.models import F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from media.models import MediaPlayStat, PlayEvent, Tag, TagPlayStat
+
+
+periods = {
+    "hour": lambda value: value.replace(minute=0, second=0, microsecond=0),
+    "day": lambda value: value.replace(hour=0, minute=0, second=0, microsecond=0),
+}
+
+
+def get_media_type_name(media_class):
+    return media_class._meta.model_name
+
+
+def write_play_events(plays):
+    # plays is a list of (media_class, media_id, created); callers run this
+    # inside a transaction so events and rollups never disagree.
+    tag_ids = get_media_tag_ids(plays)
+    plays = [play for play in plays if (play[0], play[1]) in tag_ids]
+    PlayEvent.objects.bulk_create(
+        PlayEvent(created=created, media_type=get_media_type_name(media_class), media_id=media_id)
+        for media_class, media_id, created in plays
+    )
+    media_counts = Counter()
+    tag_counts = Counter()
+    for media_class, media_id, created in plays:
+        media_type = get_media_type_name(media_class)
+        for period, truncate in periods.items():
+            start = truncate(created)
+            media_counts[(period, start, media_type, media_id)] += 1
+            for tag_id in tag_ids[(media_class, media_id)]:
+                tag_counts[(period, start, tag_id)] += 1
+    add_play_stats(
+        MediaPlayStat,
+        [
+            (dict(period=period, start=start, media_type=media_type, media_id=media_id), count)
+            for (period, start, media_type, media_id), count in media_counts.items()
+        ],
+    )
+    add_play_stats(
+        TagPlayStat,
+        [
+            (dict(period=period, start=start, tag_id=tag_id), count)
+            for (period, start, tag_id), count in tag_counts.items()
+        ],
+    )
+
+
+def get_media_tag_ids(plays):
+    # Maps every existing (media_class, media_id) of plays to its tag ids.
+    media_ids = {}
+    for media_class, media_id, _ in plays:
+        media_ids.setdefault(media_class, set()).add(media_id)
+    tag_ids = {}
+    for media_class, ids in media_ids.items():
+        for media_id in media_class.objects.filter(id__in=ids).values_list("id", flat=True):
+            tag_ids[(media_class, media_id)] = []
+        column = f"{get_media_type_name(media_class)}_id"
+        through = media_class.tags.through
+        for media_id, tag_id in through.objects.filter(**{f"{column}__in": ids}).values_list(
+            column, "tag_id"
+        ):
+            tag_ids[(media_class, media_id)].append(tag_id)
+    return tag_ids
+
+
+def add_play_stats(model, rows):
+    missing = []
+    for key, count in rows:
+        if model.objects.filter(**key).update(play_count=F("play_count") + count) == 0:
+            missing.append(model(play_count=count, **key))
+    model.objects.bulk_create(missing)
+
+
+def get_since(period, count):
+    return periods[period](timezone.now()) - timedelta(**{f"{period}s": count - 1})
+
+
+def get_play_count_subquery(media_class, since, period="day"):
+    return Coalesce(
+        Subquery(
+            MediaPlayStat.objects.filter(
+                period=period,
+                media_type=get_media_type_name(media_class),
+                media_id=OuterRef("pk"),
+                start__gte=since,
+            )
+            .values("media_id")
+            .annotate(total=Sum("play_count"))
+            .values("total")
+        ),
+        0,
+    )
+
+
+def get_top_media(media_class, since, period="day", limit=10):
+    # One grouped scan of the stats rows instead of a subquery per media row.
+    # Rows are taken up to a change of total so ties at the cut can be ordered
+    # by title, and rows of deleted media are skipped.
+    totals = (
+        MediaPlayStat.objects.filter(
+            period=period, media_type=get_media_type_name(media_class), start__gte=since
+        )
+        .values_list("media_id")
+        .annotate(total=Sum("play_count"))
+        .filter(total__gt=0)
+        .order_by("-total")
+    )
+    found = []
+    pending = {}
+    last_total = None
+    for media_id, total in totals.iterator():
+        if total != last_total and len(found) + len(pending) >= limit:
+            found += get_media_with_totals(media_class, pending)
+            pending = {}
+            if len(found) >= limit:
+                break
+        pending[media_id] = total
+        last_total = total
+    found += get_media_with_totals(media_class, pending)
+    found.sort(key=lambda media: (-media.recent_play_count, media.title))
+    return found[:limit]
+
+
+def get_media_with_totals(media_class, totals):
+    media = list(media_class.objects.filter(id__in=totals))
+    for item in media:
+        item.recent_play_count = totals[item.id]
+    return media
+
+
+def get_tag_play_counts(since, period="day"):
+    return (
+        Tag.objects.filter(tagplaystat__period=period, tagplaystat__start__gte=since)
+        .annotate(recent_play_count=Sum("tagplaystat__play_count"))
+        .order_by("-recent_play_count", "title")
+    )
+
+
+def get_play_counts_by_period(media_class, media_id, since, period="day"):
+    return list(
+        MediaPlayStat.objects.filter(
+            period=period,
+            media_type=get_media_type_name(media_class),
+            media_id=media_id,
+            start__gte=since,
+        )
+        .order_by("start")
+        .values_list("start", "play_count")
+    )
+
+
+def prune_play_events(events_before, hourly_before):
+    events = PlayEvent.objects.filter(created__lt=events_before).delete()[0]
+    hourly = MediaPlayStat.objects.filter(period="hour", start__lt=hourly_before).delete()[0]
+    hourly += TagPlayStat.objects.filter(period="hour", start__lt=hourly_before).delete()[0]
+    return events, hourly
@@ -0,0 +1,79 @@
+import gzip
+import hashlib
+import json
+from django.conf import settings
+from django.contrib.staticfiles.storage import StaticFilesStorage
+from django.core.files.base import ContentFile
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+compressible_extensions = (".css", ".html", ".js", ".json", ".map", ".svg", ".txt")
+# smaller files fit in a packet anyway
+min_compress_size = 256
+
+
+def calc_md5(file):
+    m = hashlib.md5()
+    while True:
+        data = file.read(65536)
+        if not data:
+            break
+        m.update(data)
+    return m.hexdigest()
+
+
+def compress(encoding, data):
+    match encoding:
+        case "gz":
+            return gzip.compress(data, compresslevel=9, mtime=0)
+        case "br":
+            return brotli.compress(data, quality=11) if brotli is not None else None
+        case _:
+            raise NotImplementedError()
+
+
+class Md5ManifestStaticFilesStorage(StaticFilesStorage):
+    # collectstatic hashes every file once and writes the hashes to
+    # MEDIA_STATIC_MANIFEST, the md5static tag loads it at startup. Text files
+    # also get .gz/.br variants next to them for gzip_static/brotli_static.
+
+    def post_process(self, paths, dry_run=False, **options):
+        if dry_run:
+            return
+        files = {}
+        for name in sorted(paths):
+            with self.open(name) as fh:
+                md5 = calc_md5(fh)
+            files[name] = dict(md5=md5, encodings=[])
+            if name.endswith(compressible_extensions):
+                files[name]["encodings"] = self.write_compressed(name)
+            yield name, name, True
+        self.write_manifest(files)
+
+    def write_compressed(self, name):
+        with self.open(name) as fh:
+            data = fh.read()
+        encodings = []
+        if len(data) < min_compress_size:
+            return encodings
+        for encoding in settings.MEDIA_STATIC_PRECOMPRESS:
+            compressed = compress(encoding, data)
+            variant = f"{name}.{encoding}"
+            if self.exists(variant):
+                self.delete(variant)
+            if compressed is None or len(compressed) >= len(data):
+                continue
+            self._save(variant, ContentFile(compressed))
+            encodings.append(encoding)
+        return encodings
+
+    def write_manifest(self, files):
+        name = settings.MEDIA_STATIC_MANIFEST
+        if self.exists(name):
+            self.delete(name)
+        content = json.dumps(dict(version=1, files=files), indent=1, sort_keys=True)
+        self._save(name, ContentFile(content.encode()))
@@ -0,0 +1,90 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import os
+import threading
+from django.conf import settings
+from django.core.handlers.asgi import ASGIHandler, ASGIRequest
+
+
+class FileRange:
+    # File-like object limited to ``length`` bytes from ``start``. It exposes
+    # ``fileno()`` so that ``wsgi.file_wrapper`` implementations (gunicorn,
+    # uwsgi) can hand the descriptor to ``os.sendfile`` instead of copying the
+    # data through Python; the bounded ``read`` keeps plain wrappers correct.
+    def __init__(self, path, start=0, length=None):
+        self.file = open(path, "rb", buffering=0)
+        self.file.seek(start)
+        self.remaining = length
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def read(self, size=-1):
+        if self.remaining is not None:
+            if size < 0 or size > self.remaining:
+                size = self.remaining
+            if size == 0:
+                return b""
+        data = self.file.read(size) if size >= 0 else self.file.readall()
+        if self.remaining is not None:
+            self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+def iter_file_range(path, start=0, length=None, chunk_size=1024 * 1024):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        position = start
+        end = None if length is None else start + length
+        while end is None or position < end:
+            size = chunk_size if end is None else min(chunk_size, end - position)
+            chunk = os.pread(fd, size, position)
+            if not chunk:
+                break
+            position += len(chunk)
+            yield chunk
+    finally:
+        os.close(fd)
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_io_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=settings.MEDIA_STREAM_IO_THREADS,
+                    thread_name_prefix="media-io",
+                )
+    return _executor
+
+
+async def aiter_file_range(path, start=0, length=None, chunk_size=ASGIHandler.chunk_size):
+    # Chunks default to the ASGI handler's own chunk size so the handler
+    # forwards them as-is instead of slicing (and copying) them again.
+    loop = asyncio.get_running_loop()
+    executor = get_io_executor()
+    fd = await loop.run_in_executor(executor, os.open, path, os.O_RDONLY)
+    try:
+        position = start
+        end = None if length is None else start + length
+        while end is None or position < end:
+            size = chunk_size if end is None else min(chunk_size, end - position)
+            chunk = await loop.run_in_executor(executor, os.pread, fd, size, position)
+            if not chunk:
+                break
+            position += len(chunk)
+            yield chunk
+    finally:
+        os.close(fd)
+
+
+def is_asgi_request(request):
+    return isinstance(request, ASGIRequest)
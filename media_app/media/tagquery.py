@@ -0,0 +1,144 @@
+import re
+from django.db.models import Q
+from media.models import Tag
+
+
+# expr := term ("|" term)* ; term := factor ("&" factor)* ;
+# factor := "!" factor | "(" expr ")" | tag title | '"' tag title '"'
+# "," is accepted as "|" for the older "@tags:a,b;" syntax. Quoted titles may
+# contain operators and keep their spaces, \" and \\ escape inside quotes.
+token_ptrn = re.compile(r'\s*(?:([()&|!,])|"((?:[^"\\]|\\.)*)"|([^()&|!,"]+))')
+escape_ptrn = re.compile(r"\\(.)")
+
+
+class TagQueryError(Exception):
+    pass
+
+
+def tokenize(text):
+    tokens = []
+    position = 0
+    text = text.rstrip()
+    while position < len(text):
+        m = token_ptrn.match(text, position)
+        if m is None:
+            if text[position:].lstrip().startswith('"'):
+                raise TagQueryError("missing closing quote")
+            raise TagQueryError(f"unexpected {text[position:]!r}")
+        operator, quoted, title = m.groups()
+        if operator is not None:
+            tokens.append("|" if operator == "," else operator)
+        elif quoted is not None:
+            tokens.append(("tag", escape_ptrn.sub(r"\1", quoted)))
+        else:
+            tokens.append(("tag", title.strip()))
+        position = m.end()
+    return tokens
+
+
+class Parser:
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.position = 0
+
+    def peek(self):
+        if self.position < len(self.tokens):
+            return self.tokens[self.position]
+        return None
+
+    def take(self):
+        token = self.peek()
+        self.position += 1
+        return token
+
+    def parse(self):
+        if not self.tokens:
+            raise TagQueryError("empty tag query")
+        node = self.parse_or()
+        if self.peek() is not None:
+            raise TagQueryError(f"unexpected {self.peek()!r}")
+        return node
+
+    def parse_or(self):
+        nodes = [self.parse_and()]
+        while self.peek() == "|":
+            self.take()
+            nodes.append(self.parse_and())
+        return nodes[0] if len(nodes) == 1 else ("or", nodes)
+
+    def parse_and(self):
+        nodes = [self.parse_not()]
+        while self.peek() == "&":
+            self.take()
+            nodes.append(self.parse_not())
+        return nodes[0] if len(nodes) == 1 else ("and", nodes)
+
+    def parse_not(self):
+        token = self.take()
+        match token:
+            case "!":
+                return ("not", self.parse_not())
+            case "(":
+                node = self.parse_or()
+                if self.take() != ")":
+                    raise TagQueryError("missing )")
+                return node
+            case ("tag", title):
+                return ("tag", title)
+            case None:
+                raise TagQueryError("unexpected end of tag query")
+            case _:
+                raise TagQueryError(f"unexpected {token!r}")
+
+
+def parse_tag_query(text):
+    return Parser(tokenize(text)).parse()
+
+
+def get_titles(node):
+    match node:
+        case ("tag", title):
+            return {title}
+        case ("not", child):
+            return get_titles(child)
+        case (_, children):
+            return set().union(*(get_titles(child) for child in children))
+
+
+def compile_tag_query(media_class, text):
+    # Every tag test is an IN subquery on the through table, driven by the
+    # (tag_id, media_id) index, so the result has no join rows to deduplicate.
+    # Tag ids are resolved with a single query, titles are not unique.
+    node = parse_tag_query(text)
+    tag_ids = {}
+    for title, tag_id in Tag.objects.filter(title__in=get_titles(node)).values_list("title", "id"):
+        tag_ids.setdefault(title, []).append(tag_id)
+    through = media_class.tags.through
+    column = f"{media_class._meta.model_name}_id"
+
+    def has_tags(ids):
+        if not ids:
+            return Q(pk__in=[])
+        return Q(pk__in=through.objects.filter(tag_id__in=ids).values(column))
+
+    def compile_node(node):
+        match node:
+            case ("tag", title):
+                return has_tags(tag_ids.get(title, []))
+            case ("not", child):
+                return ~compile_node(child)
+            case ("or", children) if all(child[0] == "tag" for child in children):
+                # a | b | c shares one subquery with tag_id IN (...)
+                return has_tags([tag_id for _, title in children for tag_id in tag_ids.get(title, [])])
+            case ("or", children):
+                q = Q()
+                for child in children:
+                    q |= compile_node(child)
+                return q
+            case ("and", children):
+                q = Q()
+                for child in children:
+                    q &= compile_node(child)
+                return q
+
+    return compile_node(node)
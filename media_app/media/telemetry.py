@@ -0,0 +1,155 @@
+import atexit
+from collections import Counter
+from datetime import timedelta
+import logging
+import os
+import threading
+from django.conf import settings
+from django.db import DatabaseError, close_old_connections
+from django.db.models import F
+from django.utils import timezone
+from media.db import write_atomic
+from media.stats import write_play_events
+
+
+logger = logging.getLogger(__name__)
+max_known_durations = 10000
+
+
+class TelemetryBuffer:
+    # Collects play counts and duration reports in memory and writes them as
+    # one transaction of F() updates every MEDIA_TELEMETRY_FLUSH_INTERVAL
+    # seconds. Every worker process keeps its own buffer, increments from
+    # different processes add up in the database.
+    def __init__(self, flush_interval, max_pending):
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.play_counts = Counter()
+        self.plays = []
+        self.durations = {}
+        self.known_durations = {}
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.thread = None
+        self.pid = None
+
+    def add_play(self, media_class, media_id):
+        with self.lock:
+            self.play_counts[(media_class, media_id)] += 1
+            if settings.MEDIA_PLAY_EVENTS:
+                self.plays.append((media_class, media_id, timezone.now()))
+            pending = len(self.play_counts) + len(self.durations)
+        self.schedule(pending)
+
+    def set_duration(self, media_class, media_id, duration):
+        key = (media_class, media_id)
+        with self.lock:
+            if self.known_durations.get(key) == duration:
+                return
+            self.durations[key] = duration
+            pending = len(self.play_counts) + len(self.durations)
+        self.schedule(pending)
+
+    def schedule(self, pending):
+        if self.thread is None or self.pid != os.getpid():
+            # the flush thread does not survive a fork of a preloaded app
+            with self.lock:
+                if self.thread is None or self.pid != os.getpid():
+                    self.pid = os.getpid()
+                    self.wakeup = threading.Event()
+                    self.thread = threading.Thread(
+                        target=self.run, name="media-telemetry", daemon=True
+                    )
+                    self.thread.start()
+        if pending >= self.max_pending:
+            self.wakeup.set()
+
+    def run(self):
+        while True:
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            try:
+                self.flush()
+            finally:
+                close_old_connections()
+
+    def flush(self):
+        with self.flush_lock:
+            with self.lock:
+                play_counts, self.play_counts = self.play_counts, Counter()
+                plays, self.plays = self.plays, []
+                durations, self.durations = self.durations, {}
+            if not play_counts and not durations:
+                return
+            try:
+                with write_atomic():
+                    self.write(play_counts, durations)
+                    if plays:
+                        write_play_events(plays)
+            except DatabaseError:
+                logger.exception("media telemetry flush failed, retrying later")
+                with self.lock:
+                    self.play_counts.update(play_counts)
+                    self.plays[:0] = plays
+                    for key, duration in durations.items():
+                        self.durations.setdefault(key, duration)
+                return
+            with self.lock:
+                if len(self.known_durations) + len(durations) > max_known_durations:
+                    self.known_durations.clear()
+                self.known_durations.update(durations)
+
+    def write(self, play_counts, durations):
+        # update() skips auto_now, updated is set like save() would
+        now = timezone.now()
+        grouped = {}
+        for (media_class, media_id), increment in play_counts.items():
+            grouped.setdefault((media_class, increment), []).append(media_id)
+        for (media_class, increment), media_ids in grouped.items():
+            media_class.objects.filter(id__in=media_ids).update(
+                play_count=F("play_count") + increment, updated=now
+            )
+        for (media_class, media_id), duration in durations.items():
+            value = timedelta(seconds=duration)
+            media_class.objects.filter(id=media_id).exclude(duration=value).update(
+                duration=value, updated=now
+            )
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_telemetry_buffer():
+    global _buffer
+    with _buffer_lock:
+        if _buffer is None:
+            _buffer = TelemetryBuffer(
+                settings.MEDIA_TELEMETRY_FLUSH_INTERVAL, settings.MEDIA_TELEMETRY_MAX_PENDING
+            )
+            if settings.MEDIA_TELEMETRY_FLUSH_ON_EXIT:
+                atexit.register(_buffer.flush)
+        return _buffer
+
+
+def record_play(media_class, media_id):
+    if settings.MEDIA_TELEMETRY_BUFFER:
+        get_telemetry_buffer().add_play(media_class, media_id)
+        return
+    with write_atomic():
+        media_class.objects.filter(id=media_id).update(
+            play_count=F("play_count") + 1, updated=timezone.now()
+        )
+        if settings.MEDIA_PLAY_EVENTS:
+            write_play_events([(media_class, media_id, timezone.now())])
+
+
+def record_duration(media_class, media_id, duration):
+    if settings.MEDIA_TELEMETRY_BUFFER:
+        get_telemetry_buffer().set_duration(media_class, media_id, duration)
+        return
+    value = timedelta(seconds=duration)
+    media_class.objects.filter(id=media_id).exclude(duration=value).update(
+        duration=value, updated=timezone.now()
+    )
@@ -1,4 +1,6 @@
 import hashlib
+import json
+import os
 import threading
 from os import path
 from django import template
@@ -9,13 +11,49 @@ register = template.Library()
 
 class StaticUrlCache(object):
     _md5_sum = {}
+    _manifest_mtime = None
     _lock = threading.Lock()
 
+    @classmethod
+    def get_manifest_mtime(cls):
+        try:
+            return os.stat(path.join(settings.STATIC_ROOT, settings.MEDIA_STATIC_MANIFEST)).st_mtime_ns
+        except OSError:
+            return None
+
+    @classmethod
+    def load_manifest(cls):
+        # written by collectstatic, see media.storage
+        mtime = cls.get_manifest_mtime()
+        try:
+            with open(path.join(settings.STATIC_ROOT, settings.MEDIA_STATIC_MANIFEST)) as fh:
+                files = json.load(fh)["files"]
+        except (OSError, ValueError, KeyError):
+            cls._manifest_mtime = mtime
+            return False
+        with cls._lock:
+            cls._manifest_mtime = mtime
+            cls._md5_sum = {
+                file: '%s%s?v=%s' % (settings.STATIC_URL, file, data["md5"][:8])
+                for file, data in files.items()
+            }
+        return True
+
+    @classmethod
+    def reload_manifest(cls):
+        # picks up a collectstatic run made while the server is up, returns
+        # the manifest mtime
+        mtime = cls.get_manifest_mtime()
+        if mtime != cls._manifest_mtime:
+            cls.load_manifest()
+        return mtime
+
     @classmethod
     def get_url(cls, file):
         try:
-            return cls._md5_sum[file]
+            value = cls._md5_sum[file]
         except KeyError:
+            # not in the manifest, hash it on first use
             with cls._lock:
                 try:
                     md5 = cls.calc_md5(path.join(settings.STATIC_ROOT, file))[:8]
@@ -23,7 +61,7 @@ class StaticUrlCache(object):
                 except IsADirectoryError:
                     value = settings.STATIC_URL + file
                 cls._md5_sum[file] = value
-                return value
+        return value
 
     @classmethod
     def calc_md5(cls, file_path):
@@ -39,4 +77,6 @@ class StaticUrlCache(object):
 
 @register.simple_tag
 def md5static(model_object):
-    return StaticUrlCache.get_url(model_object)
\ No newline at end of file
+    # the .gz/.br variants share the plain URL, nginx picks one by
+    # Accept-Encoding
+    return StaticUrlCache.get_url(model_object)
@@ -1,3 +1,1122 @@
-from django.test import TestCase
+import asyncio
+import contextlib
+from collections import Counter
+import gzip
+import hashlib
+import io
+import json
+import os
+import random
+import struct
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from pathlib import Path
+from wsgiref.util import setup_testing_defaults
+from unittest import mock
+from os import path
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from django.contrib.admin import site
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.wsgi import get_wsgi_application
+from django.utils import timezone
+from django.utils.http import http_date
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from media import metrics, radio
+from media.containers import ContainerInfo, read_container_info
+from media.jobs import (
+    backfill_media, claim_jobs, enqueue_media_job, enqueue_missing_backfills, get_claimable_jobs, purge_finished_jobs,
+    retry_failed_jobs, run_job,
+)
+from media.db import write_atomic
+from media.fingerprint import get_fingerprint, is_sampled_fingerprint, sample_block_size
+from media.http import MultipartRanges, RangeNotSatisfiable, if_range_matches, parse_range_header
+from media.management.commands.add_media import Command as AddMediaCommand, load_fingerprints, move_media_paths, remove_media_paths
+from media.library import get_global_id, split_global_id
+from media.models import Audio, MediaIndex, MediaJob, MediaPlayStat, MediaProbe, PlayEvent, Radio, Tag, Video
+from media.offload import OffloadApplication, get_sendfile_header
+from media.search import search_media
+from media.stats import write_play_events
+from media.streaming import FileRange, aiter_file_range
+from media.telemetry import TelemetryBuffer, record_duration, record_play
+from media.tagquery import TagQueryError, compile_tag_query
+from media.templatetags.md5static import StaticUrlCache
+from media.views import ViewPlayer
 
-# Create your tests here.
+
+# Samples recorded by the tests would be flushed at exit into the real
+# MEDIA_METRICS_DIR, MetricsTest turns them back on with a temporary one.
+metrics_off = override_settings(MEDIA_METRICS=False)
+
+
+def setUpModule():
+    metrics_off.enable()
+
+
+def tearDownModule():
+    metrics_off.disable()
+
+
+class AudioAdminQueryCountTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        tags = Tag.objects.bulk_create(Tag(title=f"tag {i:02d}") for i in range(20))
+        audio = Audio.objects.bulk_create(
+            Audio(title=f"track {i}", path=f"/home/test/{i}.mp3", md5_hex=f"{i:032x}")
+            for i in range(10000)
+        )
+        through = Audio.tags.through
+        through.objects.bulk_create(
+            through(audio_id=item.id, tag_id=tags[(item.id + offset) % len(tags)].id)
+            for item in audio
+            for offset in (0, 7)
+        )
+        cls.user = User.objects.create_superuser("admin", "admin@example.com", "admin")
+
+    def get_changelist_request(self, query=""):
+        request = RequestFactory().get(f"/admin/media/audio/{query}")
+        request.user = self.user
+        return request
+
+    def test_changelist_query_count_does_not_grow_with_rows(self):
+        model_admin = site._registry[Audio]
+        with self.assertNumQueries(5):
+            changelist = model_admin.get_changelist_instance(self.get_changelist_request())
+            rows = [model_admin.get_tags(audio) for audio in changelist.result_list]
+        self.assertEqual(len(rows), model_admin.list_per_page)
+        self.assertTrue(all(rows))
+        tags_filter = changelist.filter_specs[0]
+        self.assertEqual(len(tags_filter.lookup_choices), 20)
+
+    def test_tags_filter_choices_follow_filtered_rows(self):
+        model_admin = site._registry[Audio]
+        tag = Tag.objects.get(title="tag 00")
+        request = self.get_changelist_request(f"?tags__id__exact={tag.id}")
+        changelist = model_admin.get_changelist_instance(request)
+        choices = dict(changelist.filter_specs[0].lookup_choices)
+        self.assertIn(tag.id, choices)
+        self.assertEqual(len(choices), 3)
+
+
+class TagQueryTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        tags = {title: Tag.objects.create(title=title) for title in ("rock", "live", "jazz", "demo")}
+        cls.audio = {}
+        for title, tag_titles in (
+            ("rock live", ("rock", "live")),
+            ("rock", ("rock",)),
+            ("jazz", ("jazz",)),
+            ("jazz demo", ("jazz", "demo")),
+            ("untagged", ()),
+        ):
+            audio = Audio.objects.create(title=title, path=f"/home/test/{title}.mp3", md5_hex=title)
+            audio.tags.set([tags[tag_title] for tag_title in tag_titles])
+            cls.audio[title] = audio
+
+    def get_titles(self, query):
+        queryset = Audio.objects.filter(compile_tag_query(Audio, query))
+        return sorted(queryset.values_list("title", flat=True))
+
+    def test_operators(self):
+        self.assertEqual(self.get_titles("(rock & live) | jazz & !demo"), ["jazz", "rock live"])
+        self.assertEqual(self.get_titles("rock, jazz"), ["jazz", "jazz demo", "rock", "rock live"])
+        self.assertEqual(self.get_titles("!(rock | jazz)"), ["untagged"])
+        self.assertEqual(self.get_titles("rock & missing"), [])
+        self.assertEqual(self.get_titles("!missing"), sorted(self.audio))
+
+    def test_duplicate_tag_titles(self):
+        other_rock = Tag.objects.create(title="rock")
+        audio = Audio.objects.create(title="other rock", path="/home/test/other.mp3", md5_hex="other rock")
+        audio.tags.set([other_rock])
+        self.assertEqual(self.get_titles("rock & !live"), ["other rock", "rock"])
+        self.assertEqual(self.get_titles("rock | demo"), ["jazz demo", "other rock", "rock", "rock live"])
+
+    def test_quoted_titles(self):
+        for title in ("rock & roll", ' say "hi" ', "a;b"):
+            audio = Audio.objects.create(title=title, path=f"/home/test/{title}.mp3", md5_hex=title)
+            audio.tags.set([Tag.objects.create(title=title)])
+        self.assertEqual(self.get_titles('"rock & roll"'), ["rock & roll"])
+        self.assertEqual(self.get_titles('"rock & roll" | (jazz & !"demo")'), ["jazz", "rock & roll"])
+        self.assertEqual(self.get_titles(r'" say \"hi\" "'), [' say "hi" '])
+        self.assertEqual(self.get_titles('"say \\"hi\\""'), [])
+        self.assertEqual(self.get_titles('"a;b", rock'), ["a;b", "rock", "rock live"])
+        queryset, _ = site._registry[Audio].get_search_results(None, Audio.objects.all(), '@tags:"a;b";')
+        self.assertEqual(list(queryset.values_list("title", flat=True)), ["a;b"])
+
+    def test_syntax_errors(self):
+        for query in ("", "rock &", "(rock", "rock)", "& rock", '"rock', 'rock "live"', 'ro"ck'):
+            with self.assertRaises(TagQueryError):
+                compile_tag_query(Audio, query)
+
+
+class StaticManifestTest(SimpleTestCase):
+    def setUp(self):
+        self.static_root = tempfile.TemporaryDirectory()
+        self.addCleanup(self.static_root.cleanup)
+        self.addCleanup(setattr, StaticUrlCache, "_md5_sum", StaticUrlCache._md5_sum)
+        self.addCleanup(setattr, StaticUrlCache, "_manifest_mtime", StaticUrlCache._manifest_mtime)
+
+    def test_collectstatic_writes_manifest_and_variants(self):
+        with override_settings(STATIC_ROOT=self.static_root.name):
+            call_command("collectstatic", interactive=False, verbosity=0)
+            self.assertTrue(StaticUrlCache.load_manifest())
+            md5 = StaticUrlCache.calc_md5(path.join(self.static_root.name, "media/js/worker.js"))[:8]
+            self.assertEqual(
+                StaticUrlCache._md5_sum["media/js/worker.js"], f"/static/media/js/worker.js?v={md5}"
+            )
+            self.assertEqual(StaticUrlCache.get_url("media/js/worker.js"), f"/static/media/js/worker.js?v={md5}")
+            with open(path.join(self.static_root.name, "media/js/worker.js"), "rb") as fh:
+                data = fh.read()
+            with gzip.open(path.join(self.static_root.name, "media/js/worker.js.gz")) as fh:
+                self.assertEqual(fh.read(), data)
+
+
+class ViewPlayerTest(SimpleTestCase):
+    def setUp(self):
+        static_root = tempfile.TemporaryDirectory()
+        self.addCleanup(static_root.cleanup)
+        self.enterContext(override_settings(STATIC_ROOT=static_root.name))
+        call_command("collectstatic", interactive=False, verbosity=0)
+        self.addCleanup(setattr, StaticUrlCache, "_md5_sum", StaticUrlCache._md5_sum)
+        self.addCleanup(setattr, StaticUrlCache, "_manifest_mtime", StaticUrlCache._manifest_mtime)
+        self.addCleanup(setattr, ViewPlayer, "rendered", None)
+
+    def test_not_modified(self):
+        response = self.client.get("/media/player")
+        self.assertEqual(response.status_code, 200)
+        etag = response["ETag"]
+        response = self.client.get("/media/player", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+
+    def test_rendered_again_when_settings_change(self):
+        etag = self.client.get("/media/player")["ETag"]
+        with override_settings(STREAM_BACKEND_URL="http://127.0.0.1:9999"):
+            response = self.client.get("/media/player", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b"http://127.0.0.1:9999/media", response.content)
+
+
+class MetricsTest(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+        self.enterContext(override_settings(MEDIA_METRICS=True, MEDIA_METRICS_DIR=self.directory))
+        self.addCleanup(self.reset_store)
+
+    def reset_store(self):
+        with metrics.store.lock:
+            metrics.store.values = {}
+            metrics.store.dirty = False
+
+    def test_processes_are_summed_and_dead_gauges_dropped(self):
+        key = ("media_ingest_files_total", (("stage", "written"),))
+        before = metrics.collect().get(key, 0)
+        # pids above pid_max never exist
+        with open(self.directory / "99999999.json", "w") as fh:
+            json.dump(
+                [
+                    ["media_ingest_files_total", [["stage", "written"]], 5],
+                    ["media_streams_active", [["type", "audio"]], 3],
+                ],
+                fh,
+            )
+        metrics.ingest_files.inc("written", amount=2)
+        totals = metrics.collect()
+        self.assertEqual(totals[key], before + 2 + 5)
+        self.assertEqual(totals.get(("media_streams_active", (("type", "audio"),)), 0), 0)
+        # the exited process is merged once into the aggregate file
+        self.assertFalse((self.directory / "99999999.json").exists())
+        self.assertTrue((self.directory / metrics.aggregate_name).exists())
+        self.assertEqual(metrics.collect()[key], before + 2 + 5)
+        self.assertIn('media_ingest_files_total{stage="written"}', self.client.get("/metrics").content.decode())
+
+    def test_reused_pid_keeps_counters_of_the_exited_process(self):
+        key = ("media_ingest_files_total", (("stage", "queued"),))
+        with open(self.directory / f"{os.getpid()}.json", "w") as fh:
+            json.dump([["media_ingest_files_total", [["stage", "queued"]], 4]], fh)
+        metrics.store.flushed_pid = None
+        metrics.ingest_files.inc("queued")
+        metrics.store.flush()
+        self.assertEqual(dict(metrics.read_samples(self.directory / metrics.aggregate_name))[key], 4)
+        self.assertEqual(metrics.collect()[key], 5)
+
+    def test_stream_bytes_and_active_streams(self):
+        path = self.directory / "track.mp3"
+        path.write_bytes(b"x" * 5000)
+        audio = Audio.objects.create(
+            title="track", path=path.as_uri(), file_size=5000, md5_hex="metrics", duration=timedelta(seconds=1)
+        )
+        key = ("media_stream_bytes_total", (("type", "audio"),))
+        active = ("media_streams_active", (("type", "audio"),))
+        before = metrics.collect()
+        response = self.client.get(f"/media/media-file-stream/?type=audio&id={audio.id}")
+        self.assertEqual(metrics.collect().get(active, 0), before.get(active, 0) + 1)
+        self.assertEqual(len(b"".join(response.streaming_content)), 5000)
+        response.close()
+        after = metrics.collect()
+        self.assertEqual(after[key], before.get(key, 0) + 5000)
+        self.assertEqual(after.get(active, 0), before.get(active, 0))
+
+
+class AddMediaTest(TransactionTestCase):
+    def test_watch_events_are_case_sensitive(self):
+        for path in ("/home/music/Rock/a.mp3", "/home/music/rock/a.mp3", "/home/music/Rock2/a.mp3"):
+            Audio.objects.create(title="a", path=path, md5_hex=path)
+        with contextlib.redirect_stdout(io.StringIO()):
+            move_media_paths(Path("/home/music/Rock"), Path("/home/music/Metal"))
+        self.assertEqual(
+            sorted(Audio.objects.values_list("path", flat=True)),
+            ["/home/music/Metal/a.mp3", "/home/music/Rock2/a.mp3", "/home/music/rock/a.mp3"],
+        )
+        with contextlib.redirect_stdout(io.StringIO()):
+            remove_media_paths(Path("/home/music/Metal"))
+            remove_media_paths(Path("/home/music/ROCK"))
+        self.assertEqual(
+            sorted(Audio.objects.values_list("path", flat=True)),
+            ["/home/music/Rock2/a.mp3", "/home/music/rock/a.mp3"],
+        )
+
+    def test_probe_is_kept_after_move_and_verify(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        old_path, new_path = Path(directory.name, "a.mp3"), Path(directory.name, "b.mp3")
+        old_path.write_bytes(b"a" * 1000)
+        audio = Audio.objects.create(title="a", path=old_path.as_uri(), md5_hex="sampled:a")
+        probe = MediaProbe.objects.create(fingerprint="sampled:a", duration=timedelta(seconds=5))
+        old_path.rename(new_path)
+        with contextlib.redirect_stdout(io.StringIO()):
+            move_media_paths(old_path.as_uri(), new_path.as_uri())
+        self.assertEqual(Audio.objects.get(id=audio.id).get_probe(), probe)
+        updated = Audio.objects.get(id=audio.id).updated
+        with contextlib.redirect_stdout(io.StringIO()):
+            call_command("verify_fingerprints")
+        audio = Audio.objects.get(id=audio.id)
+        self.assertEqual(audio.md5_hex, hashlib.md5(b"a" * 1000).hexdigest())
+        self.assertGreater(audio.updated, updated)
+        self.assertEqual(audio.get_probe(), probe)
+        with mock.patch("media.jobs.ffprobe") as ffprobe:
+            backfill_media(MediaJob(kind="backfill", media_type="audio", media_id=audio.id))
+        ffprobe.assert_not_called()
+        self.assertEqual(MediaProbe.objects.count(), 1)
+        audio = Audio.objects.get(id=audio.id)
+        self.assertEqual((audio.file_size, audio.duration), (1000, timedelta(seconds=5)))
+
+    def ingest(self, file_path, rescan=False):
+        # process_file in this process, the forked workers of handle() would
+        # write into their own copy of the in-memory test database
+        command = AddMediaCommand()
+        command.skip_existing_paths = False
+        command.verbosity = 0
+        command.fingerprint_strategy = "md5"
+        command.fingerprints = {} if rescan else load_fingerprints()
+        command.results_queue = None
+        command.has_ffprobe = False
+        with mock.patch(
+            "media.management.commands.add_media.get_fingerprint",
+            side_effect=lambda *args: hashlib.md5(file_path.read_bytes()).hexdigest(),
+        ) as get_fingerprint:
+            command.process_file(file_path)
+        return get_fingerprint.called
+
+    def create_flac(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        file_path = Path(directory.name, "a.flac")
+        file_path.write_bytes(container_samples["flac"])
+        self.assertTrue(self.ingest(file_path))
+        return file_path, Audio.objects.get()
+
+    def test_unchanged_file_is_skipped(self):
+        file_path, audio = self.create_flac()
+        self.assertEqual(audio.duration, timedelta(seconds=10))
+        probe = MediaProbe.objects.get()
+        self.assertFalse(self.ingest(file_path))
+        self.assertEqual(Audio.objects.get().updated, audio.updated)
+        self.assertEqual(MediaProbe.objects.get().updated, probe.updated)
+
+    def test_changed_file_is_ingested_again(self):
+        file_path, audio = self.create_flac()
+        stat = file_path.stat()
+        os.utime(file_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        self.assertTrue(self.ingest(file_path))
+        self.assertGreater(Audio.objects.get().updated, audio.updated)
+        self.assertFalse(self.ingest(file_path))
+        with file_path.open("ab") as f:
+            f.write(bytes(100))
+        self.assertTrue(self.ingest(file_path))
+        audio = Audio.objects.get()
+        self.assertEqual(audio.file_size, len(container_samples["flac"]) + 100)
+        self.assertEqual(audio.md5_hex, hashlib.md5(file_path.read_bytes()).hexdigest())
+        self.assertEqual(MediaProbe.objects.count(), 2)
+
+    def test_deleted_media_is_ingested_again(self):
+        file_path, audio = self.create_flac()
+        audio.delete()
+        self.assertTrue(self.ingest(file_path))
+        self.assertEqual(Audio.objects.get().path, str(file_path))
+
+    def test_rescan_ingests_unchanged_files(self):
+        file_path, audio = self.create_flac()
+        self.assertTrue(self.ingest(file_path, rescan=True))
+        self.assertGreater(Audio.objects.get().updated, audio.updated)
+        self.assertEqual(MediaProbe.objects.count(), 1)
+
+    def test_unreadable_file_does_not_hang(self):
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(root.cleanup)
+        Path(root.name, "track.mp3").write_bytes(b"\0" * 1000)
+        os.symlink(Path(root.name, "missing.mp3"), Path(root.name, "dangling.mp3"))
+        output = io.StringIO()
+        errors = []
+
+        def run():
+            # forked workers print into their own copy of the buffer
+            with contextlib.redirect_stdout(output), contextlib.redirect_stderr(output):
+                try:
+                    call_command("add_media", root.name, batch_size=10)
+                except Exception as e:
+                    errors.append(e)
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        thread.join(60)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(errors, [])
+
+
+class ViewMediaStatsTest(TestCase):
+    def setUp(self):
+        tag = Tag.objects.create(title="rock")
+        self.audio = [
+            Audio.objects.create(title=f"track {i}", path=f"/home/test/{i}.mp3", md5_hex=f"stats {i}")
+            for i in range(3)
+        ]
+        self.audio[1].tags.add(tag)
+        now = timezone.now()
+        write_play_events(
+            [(Audio, self.audio[0].id, now)] * 2
+            + [(Audio, self.audio[1].id, now)] * 3
+            + [(Audio, self.audio[2].id, now - timedelta(days=3))]
+        )
+
+    def get_stats(self, **params):
+        return self.client.get("/media/media-stats/", dict(type="audio", **params)).json()
+
+    def test_hour_period(self):
+        data = self.get_stats(period="hour", count=1)
+        self.assertEqual(
+            [(media["title"], media["play_count"]) for media in data["media"]],
+            [("track 1", 3), ("track 0", 2)],
+        )
+        self.assertEqual([(tag["title"], tag["play_count"]) for tag in data["tags"]], [("rock", 3)])
+        # hour rows only, the day rows of the same plays are not added
+        data = self.get_stats(period="hour", count=48)
+        self.assertEqual(sum(media["play_count"] for media in data["media"]), 5)
+
+    def test_day_period_and_deleted_media(self):
+        data = self.get_stats(period="day", count=7)
+        self.assertEqual([media["title"] for media in data["media"]], ["track 1", "track 0", "track 2"])
+        self.audio[1].delete()
+        data = self.get_stats(period="day", count=7)
+        self.assertEqual([media["title"] for media in data["media"]], ["track 0", "track 2"])
+
+
+class FileStreamValidatorTest(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = Path(directory.name, "track.mp3")
+        self.path.write_bytes(b"a" * 1000)
+        self.audio = Audio.objects.create(
+            title="track", path=self.path.as_uri(), file_size=1000, md5_hex="0" * 32, duration=timedelta(seconds=1)
+        )
+        self.url = f"/media/media-file-stream/?type=audio&id={self.audio.id}"
+
+    def test_file_changed_in_place(self):
+        etag = self.client.get(self.url)["ETag"]
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.path.write_bytes(b"b" * 1200)
+        os.utime(self.path, ns=(1, 1))
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(self.url, HTTP_RANGE="bytes=0-9", HTTP_IF_RANGE=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b"".join(response.streaming_content), b"b" * 1200)
+
+    def test_sampled_fingerprint_is_not_used(self):
+        self.audio.md5_hex = "sampled:1234"
+        stat = self.path.stat()
+        self.assertEqual(self.audio.get_etag(stat), f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"')
+
+
+class HttpRangeTest(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = Path(directory.name, "track.mp3")
+        self.data = bytes(range(256)) * 4
+        self.path.write_bytes(self.data)
+        self.audio = Audio.objects.create(
+            title="track", path=self.path.as_uri(), file_size=1024, md5_hex="0" * 32, duration=timedelta(seconds=1)
+        )
+        self.url = f"/media/media-file-stream/?type=audio&id={self.audio.id}"
+
+    def test_parse_range_header(self):
+        self.assertEqual(parse_range_header("bytes=0-9", 100), [(0, 9)])
+        self.assertEqual(parse_range_header("bytes=-10", 100), [(90, 99)])
+        self.assertEqual(parse_range_header("bytes=-200", 100), [(0, 99)])
+        self.assertEqual(parse_range_header("bytes=90-", 100), [(90, 99)])
+        self.assertEqual(parse_range_header("bytes=90-500", 100), [(90, 99)])
+        # overlapping and adjacent ranges are merged, out of order ones sorted
+        self.assertEqual(parse_range_header("bytes=50-59, 0-9, 5-20, 21-30", 100), [(0, 30), (50, 59)])
+        self.assertEqual(parse_range_header("bytes=0-9,200-300", 100), [(0, 9)])
+
+    def test_parse_range_header_ignored(self):
+        for header in ("items=0-9", "bytes=", "bytes=a-b", "bytes=-", "bytes=9-0", "bytes=0-9;1-2"):
+            self.assertIsNone(parse_range_header(header, 100), header)
+        ranges = ",".join(f"{i * 2}-{i * 2}" for i in range(17))
+        self.assertIsNone(parse_range_header(f"bytes={ranges}", 100))
+        ranges = ",".join(f"{i * 2}-{i * 2}" for i in range(16))
+        self.assertEqual(len(parse_range_header(f"bytes={ranges}", 100)), 16)
+
+    def test_parse_range_header_not_satisfiable(self):
+        for header, size in (("bytes=100-", 100), ("bytes=-0", 100), ("bytes=-5", 0), ("bytes=200-300,100-", 100)):
+            with self.assertRaises(RangeNotSatisfiable, msg=header):
+                parse_range_header(header, size)
+
+    def test_if_range_matches(self):
+        self.assertTrue(if_range_matches('"abc"', '"abc"', 1000))
+        self.assertFalse(if_range_matches('"abd"', '"abc"', 1000))
+        self.assertFalse(if_range_matches('W/"abc"', '"abc"', 1000))
+        self.assertTrue(if_range_matches(http_date(1000), '"abc"', 1000.5))
+        self.assertFalse(if_range_matches(http_date(999), '"abc"', 1000))
+        self.assertFalse(if_range_matches("yesterday", '"abc"', 1000))
+
+    def test_single_range(self):
+        response = self.client.get(self.url, HTTP_RANGE="bytes=-24")
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response["Content-Range"], "bytes 1000-1023/1024")
+        self.assertEqual(b"".join(response.streaming_content), self.data[1000:])
+
+    def test_not_satisfiable(self):
+        response = self.client.get(self.url, HTTP_RANGE="bytes=2000-")
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response["Content-Range"], "bytes */1024")
+
+    def test_ignored_range_and_if_range_mismatch(self):
+        for headers in (dict(HTTP_RANGE="bytes=x-y"), dict(HTTP_RANGE="bytes=0-9", HTTP_IF_RANGE='"other"')):
+            response = self.client.get(self.url, **headers)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(b"".join(response.streaming_content), self.data)
+
+    def test_multipart_body(self):
+        response = self.client.get(self.url, HTTP_RANGE="bytes=0-9,100-109,105-119")
+        self.assertEqual(response.status_code, 206)
+        boundary = response["Content-Type"].removeprefix("multipart/byteranges; boundary=")
+        body = b"".join(response.streaming_content)
+        self.assertEqual(int(response["Content-Length"]), len(body))
+        expected = b""
+        for start, end in ((0, 9), (100, 119)):
+            expected += (
+                f"--{boundary}\r\nContent-Type: application/octet-stream\r\nContent-Range: bytes {start}-{end}/1024\r\n\r\n"
+            ).encode() + self.data[start:end + 1] + b"\r\n"
+        self.assertEqual(body, expected + f"--{boundary}--\r\n".encode())
+        multipart = MultipartRanges([(0, 9), (100, 119)], 1024, "audio/mpeg")
+        self.assertEqual(multipart.content_length, len(b"".join(multipart.iterator(
+            lambda start, length: [self.data[start:start + length]]
+        ))))
+
+
+    async def get_async(self, query, **headers):
+        response = await self.async_client.get(f"/media/async/media-file-stream/?{query}", headers=headers)
+        return response, b"".join([chunk async for chunk in response.streaming_content])
+
+    async def test_async_stream(self):
+        query = f"type=audio&id={self.audio.id}"
+        response, body = await self.get_async(query)
+        self.assertEqual((response.status_code, body), (200, self.data))
+        response, body = await self.get_async(f"gid={get_global_id('audio', self.audio.id)}")
+        self.assertEqual((response.status_code, body), (200, self.data))
+        response, body = await self.get_async(query, range="bytes=10-19")
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual((response["Content-Range"], body), ("bytes 10-19/1024", self.data[10:20]))
+        response, body = await self.get_async(query, range="bytes=0-9,100-109")
+        self.assertEqual(response.status_code, 206)
+        boundary = response["Content-Type"].removeprefix("multipart/byteranges; boundary=")
+        self.assertEqual(int(response["Content-Length"]), len(body))
+        parts = body.split(f"--{boundary}".encode())
+        self.assertEqual([part.split(b"\r\n\r\n", 1)[-1] for part in parts[1:]], [
+            self.data[0:10] + b"\r\n", self.data[100:110] + b"\r\n", b"--\r\n"
+        ])
+
+    async def test_aiter_file_range(self):
+        chunks = [chunk async for chunk in aiter_file_range(self.path, 5, 300, chunk_size=128)]
+        self.assertEqual([len(chunk) for chunk in chunks], [128, 128, 44])
+        self.assertEqual(b"".join(chunks), self.data[5:305])
+        chunks = [chunk async for chunk in aiter_file_range(self.path, 1000, chunk_size=16)]
+        self.assertEqual(chunks, [self.data[1000:1016], self.data[1016:]])
+
+
+def mp4_box(box_type, payload):
+    return struct.pack(">I4s", 8 + len(payload), box_type) + payload
+
+
+def ebml_element(element_id, data):
+    return element_id.to_bytes((element_id.bit_length() + 7) // 8, "big") + b"\x01" + len(data).to_bytes(7, "big") + data
+
+
+def ogg_page(header_type, granule, packet):
+    segments = [255] * (len(packet) // 255) + [len(packet) % 255]
+    return (
+        b"OggS\x00" + bytes([header_type]) + struct.pack("<q", granule) + b"serl" + bytes(8)
+        + bytes([len(segments)]) + bytes(segments) + packet
+    )
+
+
+# minimal files of every format read_container_info knows, all 10 s long
+# except the WAV file
+container_samples = dict(
+    mp3=b"".join(b"\xff\xfb\x90\x00" + bytes(413) for _ in range(10)),
+    flac=b"fLaC\x80\x00\x00\x22" + bytes(10)
+    + ((44100 << 44) | (1 << 41) | (15 << 36) | 441000).to_bytes(8, "big") + bytes(16),
+    ogg=ogg_page(0x02, 0, b"\x01vorbis" + bytes(4) + b"\x02" + struct.pack("<I", 44100) + bytes(14))
+    + ogg_page(0x04, 441000, bytes(100)),
+    wav=b"RIFF" + struct.pack("<I", 4 + 24 + 8 + 17640) + b"WAVE"
+    + b"fmt " + struct.pack("<IHHIIHH", 16, 1, 2, 44100, 176400, 4, 16)
+    + b"data" + struct.pack("<I", 17640) + bytes(17640),
+    avi=b"RIFF" + struct.pack("<I", 4 + 12 + 64) + b"AVI "
+    + b"LIST" + struct.pack("<I", 4 + 64) + b"hdrl"
+    + b"avih" + struct.pack("<I", 56) + struct.pack("<10I", 40000, 0, 0, 0, 250, 0, 1, 0, 640, 480) + bytes(16),
+    mp4=mp4_box(b"ftyp", b"M4A " + bytes(4))
+    + mp4_box(b"moov", mp4_box(b"mvhd", bytes(12) + struct.pack(">II", 1000, 10000) + bytes(80)) + mp4_box(b"trak", (
+        mp4_box(b"tkhd", bytes(84))
+        + mp4_box(b"mdia", mp4_box(b"hdlr", bytes(8) + b"soun" + bytes(12)) + mp4_box(b"minf", mp4_box(b"stbl", mp4_box(
+            b"stsd", bytes(4) + struct.pack(">I", 1)
+            + mp4_box(b"mp4a", bytes(16) + struct.pack(">HHHHI", 2, 16, 0, 0, 44100 << 16))
+        ))))
+    ))),
+    webm=ebml_element(0x1A45DFA3, ebml_element(0x4282, b"webm"))
+    + ebml_element(0x18538067, (
+        ebml_element(0x1549A966, ebml_element(0x2AD7B1, (1000000).to_bytes(3, "big")) + ebml_element(
+            0x4489, struct.pack(">d", 10000.0)
+        ))
+        + ebml_element(0x1654AE6B, (
+            ebml_element(0xAE, ebml_element(0x83, b"\x01") + ebml_element(0x86, b"V_VP9") + ebml_element(
+                0xE0, ebml_element(0xB0, (640).to_bytes(2, "big")) + ebml_element(0xBA, (480).to_bytes(2, "big"))
+            ))
+            + ebml_element(0xAE, ebml_element(0x83, b"\x02") + ebml_element(0x86, b"A_OPUS") + ebml_element(
+                0xE1, ebml_element(0xB5, struct.pack(">d", 48000.0)) + ebml_element(0x9F, b"\x02")
+            ))
+        ))
+    )),
+)
+
+
+class ContainerInfoTest(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = Path(directory.name, "file")
+
+    def read(self, data):
+        self.path.write_bytes(data)
+        return read_container_info(self.path)
+
+    def test_formats(self):
+        for name, expected in (
+            ("mp3", ContainerInfo("mp3", "audio", 4170 * 8 / 128000, "mp3", 44100, 2, 128000)),
+            ("flac", ContainerInfo("flac", "audio", 10, "flac", 44100, 2, 8 * len(container_samples["flac"]) // 10)),
+            ("ogg", ContainerInfo("ogg", "audio", 10, "vorbis", 44100, 2, 8 * len(container_samples["ogg"]) // 10)),
+            ("wav", ContainerInfo("wav", "audio", 0.1, "pcm", 44100, 2, 44100 * 32)),
+            ("avi", ContainerInfo("avi", "video", 10, width=640, height=480, bit_rate=8 * len(container_samples["avi"]) // 10)),
+            ("mp4", ContainerInfo("mp4", "audio", 10, "mp4a", 44100, 2, 8 * len(container_samples["mp4"]) // 10)),
+            ("webm", ContainerInfo(
+                "webm", "video", 10, "A_OPUS", 48000, 2, 8 * len(container_samples["webm"]) // 10, "V_VP9", 640, 480
+            )),
+        ):
+            with self.subTest(name):
+                self.assertEqual(self.read(container_samples[name]), expected)
+
+    def test_truncated(self):
+        for name, data in container_samples.items():
+            for length in range(1, min(len(data), 300)):
+                with self.subTest(name, length=length):
+                    info = self.read(data[:length])
+                    self.assertTrue(info is None or isinstance(info, ContainerInfo))
+        for name, length in (("flac", 20), ("ogg", 30), ("wav", 30), ("avi", 60), ("mp4", 40), ("webm", 60)):
+            with self.subTest(name, length=length):
+                self.assertIsNone(self.read(container_samples[name][:length]))
+
+    def test_corrupt(self):
+        rng = random.Random(0)
+        for name, data in container_samples.items():
+            for _ in range(200):
+                corrupt = bytearray(data[:1000])
+                for _ in range(rng.randint(1, 8)):
+                    corrupt[rng.randrange(len(corrupt))] = rng.randrange(256)
+                with self.subTest(name, data=bytes(corrupt[:100])):
+                    info = self.read(bytes(corrupt))
+                    self.assertTrue(info is None or isinstance(info, ContainerInfo))
+        self.assertIsNone(self.read(b"fLaC\x01" + bytes(100)))
+        self.assertIsNone(self.read(container_samples["mp4"][:16]))
+
+
+class FingerprintTest(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = Path(directory.name, "file")
+
+    def fingerprint(self, data, strategy):
+        self.path.write_bytes(data)
+        return get_fingerprint(self.path, strategy)
+
+    def test_full_hashes(self):
+        data = random.randbytes(10000)
+        self.assertEqual(self.fingerprint(data, "md5"), hashlib.md5(data).hexdigest())
+        self.assertEqual(self.fingerprint(data, "blake2b"), "blake2b:" + hashlib.blake2b(data).hexdigest())
+        self.assertEqual(self.fingerprint(b"", "md5"), hashlib.md5().hexdigest())
+        self.assertEqual(self.fingerprint(b"", "blake2b"), "blake2b:" + hashlib.blake2b().hexdigest())
+
+    def test_sampled(self):
+        small = random.randbytes(sample_block_size * 3)
+        self.assertEqual(self.fingerprint(small, "sampled"), hashlib.md5(small).hexdigest())
+        self.assertTrue(self.fingerprint(small + b"\0", "sampled").startswith("sampled:"))
+        data = bytearray(random.randbytes(sample_block_size * 4))
+        fingerprint = self.fingerprint(data, "sampled")
+        self.assertTrue(fingerprint.startswith("sampled:"))
+        self.assertEqual(self.fingerprint(data, "sampled"), fingerprint)
+        # every block and the size are part of the hash
+        for offset in (0, len(data) // 2, len(data) - 1):
+            changed = bytearray(data)
+            changed[offset] ^= 0xff
+            self.assertNotEqual(self.fingerprint(changed, "sampled"), fingerprint)
+        self.assertNotEqual(self.fingerprint(data + b"\0", "sampled"), fingerprint)
+        # bytes between the blocks are not read, verify_fingerprints catches those
+        changed = bytearray(data)
+        changed[sample_block_size + 1] ^= 0xff
+        self.assertEqual(self.fingerprint(changed, "sampled"), fingerprint)
+
+    def test_is_sampled_fingerprint(self):
+        self.assertTrue(is_sampled_fingerprint("sampled:ab"))
+        self.assertFalse(is_sampled_fingerprint("blake2b:ab"))
+        self.assertFalse(is_sampled_fingerprint(hashlib.md5().hexdigest()))
+
+
+class MediaJobTest(TestCase):
+    def create_audio(self, title, file_size=0):
+        return Audio.objects.create(
+            title=title, path=f"/home/{title}.mp3", file_size=file_size, md5_hex=title, duration=timedelta(seconds=1)
+        )
+
+    def test_enqueue_missing_backfills_counts_inserted_jobs(self):
+        queued = self.create_audio("queued")
+        self.create_audio("complete", file_size=1000)
+        enqueue_media_job("backfill", Audio, queued.id)
+        self.assertEqual(enqueue_missing_backfills(), 0)
+        self.create_audio("missing")
+        self.assertEqual(enqueue_missing_backfills(), 1)
+
+    def test_enqueue_does_not_write_known_jobs(self):
+        enqueue_media_job("backfill", Audio, 1)
+        with CaptureQueriesContext(connection) as queries:
+            enqueue_media_job("backfill", Audio, 1)
+        self.assertEqual(len(queries), 1)
+        self.assertTrue(queries[0]["sql"].startswith("SELECT"))
+        self.assertEqual(MediaJob.objects.count(), 1)
+
+    @override_settings(MEDIA_JOB_FINISHED_RETENTION=0)
+    def test_failed_backfill_is_not_queued_again(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        file_path = Path(directory.name, "unknown.mp3")
+        file_path.write_bytes(bytes(1000))
+        audio = Audio.objects.create(title="a", path=file_path.as_uri(), file_size=1000, md5_hex="a")
+        enqueue_media_job("backfill", Audio, audio.id)
+        with mock.patch("media.jobs.has_ffprobe", return_value=False):
+            self.assertFalse(run_job(claim_jobs("a", 1)[0], "a"))
+        self.assertEqual(MediaJob.objects.get().status, "failed")
+        purge_finished_jobs()
+        enqueue_media_job("backfill", Audio, audio.id)
+        self.assertEqual(MediaJob.objects.get().status, "failed")
+        self.assertEqual(retry_failed_jobs(), 1)
+        self.assertEqual(MediaJob.objects.get().status, "pending")
+
+    def test_claimers_never_share_a_job(self):
+        for i in range(4):
+            enqueue_media_job("backfill", Audio, i)
+        claimed = {}
+        calls = []
+
+        def get_racing_jobs(now):
+            calls.append(now)
+            if len(calls) == 2:
+                # worker b claims between the SELECT and the UPDATE of worker a
+                claimed["b"] = claim_jobs("b", 3)
+            return get_claimable_jobs(now)
+
+        with mock.patch("media.jobs.get_claimable_jobs", get_racing_jobs):
+            claimed["a"] = claim_jobs("a", 3)
+        self.assertEqual(len(claimed["b"]), 3)
+        self.assertEqual(claimed["a"], [])
+        claimed["a"] = claim_jobs("a", 3)
+        ids = [job.media_id for jobs in claimed.values() for job in jobs]
+        self.assertEqual(sorted(ids), [0, 1, 2, 3])
+        self.assertEqual(claim_jobs("c", 3), [])
+
+
+class SearchIndexTest(TestCase):
+    def setUp(self):
+        self.tag = Tag.objects.create(title="jazz")
+        self.audio = Audio.objects.create(title="blue moon", path="/home/test/moon.mp3", md5_hex="moon")
+        self.gid = get_global_id("audio", self.audio.id)
+
+    def search(self, text):
+        return [(media_type, media_id) for media_type, media_id, _, _ in search_media(text)]
+
+    def test_search_index_follows_changes(self):
+        self.assertEqual(self.search("blue mo"), [("audio", self.audio.id)])
+        self.audio.title = "red sun"
+        self.audio.save()
+        self.assertEqual(self.search("moon"), [])
+        self.assertEqual(self.search("sun"), [("audio", self.audio.id)])
+        self.audio.tags.add(self.tag)
+        self.assertEqual(self.search("jazz"), [("audio", self.audio.id)])
+        self.tag.title = "swing"
+        self.tag.save()
+        self.assertEqual(self.search("jazz"), [])
+        self.assertEqual(self.search("swing"), [("audio", self.audio.id)])
+        self.audio.tags.remove(self.tag)
+        self.assertEqual(self.search("swing"), [])
+        self.audio.delete()
+        self.assertEqual(self.search("sun"), [])
+
+    def test_media_index_follows_changes(self):
+        self.assertEqual(MediaIndex.objects.get(id=self.gid).title, "blue moon")
+        Audio.objects.filter(id=self.audio.id).update(title="red sun", play_count=3)
+        index = MediaIndex.objects.get(id=self.gid)
+        self.assertEqual((index.media_type, index.media_id, index.title, index.play_count), (
+            "audio", self.audio.id, "red sun", 3
+        ))
+        self.audio.tags.add(self.tag)
+        self.assertEqual(MediaIndex.objects.get(id=self.gid).tags, "jazz")
+        self.tag.title = "swing"
+        self.tag.save()
+        self.assertEqual(MediaIndex.objects.get(id=self.gid).tags, "swing")
+        self.audio.tags.clear()
+        self.assertEqual(MediaIndex.objects.get(id=self.gid).tags, "")
+        self.audio.delete()
+        self.assertFalse(MediaIndex.objects.filter(id=self.gid).exists())
+
+    def test_global_id(self):
+        for media_type in ("audio", "radio", "video"):
+            for media_id in (1, 2, 12345):
+                self.assertEqual(split_global_id(get_global_id(media_type, media_id)), (media_type, media_id))
+        for global_id in (0, 3, 4, -7, "x"):
+            with self.assertRaises(ValueError):
+                split_global_id(global_id)
+        results = self.client.get("/media/media-search/", dict(q="moon")).json()["results"]
+        self.assertEqual([result["gid"] for result in results], [self.gid])
+
+
+class MediaListApiTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        for i in range(7):
+            Audio.objects.create(
+                title="ab"[i % 2], path=f"/home/test/{i}.mp3", md5_hex=str(i), duration=timedelta(seconds=i // 3)
+            )
+        Radio.objects.create(title="a", path="http://radio.test/a", quality="h")
+        Video.objects.create(title="b", path="/home/test/b.mp4", md5_hex="b")
+
+    def get_pages(self, **query):
+        ids = []
+        cursor = None
+        while True:
+            response = self.client.get("/media/api/media/", dict(query, limit=1, cursor=cursor or ""))
+            self.assertEqual(response.status_code, 200)
+            data = response.json()
+            ids.extend(row[0] for row in data["rows"])
+            cursor = data["next"]
+            if cursor is None:
+                return ids
+
+    def test_keyset_pagination_with_ties(self):
+        for media_type, media_class in (("audio", Audio), ("all", MediaIndex)):
+            for order in ("title", "-title", "play_count", "duration", "-duration", "-id"):
+                with self.subTest(media_type, order=order):
+                    id_order = "-id" if order.startswith("-") else "id"
+                    expected = list(media_class.objects.order_by(order, id_order).values_list("id", flat=True))
+                    self.assertEqual(self.get_pages(type=media_type, order=order), expected)
+
+    def test_errors(self):
+        for query in (
+            dict(type="image"), dict(fields="path"), dict(order="path"), dict(limit="0"),
+            dict(type="all", tags="rock"), dict(type="audio", tags="rock &"), dict(cursor="x"),
+        ):
+            with self.subTest(**query):
+                response = self.client.get("/media/api/media/", query)
+                self.assertEqual(response.status_code, 400)
+                self.assertIn("error", response.json())
+
+
+class SqliteTransactionTest(TransactionTestCase):
+    def test_only_write_blocks_begin_immediate(self):
+        statements = []
+
+        def record(execute, sql, params, many, context):
+            statements.append(sql)
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(record):
+            with transaction.atomic():
+                Audio.objects.exists()
+            with write_atomic():
+                with write_atomic():
+                    Audio.objects.exists()
+            with transaction.atomic():
+                Audio.objects.exists()
+        self.assertEqual([sql for sql in statements if sql.startswith("BEGIN")], ["BEGIN", "BEGIN IMMEDIATE", "BEGIN"])
+
+
+class TelemetryTest(TestCase):
+    def setUp(self):
+        self.audio = Audio.objects.create(title="track", path="/home/test/track.mp3", md5_hex="track")
+        self.enterContext(override_settings(MEDIA_TELEMETRY_BUFFER=False, MEDIA_PLAY_EVENTS=False))
+
+    def assertUpdatedBumped(self, update):
+        old = timezone.now() - timedelta(days=1)
+        Audio.objects.filter(id=self.audio.id).update(updated=old)
+        update()
+        self.assertGreater(Audio.objects.get(id=self.audio.id).updated, old)
+
+    def test_updates_set_updated(self):
+        buffer = TelemetryBuffer(60, 1000)
+        for update in (
+            lambda: record_play(Audio, self.audio.id),
+            lambda: record_duration(Audio, self.audio.id, 10),
+            lambda: buffer.write(Counter({(Audio, self.audio.id): 2}), {}),
+            lambda: buffer.write(Counter(), {(Audio, self.audio.id): 20}),
+            lambda: self.client.post("/media/async/media-update-play-count/", dict(type="audio", id=self.audio.id)),
+            lambda: self.client.post(
+                "/media/async/media-update-duration/", dict(type="audio", id=self.audio.id, duration=30)
+            ),
+        ):
+            self.assertUpdatedBumped(update)
+        audio = Audio.objects.get(id=self.audio.id)
+        self.assertEqual((audio.play_count, audio.duration), (4, timedelta(seconds=30)))
+
+    def test_sync_and_async_duration_views_agree(self):
+        for url in ("/media/media-update-duration/", "/media/async/media-update-duration/"):
+            response = self.client.post(url, dict(type="audio", id=self.audio.id + 1, duration=30))
+            self.assertEqual(response.status_code, 200)
+            self.client.post(url, dict(type="audio", id=self.audio.id, duration=30))
+            old = timezone.now() - timedelta(days=1)
+            Audio.objects.filter(id=self.audio.id).update(updated=old)
+            # an unchanged duration is not written again
+            self.assertEqual(self.client.post(url, dict(type="audio", id=self.audio.id, duration=30)).status_code, 200)
+            self.assertEqual(Audio.objects.get(id=self.audio.id).updated, old)
+
+    @override_settings(MEDIA_PLAY_EVENTS=True)
+    async def test_async_play_writes_play_events(self):
+        for url in ("/media/media-update-play-count/", "/media/async/media-update-play-count/"):
+            response = await self.async_client.post(url, dict(type="audio", id=self.audio.id))
+            self.assertEqual(response.status_code, 200)
+        audio = await Audio.objects.aget(id=self.audio.id)
+        self.assertEqual(audio.play_count, 2)
+        self.assertEqual(await PlayEvent.objects.filter(media_type="audio", media_id=self.audio.id).acount(), 2)
+        stat = await MediaPlayStat.objects.aget(period="day", media_type="audio", media_id=self.audio.id)
+        self.assertEqual(stat.play_count, 2)
+
+
+class OffloadTest(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        # not ASCII, the header value has to carry the raw path bytes
+        self.path = Path(directory.name, "tëst ♫.mp3")
+        self.data = bytes(range(256)) * 4
+        self.path.write_bytes(self.data)
+        audio = Audio.objects.create(
+            title="track", path=self.path.as_uri(), file_size=1024, md5_hex="0" * 32, duration=timedelta(seconds=1)
+        )
+        self.query = f"type=audio&id={audio.id}"
+        self.application = OffloadApplication(get_wsgi_application())
+
+    def request(self, application, headers=None, file_wrapper=False):
+        environ = dict(
+            PATH_INFO="/media/media-file-stream/", QUERY_STRING=self.query, HTTP_HOST="testserver", **(headers or {})
+        )
+        setup_testing_defaults(environ)
+        if file_wrapper:
+            environ["wsgi.file_wrapper"] = lambda file, block_size: iter(lambda: file.read(block_size), b"")
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response.update(status=status, headers=dict(headers))
+
+        result = application(environ, start_response)
+        try:
+            body = b"".join(result)
+        finally:
+            if hasattr(result, "close"):
+                result.close()
+        return response["status"], response["headers"], body
+
+    def test_modes(self):
+        for mode in ("x-accel-redirect", "x-sendfile"):
+            with self.subTest(mode), override_settings(MEDIA_FILE_STREAM_MODE=mode):
+                status, headers, body = self.request(self.application)
+                self.assertEqual((status, headers["Content-Length"], body), ("200 OK", "1024", self.data))
+                self.assertNotIn(mode, {name.lower() for name in headers})
+                status, headers, body = self.request(self.application, dict(HTTP_RANGE="bytes=10-19"), True)
+                self.assertEqual((status, headers["Content-Range"], body), (
+                    "206 Partial Content", "bytes 10-19/1024", self.data[10:20]
+                ))
+                status, headers, body = self.request(self.application, dict(HTTP_RANGE="bytes=0-9,100-109"))
+                self.assertEqual(status, "206 Partial Content")
+                self.assertEqual(int(headers["Content-Length"]), len(body))
+                self.assertTrue(headers["Content-Type"].startswith("multipart/byteranges; boundary="))
+                self.assertIn(self.data[0:10] + b"\r\n", body)
+                self.assertIn(self.data[100:110] + b"\r\n", body)
+                status, headers, body = self.request(self.application, dict(HTTP_RANGE="bytes=2000-"))
+                self.assertEqual((status, headers["Content-Range"]), ("416 Range Not Satisfiable", "bytes */1024"))
+
+    def test_missing_file(self):
+        def application(environ, start_response):
+            start_response("200 OK", [("X-Sendfile", get_sendfile_header(str(self.path) + ".missing"))])
+            return [b""]
+
+        status, _, body = self.request(OffloadApplication(application))
+        self.assertEqual((status, body), ("404 Not Found", b""))
+
+    def test_file_is_closed(self):
+        closed = []
+        close = FileRange.close
+
+        def record_close(file):
+            closed.append(file)
+            close(file)
+
+        with override_settings(MEDIA_FILE_STREAM_MODE="x-sendfile"):
+            with mock.patch.object(FileRange, "close", record_close):
+                # the test file_wrapper leaves closing to the server
+                self.request(self.application, file_wrapper=True)
+                self.request(self.application)
+        self.assertEqual(len(closed), 1)
+
+
+class RadioUpstreamHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.server.connections += 1
+        self.send_response(200)
+        self.end_headers()
+        try:
+            while not self.server.stopped.is_set():
+                self.wfile.write(b"x" * 1024)
+                self.wfile.flush()
+                time.sleep(0.01)
+        except OSError:
+            pass
+        finally:
+            self.server.closed += 1
+
+    def log_message(self, format, *args):
+        pass
+
+
+class RadioRelayTest(SimpleTestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), RadioUpstreamHandler)
+        self.server.daemon_threads = True
+        self.server.connections = self.server.closed = 0
+        self.server.stopped = threading.Event()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.addCleanup(self.server.stopped.set)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/stream"
+        self.enterContext(override_settings(MEDIA_RADIO_RELAY_GRACE_PERIOD=0.2))
+
+    def wait_for(self, condition, timeout=5):
+        deadline = time.monotonic() + timeout
+        while not condition() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return condition()
+
+    def test_listeners_share_one_upstream(self):
+        listeners = [radio.iter_relay(self.url) for _ in range(3)]
+        for _ in range(5):
+            for listener in listeners:
+                self.assertTrue(next(listener))
+        self.assertEqual(self.server.connections, 1)
+        for listener in listeners:
+            listener.close()
+        # the upstream is closed once the grace period has passed
+        self.assertTrue(self.wait_for(lambda: self.url not in radio._relays))
+        self.assertTrue(self.wait_for(lambda: self.server.closed == 1))
+
+    async def test_async_listeners_share_one_upstream(self):
+        listeners = [radio.aiter_relay(self.url) for _ in range(2)]
+        listener = radio.iter_relay(self.url)
+        for _ in range(5):
+            for async_listener in listeners:
+                self.assertTrue(await anext(async_listener))
+            self.assertTrue(await asyncio.to_thread(next, listener))
+        self.assertEqual(self.server.connections, 1)
+        listener.close()
+        for async_listener in listeners:
+            await async_listener.aclose()
+        self.assertTrue(await asyncio.to_thread(self.wait_for, lambda: self.server.closed == 1))
+        self.assertNotIn(self.url, radio._relays)
+
+    def test_listener_within_grace_period_reuses_upstream(self):
+        listener = radio.iter_relay(self.url)
+        next(listener)
+        listener.close()
+        listener = radio.iter_relay(self.url)
+        next(listener)
+        self.assertEqual(self.server.connections, 1)
+        time.sleep(0.4)
+        self.assertIn(self.url, radio._relays)
+        listener.close()
+        self.assertTrue(self.wait_for(lambda: self.server.closed == 1))
+
+    def get_relay(self, slow_listener):
+        with override_settings(
+            MEDIA_RADIO_RELAY_BUFFER_CHUNKS=4,
+            MEDIA_RADIO_RELAY_BURST_CHUNKS=2,
+            MEDIA_RADIO_RELAY_SLOW_LISTENER=slow_listener,
+        ):
+            # not started, chunks are published by hand
+            relay = radio.RadioRelay(self.url)
+        relay.add_listener()
+        return relay
+
+    def test_slow_listener_skips_ahead(self):
+        relay = self.get_relay("skip")
+        chunks = relay.iter_chunks()
+        relay.publish(b"0")
+        self.assertEqual(next(chunks), b"0")
+        for i in range(1, 10):
+            relay.publish(str(i).encode())
+        # chunk 1 has left the ring, the listener continues at the burst
+        self.assertEqual([next(chunks), next(chunks)], [b"8", b"9"])
+        relay.close()
+        self.assertEqual(list(chunks), [])
+
+    def test_slow_listener_is_dropped(self):
+        relay = self.get_relay("drop")
+        chunks = relay.iter_chunks()
+        relay.publish(b"0")
+        self.assertEqual(next(chunks), b"0")
+        for i in range(1, 10):
+            relay.publish(str(i).encode())
+        self.assertEqual(list(chunks), [])
@@ -1,4 +1,5 @@
 from django.urls import path
+from media.api import ViewMediaList
 from media.views import *
 
 app_name = "media"
@@ -7,5 +8,11 @@ urlpatterns = [
     path(r"media-file-stream/", ViewMediaFileStream.as_view(), name="file-stream"),
     path(r"media-update-duration/", ViewMediaUpdateDuration.as_view(), name="update-duration"),
     path(r"media-update-play-count/", ViewMediaUpdatePlayCount.as_view(), name="update-play-count"),
+    path(r"media-stats/", ViewMediaStats.as_view(), name="stats"),
+    path(r"media-search/", ViewMediaSearch.as_view(), name="search"),
+    path(r"api/media/", ViewMediaList.as_view(), name="api-media-list"),
     path(r"player", ViewPlayer.as_view(), name="player"),
+    path(r"async/media-file-stream/", AsyncViewMediaFileStream.as_view(), name="async-file-stream"),
+    path(r"async/media-update-duration/", AsyncViewMediaUpdateDuration.as_view(), name="async-update-duration"),
+    path(r"async/media-update-play-count/", AsyncViewMediaUpdatePlayCount.as_view(), name="async-update-play-count"),
 ]
\ No newline at end of file
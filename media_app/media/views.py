@@ -1,65 +1,216 @@
+import asyncio
 from datetime import timedelta
+import hashlib
+import os
+import threading
+from asgiref.sync import sync_to_async
 from django.conf import settings
+from django.template.loader import get_template
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
 from django.views import View
 from django.http.request import HttpRequest
-from django.http.response import StreamingHttpResponse, JsonResponse, HttpResponse
+from django.http.response import FileResponse, StreamingHttpResponse, JsonResponse, HttpResponse
+from media.http import MultipartRanges, RangeNotSatisfiable, if_range_matches, parse_range_header
+from media.jobs import aenqueue_media_job, enqueue_media_job
+from media.library import get_global_id, get_media_key
+from media.metrics import duration_updates, instrument_stream, play_count_updates, render
 from media.models import Audio, Radio, Video
+from media.offload import get_accel_redirect_uri, get_sendfile_header
+from media.streaming import (
+    FileRange, aiter_file_range, get_io_executor, is_asgi_request, iter_file_range
+)
+from media.search import search_media
+from media.stats import get_play_counts_by_period, get_since, get_tag_play_counts, get_top_media
+from media.telemetry import record_duration, record_play
+from media.templatetags.md5static import StaticUrlCache
 
 
 Media = Audio | Radio | Video
 
 
+def needs_backfill(object: Audio | Video) -> bool:
+    return object.file_size == 0 or object.md5_hex == "" or object.duration == timedelta(0)
+
+
 class ViewBaseFileStream(View):
     content_type = "application/octet-stream"
 
-    def get(self, request: HttpRequest) -> StreamingHttpResponse:
+    def get(self, request: HttpRequest) -> HttpResponse:
         object = self.get_object()
         if object is None:
             return StreamingHttpResponse(iter([b""]))
-        response = StreamingHttpResponse(
+        stat = self.get_file_stat(object)
+        return instrument_stream(object._meta.model_name, self.get_response(object, stat))
+
+    def get_response(self, object: Media, stat: os.stat_result | None) -> HttpResponse:
+        request = self.request
+        if stat is None:
+            response = self.get_stream_response(object)
+            response = self.update_response_headers(object, response, stat)
+            return response
+        response = get_conditional_response(
+            request, etag=object.get_etag(stat), last_modified=int(stat.st_mtime)
+        )
+        if response is not None:
+            response = self.update_response_headers(object, response, stat)
+            return response
+        if settings.MEDIA_FILE_STREAM_MODE in ("x-accel-redirect", "x-sendfile"):
+            response = self.get_offload_response(object)
+            response = self.update_response_headers(object, response, stat)
+            return response
+        fsize = stat.st_size
+        ranges = None
+        range_header = request.headers.get("Range")
+        if_range = request.headers.get("If-Range")
+        if range_header is not None and (
+            if_range is None or if_range_matches(if_range, object.get_etag(stat), stat.st_mtime)
+        ):
+            try:
+                ranges = parse_range_header(range_header, fsize)
+            except RangeNotSatisfiable:
+                response = HttpResponse(status=416, content_type=self.content_type)
+                response["Content-Range"] = f"bytes */{fsize}"
+                response = self.update_response_headers(object, response, stat)
+                return response
+        if ranges is None:
+            response = self.get_range_response(object, 0, None, 200, self.content_type)
+            response["Content-Length"] = fsize
+        elif len(ranges) == 1:
+            start, end = ranges[0]
+            response = self.get_range_response(
+                object, start, end - start + 1, 206, self.content_type
+            )
+            response["Content-Length"] = end - start + 1
+            response["Content-Range"] = f"bytes {start}-{end}/{fsize}"
+        else:
+            multipart = MultipartRanges(ranges, fsize, self.content_type)
+            response = self.get_multipart_response(object, multipart)
+            response["Content-Length"] = multipart.content_length
+        response = self.update_response_headers(object, response, stat)
+        return response
+
+    def get_stream_response(self, object: Media) -> HttpResponse:
+        return StreamingHttpResponse(
             object.get_fd_iterator(),
             content_type=self.content_type,
         )
-        response = self.update_response_headers(object, response)
+
+    def get_offload_response(self, object: Media) -> HttpResponse:
+        response = HttpResponse(content_type=self.content_type)
+        path = object.get_processed_path()
+        match settings.MEDIA_FILE_STREAM_MODE:
+            case "x-accel-redirect":
+                response["X-Accel-Redirect"] = get_accel_redirect_uri(path)
+            case "x-sendfile":
+                response["X-Sendfile"] = get_sendfile_header(path)
+            case _:
+                raise NotImplementedError()
         return response
 
+    def get_range_response(
+        self, object: Media, start: int, length: int | None, status: int, content_type: str
+    ) -> HttpResponse:
+        match settings.MEDIA_FILE_STREAM_MODE:
+            case "iterator":
+                return StreamingHttpResponse(
+                    object.get_fd_iterator(start, length),
+                    status=status,
+                    content_type=content_type,
+                )
+            case "sendfile":
+                path = object.get_processed_path()
+                if is_asgi_request(self.request):
+                    return StreamingHttpResponse(
+                        aiter_file_range(path, start, length),
+                        status=status,
+                        content_type=content_type,
+                    )
+                response = FileResponse(
+                    FileRange(path, start, length),
+                    status=status,
+                    content_type=content_type,
+                )
+                response.block_size = object.chunk_size
+                return response
+            case _:
+                raise NotImplementedError()
+
+    def get_multipart_response(
+        self, object: Media, multipart: MultipartRanges
+    ) -> HttpResponse:
+        match settings.MEDIA_FILE_STREAM_MODE:
+            case "iterator":
+                content = multipart.iterator(object.get_fd_iterator)
+            case "sendfile":
+                path = object.get_processed_path()
+                if is_asgi_request(self.request):
+                    content = multipart.aiterator(
+                        lambda start, length: aiter_file_range(path, start, length)
+                    )
+                else:
+                    content = multipart.iterator(
+                        lambda start, length: iter_file_range(path, start, length, object.chunk_size)
+                    )
+            case _:
+                raise NotImplementedError()
+        return StreamingHttpResponse(
+            content,
+            status=206,
+            content_type=multipart.content_type_header,
+        )
+
     def get_object(self) -> Media:
         raise NotImplementedError()
 
+    def get_file_stat(self, object: Media) -> os.stat_result | None:
+        return None
+
     def update_response_headers(
-        self, object: Media, response: StreamingHttpResponse
-    ) -> StreamingHttpResponse:
+        self, object: Media, response: HttpResponse, stat: os.stat_result | None
+    ) -> HttpResponse:
         return response
 
 
 class ViewMediaFileStream(ViewBaseFileStream):
-    def get_object(self) -> Media | None:
-        media_id = self.request.GET.get("id")
-        media_type = self.request.GET.get("type")
+    def get_media_class(self) -> type[Media]:
+        media_type, _ = get_media_key(self.request.GET)
         match media_type:
             case "audio":
-                media_class = Audio
+                return Audio
             case "radio":
-                media_class = Radio
+                return Radio
             case "video":
-                media_class = Video
+                return Video
             case _:
                 raise NotImplementedError()
-        return media_class.objects.filter(id=media_id).first()
+
+    def get_object(self) -> Media | None:
+        _, media_id = get_media_key(self.request.GET)
+        return self.get_media_class().objects.filter(id=media_id).first()
+
+    def get_file_stat(self, object: Media) -> os.stat_result | None:
+        if isinstance(object, (Audio, Video)):
+            stat = object.get_processed_path().stat()
+            if needs_backfill(object):
+                enqueue_media_job("backfill", object.__class__, object.id)
+            return stat
+        elif isinstance(object, Radio):
+            return None
+        else:
+            raise NotImplementedError()
 
     def update_response_headers(
-        self, object: Media, response: StreamingHttpResponse
-    ) -> StreamingHttpResponse:
+        self, object: Media, response: HttpResponse, stat: os.stat_result | None
+    ) -> HttpResponse:
         if isinstance(object, (Audio, Video)):
-            fsize = object.get_processed_path().stat().st_size
-            if object.file_size == 0:
-                object.file_size = fsize
-                object.save()
             response["Accept-Ranges"] = "bytes"
-            response["Content-Length"] = fsize
-            response["Content-Range"] = f"bytes 0-{fsize - 1}/{fsize}"
+            response["ETag"] = object.get_etag(stat)
+            response["Last-Modified"] = http_date(stat.st_mtime)
+            response["Cache-Control"] = settings.MEDIA_CACHE_CONTROL[object._meta.model_name]
             return response
         elif isinstance(object, Radio):
+            response["Cache-Control"] = settings.MEDIA_CACHE_CONTROL["radio"]
             return response
         else:
             raise NotImplementedError()
@@ -67,52 +218,243 @@ class ViewMediaFileStream(ViewBaseFileStream):
 
 class ViewMediaUpdateDuration(View):
     def post(self, request: HttpRequest) -> JsonResponse:
-        media_id = request.POST.get("id")
-        media_type = request.POST.get("type")
+        media_type, media_id = get_media_key(request.POST)
         dur = request.POST.get("duration")
         if dur is None:
             return JsonResponse(dict(), status=400)
         duration = int(float(dur))
+        media_class = self.get_media_class(media_type)
+        if not media_id or not media_id.isdigit():
+            return JsonResponse(dict(), status=400)
+        record_duration(media_class, int(media_id), duration)
+        duration_updates.inc(media_class._meta.model_name)
+        return JsonResponse(dict(), status=200)
+
+    def get_media_class(self, media_type: str | None) -> type[Audio | Video]:
         match media_type:
             case "audio":
-                media_class = Audio
+                return Audio
             case "video":
-                media_class = Video
+                return Video
             case _:
                 raise NotImplementedError()
-        media = media_class.objects.get(id=media_id)
-        media.duration = timedelta(seconds=duration)
-        media.save()
-        return JsonResponse(dict(), status=200)
 
 
 class ViewMediaUpdatePlayCount(View):
     def post(self, request: HttpRequest) -> JsonResponse:
-        media_id = request.POST.get("id")
-        media_type = request.POST.get("type")
-        if media_id is None:
+        media_type, media_id = get_media_key(request.POST)
+        if media_id is None or not media_id.isdigit():
             return JsonResponse(dict(), status=400)
+        media_class = self.get_media_class(media_type)
+        record_play(media_class, int(media_id))
+        play_count_updates.inc(media_class._meta.model_name)
+        return JsonResponse(dict(), status=200)
+
+    def get_media_class(self, media_type: str | None) -> type[Media]:
         match media_type:
             case "audio":
-                media_class = Audio
+                return Audio
             case "radio":
-                media_class = Radio
+                return Radio
             case "video":
-                media_class = Video
+                return Video
             case _:
                 raise NotImplementedError()
-        media = media_class.objects.get(id=media_id)
-        media.play_count = media.play_count + 1
-        media.save()
+
+
+class AsyncViewMediaFileStream(ViewMediaFileStream):
+    async def get(self, request: HttpRequest) -> HttpResponse:
+        object = await self.aget_object()
+        if object is None:
+            return HttpResponse(b"")
+        stat = await self.aget_file_stat(object)
+        return instrument_stream(object._meta.model_name, self.get_response(object, stat))
+
+    async def aget_object(self) -> Media | None:
+        _, media_id = get_media_key(self.request.GET)
+        return await self.get_media_class().objects.filter(id=media_id).afirst()
+
+    async def aget_file_stat(self, object: Media) -> os.stat_result | None:
+        if isinstance(object, (Audio, Video)):
+            loop = asyncio.get_running_loop()
+            stat = await loop.run_in_executor(get_io_executor(), object.get_processed_path().stat)
+            if needs_backfill(object):
+                await aenqueue_media_job("backfill", object.__class__, object.id)
+            return stat
+        elif isinstance(object, Radio):
+            return None
+        else:
+            raise NotImplementedError()
+
+    def get_stream_response(self, object: Media) -> HttpResponse:
+        return StreamingHttpResponse(
+            object.aget_fd_iterator(),
+            content_type=self.content_type,
+        )
+
+    def get_range_response(
+        self, object: Media, start: int, length: int | None, status: int, content_type: str
+    ) -> HttpResponse:
+        return StreamingHttpResponse(
+            object.aget_fd_iterator(start, length),
+            status=status,
+            content_type=content_type,
+        )
+
+    def get_multipart_response(
+        self, object: Media, multipart: MultipartRanges
+    ) -> HttpResponse:
+        return StreamingHttpResponse(
+            multipart.aiterator(object.aget_fd_iterator),
+            status=206,
+            content_type=multipart.content_type_header,
+        )
+
+
+class AsyncViewMediaUpdateDuration(ViewMediaUpdateDuration):
+    async def post(self, request: HttpRequest) -> JsonResponse:
+        media_type, media_id = get_media_key(request.POST)
+        dur = request.POST.get("duration")
+        if dur is None:
+            return JsonResponse(dict(), status=400)
+        duration = int(float(dur))
+        media_class = self.get_media_class(media_type)
+        if not media_id or not media_id.isdigit():
+            return JsonResponse(dict(), status=400)
+        if settings.MEDIA_TELEMETRY_BUFFER:
+            record_duration(media_class, int(media_id), duration)
+        else:
+            await sync_to_async(record_duration)(media_class, int(media_id), duration)
+        duration_updates.inc(media_class._meta.model_name)
+        return JsonResponse(dict(), status=200)
+
+
+class AsyncViewMediaUpdatePlayCount(ViewMediaUpdatePlayCount):
+    async def post(self, request: HttpRequest) -> JsonResponse:
+        media_type, media_id = get_media_key(request.POST)
+        if media_id is None or not media_id.isdigit():
+            return JsonResponse(dict(), status=400)
+        media_class = self.get_media_class(media_type)
+        if settings.MEDIA_TELEMETRY_BUFFER:
+            # only touches memory, no need to leave the event loop
+            record_play(media_class, int(media_id))
+        else:
+            await sync_to_async(record_play)(media_class, int(media_id))
+        play_count_updates.inc(media_class._meta.model_name)
         return JsonResponse(dict(), status=200)
 
 
+class ViewMediaStats(View):
+    def get(self, request: HttpRequest) -> JsonResponse:
+        media_type = request.GET.get("type")
+        media_id = request.GET.get("id")
+        period = request.GET.get("period", "day")
+        count = request.GET.get("count", "7")
+        if period not in ("hour", "day") or not count.isdigit() or int(count) < 1:
+            return JsonResponse(dict(), status=400)
+        since = get_since(period, int(count))
+        media_class = self.get_media_class(media_type)
+        if media_id is not None:
+            if not media_id.isdigit():
+                return JsonResponse(dict(), status=400)
+            plays = get_play_counts_by_period(media_class, int(media_id), since, period)
+            return JsonResponse(
+                dict(plays=[dict(start=start, play_count=play_count) for start, play_count in plays])
+            )
+        return JsonResponse(
+            dict(
+                media=[
+                    dict(id=media.id, title=media.title, play_count=media.recent_play_count)
+                    for media in get_top_media(media_class, since, period)
+                ],
+                tags=[
+                    dict(id=tag.id, title=tag.title, play_count=tag.recent_play_count)
+                    for tag in get_tag_play_counts(since, period)
+                ],
+            )
+        )
+
+    def get_media_class(self, media_type: str | None) -> type[Media]:
+        match media_type:
+            case "audio":
+                return Audio
+            case "radio":
+                return Radio
+            case "video":
+                return Video
+            case _:
+                raise NotImplementedError()
+
+
+class ViewMediaSearch(View):
+    def get(self, request: HttpRequest) -> JsonResponse:
+        text = request.GET.get("q", "")
+        media_type = request.GET.get("type")
+        limit = request.GET.get("limit", "20")
+        offset = request.GET.get("offset", "0")
+        if media_type not in (None, "audio", "radio", "video"):
+            return JsonResponse(dict(), status=400)
+        if not limit.isdigit() or not offset.isdigit() or not 0 < int(limit) <= 100:
+            return JsonResponse(dict(), status=400)
+        results = search_media(text, media_type, int(limit), int(offset))
+        return JsonResponse(
+            dict(
+                results=[
+                    dict(
+                        gid=get_global_id(media_type, media_id),
+                        type=media_type,
+                        id=media_id,
+                        title=title,
+                        rank=rank,
+                    )
+                    for media_type, media_id, title, rank in results
+                ]
+            )
+        )
+
+
 class ViewPlayer(View):
+    # The page only depends on STREAM_BACKEND_URL, the template and the static
+    # hashes, so it is rendered once per version of those and revalidated by
+    # the shared worker's popups with If-None-Match.
+    template_name = "media/player.html"
+    # (version, content, etag)
+    rendered = None
+    lock = threading.Lock()
+
     def get(self, request: HttpRequest) -> HttpResponse:
-        from django.template.loader import render_to_string
+        version = self.get_version()
+        rendered = ViewPlayer.rendered
+        if rendered is None or rendered[0] != version:
+            with ViewPlayer.lock:
+                rendered = ViewPlayer.rendered
+                if rendered is None or rendered[0] != version:
+                    rendered = ViewPlayer.rendered = self.render(version)
+        _, content, etag = rendered
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = HttpResponse(content)
+        response["ETag"] = etag
+        response["Cache-Control"] = settings.MEDIA_PLAYER_CACHE_CONTROL
+        return response
+
+    def get_version(self) -> tuple:
+        template = get_template(self.template_name)
+        try:
+            template_mtime = os.stat(template.origin.name).st_mtime_ns
+        except OSError:
+            template_mtime = None
+        return (settings.STREAM_BACKEND_URL, template_mtime, StaticUrlCache.reload_manifest())
 
-        content = render_to_string(
-            "media/player.html", dict(stream_backend_url=settings.STREAM_BACKEND_URL)
+    def render(self, version: tuple) -> tuple:
+        content = get_template(self.template_name).render(
+            dict(stream_backend_url=settings.STREAM_BACKEND_URL)
         )
-        return HttpResponse(content)
+        return version, content, '"%s"' % hashlib.md5(content.encode()).hexdigest()
 
+
+class ViewMetrics(View):
+    def get(self, request: HttpRequest) -> HttpResponse:
+        if not settings.MEDIA_METRICS:
+            return HttpResponse(status=404)
+        return HttpResponse(render(), content_type="text/plain; version=0.0.4; charset=utf-8")
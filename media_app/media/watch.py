@@ -0,0 +1,215 @@
+import ctypes
+import ctypes.util
+import os
+from pathlib import Path
+import select
+import struct
+import time
+
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+watch_mask = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+event_header = struct.Struct("iIII")
+move_timeout = 1
+
+
+def iter_files(root):
+    if root.is_file():
+        yield root
+        return
+    for path, _, files in os.walk(root):
+        for fname in files:
+            yield Path(path) / fname
+
+
+class InotifyWatcher:
+    # Emits ("changed", path), ("removed", path) and ("moved", old, new)
+    # events, where removed and moved paths may also be directories.
+    def __init__(self, roots):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.inotify_add_watch = libc.inotify_add_watch
+        self.inotify_add_watch.argtypes = (ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32)
+        self.fd = libc.inotify_init1(os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.roots = roots
+        self.paths = {}
+        self.moves = {}
+        for root in roots:
+            self.add_tree(root)
+
+    def close(self):
+        os.close(self.fd)
+
+    def add_watch(self, path):
+        wd = self.inotify_add_watch(self.fd, os.fsencode(path), watch_mask)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"inotify_add_watch failed for {path}")
+        self.paths[wd] = path
+
+    def add_tree(self, root):
+        if not root.is_dir():
+            root = root.parent
+        for path, _, _ in os.walk(root):
+            self.add_watch(Path(path))
+
+    def rename_tree(self, old, new):
+        for wd, path in self.paths.items():
+            if path == old or old in path.parents:
+                self.paths[wd] = new / path.relative_to(old)
+
+    def read_events(self, timeout):
+        events = []
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if readable:
+            data = os.read(self.fd, 64 * 1024)
+            offset = 0
+            while offset < len(data):
+                wd, mask, cookie, length = event_header.unpack_from(data, offset)
+                name = data[offset + event_header.size:offset + event_header.size + length]
+                offset += event_header.size + length
+                self.handle_event(wd, mask, cookie, os.fsdecode(name.rstrip(b"\0")), events)
+        now = time.monotonic()
+        for cookie, (path, moved_at) in list(self.moves.items()):
+            if now - moved_at > move_timeout:
+                del self.moves[cookie]
+                events.append(("removed", path))
+        return events
+
+    def handle_event(self, wd, mask, cookie, name, events):
+        if mask & IN_Q_OVERFLOW:
+            for root in self.roots:
+                events.extend(("changed", path) for path in iter_files(root))
+            return
+        if mask & IN_IGNORED:
+            self.paths.pop(wd, None)
+            return
+        directory = self.paths.get(wd)
+        if directory is None:
+            return
+        path = directory / name
+        is_dir = mask & IN_ISDIR
+        if mask & IN_MOVED_FROM:
+            self.moves[cookie] = (path, time.monotonic())
+        elif mask & IN_MOVED_TO:
+            moved = self.moves.pop(cookie, None)
+            if moved is not None:
+                if is_dir:
+                    self.rename_tree(moved[0], path)
+                events.append(("moved", moved[0], path))
+            elif is_dir:
+                self.add_tree(path)
+                events.extend(("changed", file_path) for file_path in iter_files(path))
+            else:
+                events.append(("changed", path))
+        elif mask & IN_CREATE and is_dir:
+            # files created before the watch was added would be missed
+            self.add_tree(path)
+            events.extend(("changed", file_path) for file_path in iter_files(path))
+        elif mask & IN_DELETE:
+            events.append(("removed", path))
+        elif mask & (IN_CREATE | IN_MODIFY | IN_CLOSE_WRITE) and not is_dir:
+            events.append(("changed", path))
+
+
+class PollingWatcher:
+    def __init__(self, roots, interval):
+        self.roots = roots
+        self.interval = interval
+        self.snapshot = self.scan()
+        self.last_scan = time.monotonic()
+
+    def close(self):
+        pass
+
+    def scan(self):
+        snapshot = {}
+        for root in self.roots:
+            for path in iter_files(root):
+                try:
+                    stat = path.stat()
+                except OSError:
+                    continue
+                snapshot[path] = (stat.st_size, stat.st_mtime_ns, stat.st_ino)
+        return snapshot
+
+    def read_events(self, timeout):
+        remaining = self.interval - (time.monotonic() - self.last_scan)
+        if remaining > timeout:
+            time.sleep(timeout)
+            return []
+        time.sleep(max(remaining, 0))
+        snapshot = self.scan()
+        self.last_scan = time.monotonic()
+        events = []
+        removed = {
+            self.snapshot[path][2]: path for path in self.snapshot.keys() - snapshot.keys()
+        }
+        for path, fingerprint in snapshot.items():
+            previous = self.snapshot.get(path)
+            if previous == fingerprint:
+                continue
+            old_path = removed.pop(fingerprint[2], None) if previous is None else None
+            if old_path is not None:
+                events.append(("moved", old_path, path))
+            else:
+                events.append(("changed", path))
+        events.extend(("removed", path) for path in removed.values())
+        self.snapshot = snapshot
+        return events
+
+
+def create_watcher(roots, poll_interval=None):
+    if poll_interval is None:
+        try:
+            return InotifyWatcher(roots)
+        except (OSError, AttributeError):
+            poll_interval = 30
+    return PollingWatcher(roots, poll_interval)
+
+
+class Debouncer:
+    # Holds changed paths back until they have been quiet for ``delay``
+    # seconds and their size and mtime stopped changing.
+    def __init__(self, delay):
+        self.delay = delay
+        self.pending = {}
+
+    def touch(self, path):
+        self.pending[path] = (time.monotonic(), self.stat(path))
+
+    def discard(self, path):
+        for pending_path in list(self.pending):
+            if pending_path == path or path in pending_path.parents:
+                del self.pending[pending_path]
+
+    def stat(self, path):
+        try:
+            stat = path.stat()
+        except OSError:
+            return None
+        return (stat.st_size, stat.st_mtime_ns)
+
+    def ready(self):
+        now = time.monotonic()
+        paths = []
+        for path, (touched, stat) in list(self.pending.items()):
+            if now - touched < self.delay:
+                continue
+            current = self.stat(path)
+            if current is None:
+                del self.pending[path]
+            elif current != stat:
+                self.pending[path] = (now, current)
+            else:
+                del self.pending[path]
+                paths.append(path)
+        return paths
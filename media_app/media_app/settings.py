@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/5.0/ref/settings/
 """
 
 from pathlib import Path
+import tempfile
 from django.core.management.utils import get_random_secret_key
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -77,7 +78,7 @@ WSGI_APPLICATION = "media_app.wsgi.application"
 
 DATABASES = {
     "default": {
-        "ENGINE": "django.db.backends.sqlite3",
+        "ENGINE": "media.backends.sqlite3",
         "NAME": BASE_DIR / ".." / "db.sqlite3",
     }
 }
@@ -120,9 +121,108 @@ USE_TZ = True
 STATIC_URL = "static/"
 STATIC_ROOT = BASE_DIR / "static"
 
+STORAGES = {
+    "default": {"BACKEND": "django.core.files.storage.FileSystemStorage"},
+    "staticfiles": {"BACKEND": "media.storage.Md5ManifestStaticFilesStorage"},
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 STREAM_BACKEND_URL = "http://127.0.0.1:8080"
+
+# "iterator" streams files through Media.get_fd_iterator, "sendfile" hands the
+# open file to wsgi.file_wrapper (os.sendfile under gunicorn/uwsgi) and reads
+# fixed-size chunks on a bounded thread pool under ASGI. "x-accel-redirect"
+# (nginx) and "x-sendfile" (apache, lighttpd) only authorize the request and
+# leave the transfer to the front server.
+MEDIA_FILE_STREAM_MODE = "sendfile"
+# nginx: location /protected-media/ { internal; alias /; }
+MEDIA_ACCEL_REDIRECT_PREFIX = "/protected-media/"
+MEDIA_STREAM_IO_THREADS = 16
+
+# Share one upstream connection per radio station between all listeners.
+# Listeners that fall more than MEDIA_RADIO_RELAY_BUFFER_CHUNKS behind are
+# either moved ahead to the live edge ("skip") or disconnected ("drop").
+MEDIA_RADIO_RELAY = True
+MEDIA_RADIO_RELAY_CHUNK_SIZE = 1024 * 16
+MEDIA_RADIO_RELAY_BUFFER_CHUNKS = 256
+MEDIA_RADIO_RELAY_BURST_CHUNKS = 8
+MEDIA_RADIO_RELAY_GRACE_PERIOD = 10
+MEDIA_RADIO_RELAY_SLOW_LISTENER = "skip"
+
+# Content fingerprint stored in Audio/Video.md5_hex by add_media: "md5" (full
+# MD5, unprefixed), "blake2b" (full BLAKE2b) or "sampled" (size plus head,
+# middle and tail blocks, see the verify_fingerprints command).
+MEDIA_FINGERPRINT_STRATEGY = "md5"
+
+# Buffer play counts and duration reports in memory and write them in one
+# transaction of F() updates every MEDIA_TELEMETRY_FLUSH_INTERVAL seconds, or
+# sooner once MEDIA_TELEMETRY_MAX_PENDING rows are waiting. Unflushed counts
+# are lost on a crash, and on shutdown too unless MEDIA_TELEMETRY_FLUSH_ON_EXIT.
+MEDIA_TELEMETRY_BUFFER = True
+MEDIA_TELEMETRY_FLUSH_INTERVAL = 5
+MEDIA_TELEMETRY_MAX_PENDING = 1000
+MEDIA_TELEMETRY_FLUSH_ON_EXIT = True
+
+# Log every play in PlayEvent and keep hourly and daily MediaPlayStat and
+# TagPlayStat rollups up to date with it. prune_play_events deletes events and
+# hourly rollups older than these many days, daily rollups are kept.
+MEDIA_PLAY_EVENTS = True
+MEDIA_PLAY_EVENT_RETENTION_DAYS = 30
+MEDIA_PLAY_STAT_HOURLY_RETENTION_DAYS = 90
+
+# MediaJob queue processed by run_media_jobs. Failed jobs are retried after
+# MEDIA_JOB_RETRY_DELAY seconds, doubled on every attempt up to
+# MEDIA_JOB_MAX_RETRY_DELAY. Jobs running longer than MEDIA_JOB_LOCK_TIMEOUT
+# are assumed to belong to a dead worker and are claimed again. Done jobs are
+# kept for MEDIA_JOB_FINISHED_RETENTION seconds and block re-queueing, failed
+# jobs block it until run_media_jobs --retry-failed.
+MEDIA_JOB_MAX_ATTEMPTS = 5
+MEDIA_JOB_RETRY_DELAY = 30
+MEDIA_JOB_MAX_RETRY_DELAY = 60 * 60
+MEDIA_JOB_LOCK_TIMEOUT = 10 * 60
+MEDIA_JOB_FINISHED_RETENTION = 24 * 60 * 60
+
+# Cache-Control of media-file-stream responses per media type. File responses
+# also carry ETag (md5_hex, or mtime and size until it is known) and
+# Last-Modified and are answered with 304 when the client copy is current.
+MEDIA_CACHE_CONTROL = {
+    "audio": "private, max-age=86400",
+    "video": "private, max-age=86400",
+    "radio": "no-store",
+}
+
+# Cache-Control of the player page, which is rendered once and answered with
+# 304 while its ETag matches.
+MEDIA_PLAYER_CACHE_CONTROL = "no-cache"
+
+# Applied to every new SQLite connection. WAL lets the stream backend and the
+# views read while add_media writes; synchronous = NORMAL is durable in WAL mode
+# except for the last transactions on power loss. busy_timeout is in ms,
+# cache_size in KiB when negative.
+MEDIA_SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "busy_timeout": 10000,
+    "mmap_size": 256 * 1024 * 1024,
+    "cache_size": -64 * 1024,
+    "temp_store": "MEMORY",
+}
+
+# File -> md5 manifest written to STATIC_ROOT by collectstatic and loaded by
+# the md5static tag at startup. Files missing from it are hashed on first use.
+MEDIA_STATIC_MANIFEST = "md5static.json"
+# Precompressed variants written next to text static files, "br" needs the
+# brotli package and is skipped without it.
+MEDIA_STATIC_PRECOMPRESS = ("gz", "br")
+
+# Prometheus text metrics on /metrics. Every process, web workers and
+# add_media workers alike, writes its samples to MEDIA_METRICS_DIR every
+# MEDIA_METRICS_FLUSH_INTERVAL seconds and /metrics sums them. Counters of
+# exited processes are kept, empty the directory when deploying.
+MEDIA_METRICS = True
+MEDIA_METRICS_DIR = Path(tempfile.gettempdir()) / "media_app_metrics"
+MEDIA_METRICS_FLUSH_INTERVAL = 1
@@ -1,7 +1,9 @@
 from django.contrib import admin
 from django.urls import path, include
+from media.views import ViewMetrics
 
 urlpatterns = [
     path("admin/", admin.site.urls),
-    path("media/", include("media.urls"))
+    path("media/", include("media.urls")),
+    path("metrics", ViewMetrics.as_view(), name="metrics"),
 ]